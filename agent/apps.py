@@ -3,3 +3,20 @@ from django.apps import AppConfig
 class AgentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'agent'
+
+    def ready(self):
+        from agent.index_sync import INDEX_AUTOSYNC
+        if INDEX_AUTOSYNC:
+            from agent import signals  # noqa: F401  (registers Product -> vector index sync)
+
+        # Optional eager load (AGENT_WARMUP_MODELS=embedding,whisper); models load lazily otherwise.
+        from agent.model_registry import warm_up
+        warm_up()
+
+        # Embedding backend drift: a file read only. Re-embedding or measuring recall is an explicit
+        # step (load_embeddings.py --drift-action), not something every process does at boot.
+        try:
+            from agent.embedding_service import warn_on_backend_drift
+            warn_on_backend_drift()
+        except Exception as e:
+            print(f"[Agent] ⚠️ Embedding drift check skipped: {e}")
@@ -0,0 +1,80 @@
+# agent/catalog.py
+"""
+Turn products (from ``products_data.products`` or the Django ``Product``
+model) into ``(id, document, metadata)`` items for the vector index.
+
+Ids are stable across runs (model name for the static catalog, primary key
+for database rows) so incremental re-indexing can diff by content hash.
+Metadata carries the normalized numeric specs (``specs.normalize_specs``)
+so filters and comparisons never re-parse spec text at query time.
+"""
+import hashlib
+import json
+
+from agent.products_data import products
+from agent.specs import normalize_specs
+
+# Metadata keys that are bookkeeping, not product content
+INDEX_META_KEYS = ("source", "content_hash")
+
+
+def build_product_text(p):
+    details = [f"{k}: {v}" for k, v in p.items() if k not in ["stripe_price_id", "id"]]
+    return f"{p.get('name', p.get('model', 'Unknown Product'))} | " + " | ".join(details)
+
+
+def build_product_text_from_model(p) -> str:
+    # Use getattr to avoid static analysis errors and to gracefully handle missing attrs
+    parts = [
+        f"Name: {getattr(p, 'name', '') or ''}",
+        f"Model: {getattr(p, 'model', '') or ''}",
+        f"Category: {getattr(p, 'category', '') or ''}",
+        f"Processor: {getattr(p, 'processor', '') or ''}",
+        f"Memory: {getattr(p, 'memory', '') or ''}",
+        f"Storage: {getattr(p, 'storage', '') or ''}",
+        f"Display: {getattr(p, 'display', '') or ''}",
+        f"Graphics: {getattr(p, 'graphics', '') or ''}",
+        f"Cooling: {getattr(p, 'cooling', '') or ''}",
+        f"Features: {getattr(p, 'features', '') or ''}",
+        f"Price: {getattr(p, 'price', '') or ''}",
+    ]
+    # Remove empty segments and join
+    return " | ".join([seg for seg in parts if seg.split(": ", 1)[1].strip() != ""])
+
+
+def product_metadata_from_model(p):
+    # Chroma metadata values cannot be None
+    meta = {
+        "name": getattr(p, "name", "") or "",
+        "model": getattr(p, "model", "") or "",
+        "category": getattr(p, "category", "") or "",
+        "price": getattr(p, "price", 0) or 0,
+    }
+    meta.update(normalize_specs(p))
+    return meta
+
+
+def product_key(metadata):
+    """Identity of a retrieved product across backends (``model`` is unique per product)."""
+    return str(metadata.get("model") or metadata.get("name"))
+
+
+def content_hash(document, metadata):
+    """Hash of everything that ends up in the index for one product."""
+    meta = {k: v for k, v in metadata.items() if k not in INDEX_META_KEYS}
+    payload = document + "\x00" + json.dumps(meta, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def catalog_items(items=None):
+    """Items for the static catalog in ``products_data`` (source ``catalog``)."""
+    items = products if items is None else items
+    return [(f"product-{p['model']}", build_product_text(p), {**p, **normalize_specs(p)}) for p in items]
+
+
+def model_items(queryset):
+    """Items for Django ``Product`` rows (source ``db``), keyed by primary key."""
+    return [
+        (str(p.pk), build_product_text_from_model(p), product_metadata_from_model(p))
+        for p in queryset
+    ]
@@ -0,0 +1,417 @@
+# agent/chat_pipeline.py
+"""
+Steps of a single chat turn, shared by the sync, async and streaming chat views.
+
+Each step is a plain function so the sync view can call them in order and the
+async view can offload the blocking ones (embedding, Chroma, ORM) without
+duplicating the logic.
+"""
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+from asgiref.sync import sync_to_async
+
+from agent.casual_responses import casual_responses
+from agent.conversation_summary import history_context
+from agent.embedding_service import aembed_query
+from agent.llm_client import (
+    apost_chat_completion,
+    astream_chat_completion,
+    get_api_key,
+    post_chat_completion,
+)
+from agent.memory_manager import MEMORY_RECALL, add_memory, recall_memory
+from agent.memory_service import get_history, save_message
+from agent.metrics import StageTimings
+from agent.prompt_builder import build_prompt
+from agent.response_cache import SEMANTIC_CACHE_ENABLED, product_ids, response_cache
+from agent.retrieval import needs_query_embedding, retrieve
+
+# Pakistan timezone
+PAKISTAN_TZ = pytz.timezone("Asia/Karachi")
+
+# ---- Bounded executor for CPU-bound work (embedding forward pass, Chroma query) ----
+# Kept small on purpose: these steps saturate a core each, so more threads only add contention.
+CPU_WORKERS = int(os.getenv("AGENT_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="agent-cpu")
+
+
+async def run_in_cpu_executor(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, fn, *args)
+
+
+def query_similar_products_rag(user_message, n_results=3, query_emb=None):
+    """
+    Retrieve products similar to the user message from the configured
+    backend (``RETRIEVAL_BACKEND``) and mode (``RETRIEVAL_MODE``).
+
+    Pass ``query_emb`` to reuse an embedding the caller already computed.
+    """
+    return retrieve(user_message, n_results=n_results, query_emb=query_emb)[1]
+
+
+def fallback_response(user_message):
+    """
+    Simple fallback: try casual responses or generic message
+    """
+    lower_msg = user_message.lower()
+    for keyword, response in casual_responses.items():
+        if keyword in lower_msg:
+            return response
+    return "Sorry, I don't have information about that product. Please ask about available products or categories."
+
+
+def retrieve_product_context(user_message, query_emb=None):
+    """
+    Step 1: RAG lookup. Returns ``(query_emb, similar_products, product_context)``;
+    the embedding is handed back so the response cache can key on it. It is
+    None when hybrid retrieval answered from an exact model-name match.
+    """
+    try:
+        query_emb, similar_products = retrieve(user_message, n_results=3, query_emb=query_emb)
+    except Exception:
+        return None, [], ""
+    product_context = "\n".join([f"{meta['name']}: {doc}" for doc, meta in similar_products])
+    return query_emb, similar_products, product_context
+
+
+async def aretrieve_product_context(user_message):
+    """
+    ``retrieve_product_context`` for async turns. The query is embedded on the
+    event loop through the shared batcher, so concurrent misses share a forward
+    pass however few ``cpu_executor`` threads there are; only the search runs
+    on the executor.
+    """
+    query_emb = None
+    if needs_query_embedding(user_message):
+        try:
+            query_emb = await aembed_query(user_message, cpu_executor)
+        except Exception:
+            return None, [], ""
+    return await run_in_cpu_executor(retrieve_product_context, user_message, query_emb)
+
+
+def lookup_cached_reply(user_message, query_emb, similar_products):
+    """Returns ``(reply_text, lead_stage, emotion)`` from the semantic cache, or None."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    return response_cache.lookup(query_emb, product_ids(similar_products), text=user_message)
+
+
+def store_cached_reply(user_message, query_emb, similar_products, reply_text, lead_stage, emotion):
+    if SEMANTIC_CACHE_ENABLED and reply_text:
+        response_cache.store(query_emb, product_ids(similar_products), (reply_text, lead_stage, emotion),
+                             text=user_message)
+
+
+def recall_memory_context(session_id, query_emb, history):
+    """Older turns relevant to this message (see ``memory_manager.recall_memory``), or [] if none."""
+    if not MEMORY_RECALL:
+        return []
+    timestamps = [getattr(h, "timestamp", None) for h in history]
+    before = min(ts.timestamp() for ts in timestamps if ts) if any(timestamps) else None
+    try:
+        return recall_memory(session_id, query_emb=query_emb, before=before)
+    except Exception as e:
+        print(f"[ChatPipeline] Memory recall failed: {e}")
+        return []
+
+
+def build_llm_messages(session_id, user_message, product_context, query_emb=None):
+    """
+    Messages for the LLM call (see ``prompt_builder.build_prompt``): the static
+    system prompt first, then summary, memory, recent turns in their own
+    roles, products and the user message, each within its token budget.
+    """
+    # Bounded history: recent turns verbatim, older ones folded into the rolling summary
+    summary, history = history_context(session_id)
+    # The current message is already saved; it goes last, not in the history
+    if history and getattr(history[-1], "sender", "") == "user" and getattr(history[-1], "message", "") == user_message:
+        history = history[:-1]
+    memory = recall_memory_context(session_id, query_emb, history)
+    messages, _report = build_prompt(user_message, product_context, history=history, summary=summary, memory=memory)
+    return messages
+
+
+def remember_turn(session_id, user_message, reply_text, query_emb):
+    """Queue the turn for long-term memory, reusing the message embedding as its vector."""
+    if MEMORY_RECALL:
+        add_memory(user_message, reply_text, session_id, embedding=query_emb)
+
+
+def parse_llm_response(resp_json):
+    """Returns ``(reply_text, lead_stage, emotion)``; ``reply_text`` is None if the body has no choices."""
+    if "choices" not in resp_json:
+        return None, "cold", "neutral"
+    raw_reply = resp_json["choices"][0]["message"]["content"].strip()
+    return parse_llm_reply(raw_reply)
+
+
+def parse_llm_reply(raw_reply):
+    try:
+        parsed = json.loads(raw_reply.replace("'", '"'))
+        return parsed.get("reply", raw_reply), parsed.get("lead_stage", "warm"), parsed.get("emotion", "happy")
+    except (json.JSONDecodeError, AttributeError):
+        return raw_reply, "cold", "neutral"
+
+
+class ReplyStream:
+    """
+    Turns raw LLM deltas into the text to show while streaming.
+
+    The model is asked for a JSON object (see ``parse_llm_reply``), and
+    streaming that raw would show braces and keys in the chat bubble.
+    Plain-text answers pass through unchanged. For a JSON object only the
+    ``reply`` string is emitted, decoded as it arrives. The ``done`` event
+    still carries the parsed reply, which is authoritative.
+    """
+
+    _REPLY_KEY = re.compile(r"""["']reply["']\s*:\s*(["'])""")
+    _ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.raw = ""
+        self.mode = None   # "text" or "json", decided by the first non-space character
+        self.pos = None    # json: index in ``raw`` of the next reply character, once the key is seen
+        self.quote = None
+        self.closed = False
+        self.emitted = False
+        self.shown = ""    # everything emitted so far, i.e. what the client has on screen
+
+    def feed(self, delta):
+        self.raw += delta
+        if self.mode is None:
+            stripped = self.raw.lstrip()
+            if not stripped:
+                return ""
+            self.mode = "json" if stripped[0] == "{" else "text"
+            if self.mode == "text":
+                return self._emit(self.raw)
+        if self.mode == "text":
+            return self._emit(delta)
+        return self._emit(self._reply_chars())
+
+    def _emit(self, text):
+        self.emitted = self.emitted or bool(text)
+        self.shown += text
+        return text
+
+    def _reply_chars(self):
+        if self.closed:
+            return ""
+        if self.pos is None:
+            match = self._REPLY_KEY.search(self.raw)
+            if not match:
+                return ""
+            self.pos, self.quote = match.end(), match.group(1)
+        raw, i, out = self.raw, self.pos, []
+        while i < len(raw):
+            c = raw[i]
+            if c == "\\":
+                if i + 1 >= len(raw):
+                    break  # escape split across deltas
+                e = raw[i + 1]
+                if e == "u":
+                    if i + 6 > len(raw):
+                        break
+                    try:
+                        out.append(chr(int(raw[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                    continue
+                out.append(self._ESCAPES.get(e, e))
+                i += 2
+                continue
+            if c == self.quote:
+                self.closed = True
+                i += 1
+                break
+            out.append(c)
+            i += 1
+        self.pos = i
+        return "".join(out)
+
+
+def fallback_reply(user_message, similar_products):
+    """Step 3: reply when the LLM is unavailable or there is no product context."""
+    if similar_products:
+        # If RAG returned products but LLM failed, list them
+        reply_text = "Here are some products that might match your query:\n"
+        for doc, meta in similar_products:
+            reply_text += f"- {meta['name']} ({meta.get('model', 'N/A')}): ${meta.get('price', 'N/A')}\n"
+        return reply_text
+    # Casual/fallback response
+    return fallback_response(user_message)
+
+
+def serialize_message(h):
+    """``id`` is None for a message still in the write-behind buffer (see ``message_buffer``)."""
+    return {"id": getattr(h, "pk", None),
+            "sender": getattr(h, "sender", "unknown"),
+            "message": getattr(h, "message", ""),
+            "timestamp": getattr(h, "timestamp", datetime.now()).astimezone(PAKISTAN_TZ).strftime("%d-%m-%Y %I:%M:%S %p")}
+
+
+def serialize_history(session_id, limit=50):
+    history = get_history(session_id, limit=limit)
+    return [serialize_message(h) for h in history]
+
+
+def run_chat_turn(session_id, user_message, timings=None):
+    """
+    Blocking chat turn, as served by ``views.chat_api``. Pass a
+    ``metrics.StageTimings`` to get per-step durations.
+    """
+    timings = timings or StageTimings()
+    with timings.stage("save_user"):
+        save_message(session_id, "user", user_message)
+
+    reply_text = None
+    lead_stage, emotion = "cold", "neutral"
+
+    with timings.stage("retrieve"):
+        query_emb, similar_products, product_context = retrieve_product_context(user_message)
+
+    # --- Step 2: Call LLM if context is available (unless a near-identical question was answered) ---
+    api_key = get_api_key()
+    with timings.stage("cache_lookup"):
+        cached = lookup_cached_reply(user_message, query_emb, similar_products) if api_key and product_context else None
+    if cached:
+        reply_text, lead_stage, emotion = cached
+    elif api_key and product_context:
+        try:
+            with timings.stage("prompt"):
+                messages = build_llm_messages(session_id, user_message, product_context, query_emb)
+            with timings.stage("llm"):
+                reply_text, lead_stage, emotion = parse_llm_response(post_chat_completion(messages, api_key))
+            store_cached_reply(user_message, query_emb, similar_products, reply_text, lead_stage, emotion)
+        except Exception:
+            reply_text = None
+
+    if not reply_text:
+        reply_text = fallback_reply(user_message, similar_products)
+
+    with timings.stage("save_reply"):
+        save_message(session_id, "agent", reply_text)
+        remember_turn(session_id, user_message, reply_text, query_emb)
+
+    with timings.stage("history"):
+        history = serialize_history(session_id)
+    return {"reply": reply_text, "lead_stage": lead_stage, "emotion": emotion, "history": history}
+
+
+async def arun_chat_turn(session_id, user_message, timings=None):
+    """
+    Non-blocking chat turn, as served by ``views.chat_api_async``.
+
+    The query embedding awaits the shared batcher and Chroma runs on
+    ``cpu_executor``; ORM calls go through ``sync_to_async``; the LLM call
+    awaits the shared keep-alive client, so a slow completion holds no thread
+    at all.
+    """
+    timings = timings or StageTimings()
+    with timings.stage("save_user"):
+        await sync_to_async(save_message)(session_id, "user", user_message)
+
+    reply_text = None
+    lead_stage, emotion = "cold", "neutral"
+
+    with timings.stage("retrieve"):
+        query_emb, similar_products, product_context = await aretrieve_product_context(user_message)
+
+    api_key = get_api_key()
+    with timings.stage("cache_lookup"):
+        cached = lookup_cached_reply(user_message, query_emb, similar_products) if api_key and product_context else None
+    if cached:
+        reply_text, lead_stage, emotion = cached
+    elif api_key and product_context:
+        try:
+            with timings.stage("prompt"):
+                messages = await sync_to_async(build_llm_messages)(session_id, user_message, product_context, query_emb)
+            with timings.stage("llm"):
+                reply_text, lead_stage, emotion = parse_llm_response(await apost_chat_completion(messages, api_key))
+            store_cached_reply(user_message, query_emb, similar_products, reply_text, lead_stage, emotion)
+        except Exception:
+            reply_text = None
+
+    if not reply_text:
+        reply_text = fallback_reply(user_message, similar_products)
+
+    with timings.stage("save_reply"):
+        await sync_to_async(save_message)(session_id, "agent", reply_text)
+        remember_turn(session_id, user_message, reply_text, query_emb)
+
+    with timings.stage("history"):
+        history = await sync_to_async(serialize_history)(session_id)
+    return {"reply": reply_text, "lead_stage": lead_stage, "emotion": emotion, "history": history}
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def astream_chat_turn(session_id, user_message):
+    """
+    Streaming chat turn, as served by ``views.chat_stream_api``.
+
+    Yields SSE frames: ``token`` events with the reply text as the LLM
+    produces it (only the ``reply`` field when the model answers with a JSON
+    object, see ``ReplyStream``), then a single ``done`` event carrying the parsed ``reply``, ``lead_stage``,
+    ``emotion`` and ``history`` (the same fields ``chat_api`` returns). If the
+    LLM is unavailable the fallback reply is sent as a single token; if the
+    stream breaks off, the reply is the text streamed so far (or the fallback).
+    """
+    await sync_to_async(save_message)(session_id, "user", user_message)
+
+    reply_text = None
+    lead_stage, emotion = "cold", "neutral"
+
+    query_emb, similar_products, product_context = await aretrieve_product_context(user_message)
+
+    api_key = get_api_key()
+    cached = lookup_cached_reply(user_message, query_emb, similar_products) if api_key and product_context else None
+    if cached:
+        reply_text, lead_stage, emotion = cached
+        yield sse_event("token", {"text": reply_text})
+    elif api_key and product_context:
+        parts = []
+        stream = ReplyStream()
+        failed = False
+        try:
+            messages = await sync_to_async(build_llm_messages)(session_id, user_message, product_context, query_emb)
+            async for delta in astream_chat_completion(messages, api_key):
+                parts.append(delta)
+                text = stream.feed(delta)
+                if text:
+                    yield sse_event("token", {"text": text})
+        except Exception as e:
+            failed = True
+            print(f"[ChatPipeline] Streaming LLM call failed: {e}")
+        if parts:
+            if failed:
+                # The raw buffer is a truncated JSON object; keep what the client already shows
+                reply_text = stream.shown.strip() or None
+            else:
+                reply_text, lead_stage, emotion = parse_llm_reply("".join(parts).strip())
+                # Only a stream that reached [DONE] is a whole reply worth serving again
+                store_cached_reply(user_message, query_emb, similar_products, reply_text, lead_stage, emotion)
+            if reply_text and not stream.emitted:
+                yield sse_event("token", {"text": reply_text})  # JSON without a readable "reply" string
+
+    if not reply_text:
+        reply_text = fallback_reply(user_message, similar_products)
+        yield sse_event("token", {"text": reply_text})
+
+    await sync_to_async(save_message)(session_id, "agent", reply_text)
+    remember_turn(session_id, user_message, reply_text, query_emb)
+
+    yield sse_event("done", {"reply": reply_text, "lead_stage": lead_stage, "emotion": emotion,
+                             "history": await sync_to_async(serialize_history)(session_id)})
@@ -0,0 +1,193 @@
+# agent/conversation_summary.py
+"""
+Rolling per-session summary that keeps the chat prompt a fixed size.
+
+Each turn, the prompt gets the newest messages that fit in
+``HISTORY_TOKEN_BUDGET`` tokens verbatim (out of the last
+``HISTORY_WINDOW``), plus the session's summary, which is capped at
+``SUMMARY_TOKEN_BUDGET``. Every saved message older than the verbatim part
+is folded into the summary once, incrementally, whether it fell out over
+the token budget or slid past the window: the stored
+``ConversationSummary`` remembers the last message it covers, and only newer
+messages are folded in. The summary is never rebuilt from the whole
+conversation. Token counts come from ``agent.tokens.estimate_tokens``, so
+sizing the window needs no tokenizer and no network.
+
+``SUMMARY_MODE`` picks the summarizer:
+
+* ``extractive`` (default): one clipped line per folded message. The oldest
+  lines roll off when the summary would pass its budget. The turn that
+  triggers a fold computes the new summary inline (microseconds) for its
+  own prompt.
+* ``llm``: the chat model merges the new messages into the summary. It runs
+  on a background thread, so the turn that triggers a fold still sees the
+  previous summary. If the call fails, the extractive summarizer is used.
+
+Either way the ``ConversationSummary`` row is written by a background
+thread (``summary_executor``), never on the request path. Messages still
+in the write-behind buffer have no id yet, so they cannot be folded; they
+stay in the verbatim part until a later turn folds them.
+
+``CONVERSATION_SUMMARY=0`` restores the previous behaviour: the last 5
+messages, with no summary.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import takewhile
+
+from django.db import close_old_connections
+from django.db.models import Q
+
+from agent.llm_client import get_api_key, post_chat_completion
+from agent.memory_service import get_history
+from agent.models import ChatMessage, ConversationSummary
+from agent.tokens import clip_to_tokens, estimate_tokens
+
+CONVERSATION_SUMMARY = os.getenv("CONVERSATION_SUMMARY", "1") == "1"
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "400"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "250"))
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "extractive")
+# Messages read per turn to find the window boundary (served by the history cache)
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "20"))
+# Cap per folded message in extractive mode, so one long reply cannot push everything else out
+SUMMARY_LINE_TOKENS = 40
+LEGACY_HISTORY_MESSAGES = 5
+# Messages one background fold loads; a longer backlog drains over the next turns
+SUMMARY_FOLD_BATCH = 200
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a sales chat between a customer and an assistant. "
+    "Merge the new messages into the summary. Keep the customer's needs, budget, the products "
+    "and prices discussed, objections and agreed next steps; drop greetings and small talk. "
+    "Reply with the updated summary only, in under {words} words."
+)
+
+# One thread: folds for a session are applied in order
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+
+def format_message(m):
+    return f"{getattr(m, 'sender', 'unknown')}: {getattr(m, 'message', '')}"
+
+
+def split_history(messages, budget=HISTORY_TOKEN_BUDGET):
+    """``(older, recent)``: the newest messages that fit in ``budget`` tokens, and everything before them.
+
+    The newest message is always in ``recent``, even if it alone exceeds the budget.
+    """
+    used, cut = 0, len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        cost = estimate_tokens(format_message(messages[i])) + 1  # + the newline
+        if used + cost > budget and cut < len(messages):
+            break
+        used += cost
+        cut = i
+    return messages[:cut], messages[cut:]
+
+
+def render_history(messages, budget=HISTORY_TOKEN_BUDGET):
+    return clip_to_tokens("\n".join(format_message(m) for m in messages), budget)
+
+
+def fold_extractive(summary, messages, max_tokens=SUMMARY_TOKEN_BUDGET):
+    lines = summary.splitlines() if summary else []
+    lines += [clip_to_tokens(format_message(m), SUMMARY_LINE_TOKENS) for m in messages]
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    total = sum(costs)
+    start = 0
+    while total > max_tokens and start < len(lines) - 1:
+        total -= costs[start]
+        start += 1
+    return clip_to_tokens("\n".join(lines[start:]), max_tokens)
+
+
+def fold_llm(summary, messages, max_tokens=SUMMARY_TOKEN_BUDGET):
+    api_key = get_api_key()
+    if not api_key:
+        return fold_extractive(summary, messages, max_tokens)
+    new_lines = "\n".join(format_message(m) for m in messages)
+    prompt = [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=max(20, max_tokens * 3 // 4))},
+        {"role": "user", "content": f"Summary so far:\n{summary or '(empty)'}\n\nNew messages:\n{new_lines}"},
+    ]
+    try:
+        resp = post_chat_completion(prompt, api_key)
+        text = resp["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        print(f"[ConversationSummary] LLM summary failed, using extractive: {e}")
+        return fold_extractive(summary, messages, max_tokens)
+    return clip_to_tokens(text, max_tokens)
+
+
+SUMMARIZERS = {
+    "extractive": fold_extractive,
+    "llm": fold_llm,
+}
+
+
+def fold_messages(session_id, messages, mode=SUMMARY_MODE):
+    """Fold ``messages`` (oldest first, all saved) into the session's summary. Returns the summary text."""
+    record, _ = ConversationSummary.objects.get_or_create(session_id=session_id)
+    # Another fold may already have covered some of them
+    new = [m for m in messages if m.pk > record.last_message_id]
+    if not new:
+        return record.summary
+    record.summary = SUMMARIZERS[mode](record.summary, new)
+    record.last_message_id = new[-1].pk
+    record.folded_messages += len(new)
+    record.save(update_fields=["summary", "last_message_id", "folded_messages", "updated_at"])
+    return record.summary
+
+
+def fold_before(session_id, boundary, mode=SUMMARY_MODE):
+    """
+    Fold the saved messages not yet in the summary that come before
+    ``boundary``, the ``(timestamp, pk)`` of the first verbatim message
+    (``pk`` None if it is not written yet). Returns the summary text.
+    """
+    record = ConversationSummary.objects.filter(session_id=session_id).first()
+    ts, pk = boundary
+    qs = ChatMessage.objects.filter(session_id=session_id, pk__gt=record.last_message_id if record else 0)
+    qs = qs.filter(Q(timestamp__lt=ts) | Q(timestamp=ts, pk__lt=pk)) if pk is not None else qs.filter(timestamp__lt=ts)
+    messages = list(qs.order_by("timestamp", "pk")[:SUMMARY_FOLD_BATCH])
+    if not messages:
+        return record.summary if record else ""
+    return fold_messages(session_id, messages, mode)
+
+
+def _fold_in_background(session_id, boundary, mode):
+    try:
+        fold_before(session_id, boundary, mode)
+    except Exception as e:
+        print(f"[ConversationSummary] Background fold failed for {session_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def history_context(session_id, mode=SUMMARY_MODE):
+    """
+    ``(summary, recent)`` for this turn's prompt: the session's rolling summary
+    and the newest messages that fit in ``HISTORY_TOKEN_BUDGET``, oldest first.
+    ``recent`` can run over the budget while older messages are unflushed;
+    ``prompt_builder`` trims it.
+    """
+    if not CONVERSATION_SUMMARY:
+        return "", get_history(session_id, limit=LEGACY_HISTORY_MESSAGES)
+    if mode not in SUMMARIZERS:
+        raise ValueError(f"Unknown SUMMARY_MODE '{mode}' (expected one of {sorted(SUMMARIZERS)})")
+
+    window = get_history(session_id, limit=HISTORY_WINDOW)
+    record = ConversationSummary.objects.filter(session_id=session_id).first()
+    summary = record.summary if record else ""
+    history = [m for m in window if m.pk is None or m.pk > (record.last_message_id if record else 0)]
+    older, recent = split_history(history)
+    # Messages still in the write-behind buffer have no id yet: keep them verbatim, fold them on a later turn
+    foldable = list(takewhile(lambda m: m.pk is not None, older))
+    recent = older[len(foldable):] + recent
+    # A full window with nothing folded in it may have unfolded messages behind it (short turns never pass the budget)
+    behind = len(window) == HISTORY_WINDOW and len(history) == len(window)
+    if recent and (foldable or behind):
+        if mode == "extractive" and foldable:
+            summary = fold_extractive(summary, foldable)  # messages behind the window show up next turn
+        summary_executor.submit(_fold_in_background, session_id, (recent[0].timestamp, recent[0].pk), mode)
+    return summary, recent
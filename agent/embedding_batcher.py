@@ -0,0 +1,117 @@
+# agent/embedding_batcher.py
+"""
+Micro-batching executor for query embeddings.
+
+Concurrent chat requests each need one short query embedded. Run one by
+one, every request pays a full forward pass for a batch of one. The
+batcher queues those requests and one worker thread runs them together:
+it takes the first waiting query, keeps collecting for up to
+``EMBEDDING_BATCH_WINDOW_MS`` (or until ``EMBEDDING_MAX_BATCH`` queries),
+embeds the batch in a single call and hands each caller its own vector.
+Identical texts in flight at the same time share one slot.
+
+``stats()`` exposes batch-size and queue-wait histograms so the window can
+be tuned: a longer window gives larger batches but adds up to that much
+latency to a lone request.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from agent.metrics import Histogram
+
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "1") == "1"
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "3"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_WAIT_BUCKETS_MS = (0.5, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch=EMBEDDING_MAX_BATCH):
+        self.embed_fn = embed_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._pending = {}  # text -> Future, for texts queued but not yet embedded
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self.batches = 0
+        self.requests = 0
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, text):
+        """Queue ``text``; the returned future resolves to its float32 vector."""
+        with self._lock:
+            self.requests += 1
+            future = self._pending.get(text)
+            if future is not None:
+                return future
+            future = Future()
+            self._pending[text] = future
+            self._ensure_worker()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text, timeout=None):
+        return self.submit(text).result(timeout=timeout)
+
+    async def aembed(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            with self._lock:
+                for text in texts:
+                    self._pending.pop(text, None)
+            for _, _, queued_at in batch:
+                self.queue_wait_ms.observe((started - queued_at) * 1000.0)
+            self.batch_sizes.observe(len(batch))
+            self.batches += 1
+            try:
+                vectors = self.embed_fn(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), vec in zip(batch, vectors):
+                future.set_result(np.asarray(vec, dtype=np.float32))
+
+    def stats(self):
+        return {
+            "enabled": EMBEDDING_BATCHING,
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "requests": self.requests,
+            "batches": self.batches,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
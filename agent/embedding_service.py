@@ -1,71 +1,455 @@
 # agent/embedding_service.py
-import chromadb
-from chromadb.utils import embedding_functions
-from agent.products_data import products
-from .products_data import products
+import asyncio
+import atexit
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 
-# ---- Chroma Client Setup ----
-chroma_client = chromadb.PersistentClient(path="./product_db")
+import numpy as np
+from agent.catalog import build_product_text, catalog_items, content_hash
+from agent.embedding_batcher import EMBEDDING_BATCHING, EmbeddingBatcher
+from agent.model_registry import embedding_backend_id, get_collection, get_embedding_function, get_model
+from agent.products_data import products
 
 # ---- Embedding Function ----
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
+# Shared with memory_manager through the model registry; weights load on first call.
+embedding_fn = get_embedding_function()
 
 # ---- Collection Setup ----
-collection = chroma_client.get_or_create_collection(
-    name="product_embeddings",
-    embedding_function=embedding_fn  # type: ignore
-)
+# Opened on first use; workers that forward retrieval to the model server never open it.
+collection = get_collection("./product_db", "product_embeddings")
 
-def build_product_text(p):
-    details = [f"{k}: {v}" for k, v in p.items() if k not in ["stripe_price_id", "id"]]
-    return f"{p.get('name', p.get('model', 'Unknown Product'))} | " + " | ".join(details)
-from .products_data import products
+# ---- Index Version ----
+# Touched after every re-index so caches in other processes (web workers) can
+# notice the catalog changed without querying Chroma.
+INDEX_VERSION_FILE = os.path.join("./product_db", "index_version")
 
-def generate_embeddings():
-    print("[EmbeddingService] 🚀 Starting regeneration process...")
-    print(f"[EmbeddingService] 📦 Total products loaded: {len(products)}")
 
+def bump_index_version():
+    os.makedirs(os.path.dirname(INDEX_VERSION_FILE), exist_ok=True)
+    with open(INDEX_VERSION_FILE, "w") as f:
+        f.write(str(time.time_ns()))
+
+
+def current_index_version():
     try:
-       print("[EmbeddingService] 🗑 Attempting to clear old embeddings...")
-       collection.delete()  # ✅ This clears the entire collection safely
-       print("[EmbeddingService] ✅ Old embeddings cleared.")
-    except Exception as e:
-       print(f"[EmbeddingService] ⚠️ Failed to clear embeddings: {e}")
+        return os.stat(INDEX_VERSION_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+
+# ---- Query Embedding Cache ----
+# Bounded LRU in front of the MiniLM forward pass for user queries. Keys are
+# normalized text (lowercase, collapsed whitespace); the model is uncased, so
+# this does not change the vector. Set EMBEDDING_CACHE_FILE to persist warm
+# entries across restarts (saved at exit, loaded at import).
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE", "")
+
 
+def normalize_query(text):
+    return " ".join(text.lower().split())
 
-    success_count = 0
 
-    for idx, p in enumerate(products):
+class QueryEmbeddingCache:
+    def __init__(self, capacity=EMBEDDING_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()  # normalized text -> float32 vector
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key, vec):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = np.asarray(vec, dtype=np.float32)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self, path):
+        """Write entries (oldest first, so LRU order survives a reload) to an .npz file."""
+        with self._lock:
+            if not self._entries:
+                return
+            keys = np.array(list(self._entries.keys()))
+            vectors = np.stack(list(self._entries.values()))
+        # A temp file per writer: every worker saves at exit, and a shared name would interleave
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
         try:
-            text = " ".join([f"{k}: {v}" for k, v in p.items()])
-            print(f"[EmbeddingService] ➕ Adding product #{idx+1}: {p.get('name', 'Unknown')}")
-            
-            # Force embedding calculation (help catch errors early)
-            emb = embedding_fn([text])
-            print(f"[EmbeddingService] 🧠 Embedding shape: {len(emb)}")  # debug
-
-            collection.upsert(
-                documents=[text],
-                metadatas=[p],
-                ids=[f"product-{idx+1}"],
-                embeddings=emb
-            )
-            success_count += 1
-            print(f"[EmbeddingService] ✅ Successfully added {p['name']}")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, keys=keys, vectors=vectors, backend=np.array(embedding_backend_id()))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, path):
+        try:
+            with np.load(path) as data:
+                keys, vectors = data["keys"], data["vectors"]
+                backend = str(data["backend"]) if "backend" in data else embedding_backend_id("torch")
+        except (OSError, KeyError, ValueError) as e:
+            print(f"[EmbeddingService] ⚠️ Could not load embedding cache {path}: {e}")
+            return
+        if backend != embedding_backend_id():
+            print(f"[EmbeddingService] Skipping embedding cache {path}: built with {backend}")
+            return
+        for key, vec in zip(keys.tolist(), vectors):
+            self.put(key, vec)
+        print(f"[EmbeddingService] Loaded {len(keys)} cached query embeddings from {path}")
+
+
+query_cache = QueryEmbeddingCache()
+
+if EMBEDDING_CACHE_FILE:
+    if os.path.exists(EMBEDDING_CACHE_FILE):
+        query_cache.load(EMBEDDING_CACHE_FILE)
+    atexit.register(query_cache.save, EMBEDDING_CACHE_FILE)
 
+
+# Cache misses from concurrent requests are embedded together (see agent.embedding_batcher)
+embedding_batcher = EmbeddingBatcher(embedding_fn)
+
+
+def embed_query(text):
+    """Embedding for a single user query, served from ``query_cache`` when possible."""
+    key = normalize_query(text)
+    vec = query_cache.get(key)
+    if vec is None:
+        if EMBEDDING_BATCHING:
+            vec = embedding_batcher.embed(key)
+        else:
+            vec = np.asarray(embedding_fn([key])[0], dtype=np.float32)
+        query_cache.put(key, vec)
+    return vec
+
+
+async def aembed_query(text, executor=None):
+    """``embed_query`` for the event loop: a cache hit returns at once, a miss awaits the shared batcher."""
+    key = normalize_query(text)
+    vec = query_cache.get(key)
+    if vec is None:
+        if not EMBEDDING_BATCHING:
+            return await asyncio.get_running_loop().run_in_executor(executor, embed_query, text)
+        vec = await embedding_batcher.aembed(key)
+        query_cache.put(key, vec)
+    return vec
+
+
+# ---- Batched Ingestion ----
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+
+def ingest_documents(ids, documents, metadatas, batch_size=EMBEDDING_BATCH_SIZE, target=None):
+    """
+    Embed and upsert documents in batches of ``batch_size``.
+
+    Each batch is one vectorized forward pass and one ``upsert`` into
+    ``target`` (default: the product collection). A failed batch is reported
+    and skipped rather than aborting the run; its ids are returned in
+    ``failed_ids`` so callers can retry them. Progress is printed roughly
+    every 10%, and the returned summary includes throughput in docs/sec.
+    """
+    target = target if target is not None else collection
+    total = len(ids)
+    batch_size = max(1, batch_size)
+    upserted = failed = batches = 0
+    failed_ids = []
+    report_every = max(1, total // 10)
+    next_report = report_every
+    start = time.perf_counter()
+
+    for i in range(0, total, batch_size):
+        batch_ids = ids[i:i + batch_size]
+        batch_docs = documents[i:i + batch_size]
+        batch_metas = metadatas[i:i + batch_size]
+        batches += 1
+        try:
+            embeddings = embedding_fn(batch_docs)
+            target.upsert(ids=batch_ids, documents=batch_docs, metadatas=batch_metas, embeddings=embeddings)
+            upserted += len(batch_ids)
         except Exception as e:
-            print(f"[EmbeddingService] ❌ Failed to add {p.get('name', 'Unknown')}: {e}")
-            import traceback
-            traceback.print_exc()
+            failed += len(batch_ids)
+            failed_ids.extend(batch_ids)
+            print(f"[EmbeddingService] ❌ Batch {batches} ({batch_ids[0]}..{batch_ids[-1]}) failed: {e}")
+
+        done = upserted + failed
+        if done >= next_report and done < total:
+            elapsed = time.perf_counter() - start
+            print(f"[EmbeddingService] ⏳ {done}/{total} docs ({done / elapsed:.1f} docs/sec)")
+            next_report = done + report_every
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "total": total,
+        "upserted": upserted,
+        "failed": failed,
+        "batches": batches,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(upserted / elapsed, 1) if elapsed > 0 else 0.0,
+        "failed_ids": failed_ids,
+    }
+    print(f"[EmbeddingService] 📊 Ingested {upserted}/{total} docs in {batches} batches, "
+          f"{elapsed:.2f}s ({summary['docs_per_sec']} docs/sec), {failed} failed")
+    return summary
+
+
+# ---- Incremental Sync ----
+
+def index_metadata(document, metadata, source):
+    """Metadata as stored in the index: product fields plus ``source`` and ``content_hash``."""
+    return {**metadata, "source": source, "content_hash": content_hash(document, metadata)}
+
+
+def upsert_items(items, source, batch_size=EMBEDDING_BATCH_SIZE, target=None):
+    """Embed and upsert a known-changed subset of ``source`` without diffing the whole collection."""
+    items = list(items)
+    if not items:
+        return None
+    ids = [doc_id for doc_id, _, _ in items]
+    documents = [document for _, document, _ in items]
+    metadatas = [index_metadata(document, metadata, source) for _, document, metadata in items]
+    return ingest_documents(ids, documents, metadatas, batch_size=batch_size, target=target)
+
+
+def sync_collection(items, source, batch_size=EMBEDDING_BATCH_SIZE, force=False, target=None):
+    """
+    Bring ``target`` (default: the product collection) in line with ``items``.
+
+    ``items`` are ``(id, document, metadata)`` tuples from one ``source``
+    (e.g. ``catalog`` or ``db``). Each stored entry carries a ``content_hash``
+    in its metadata; only new or changed items are re-embedded, and ids of
+    this source that are no longer present are deleted afterwards. Entries
+    from before content hashing (no ``source``) are treated as belonging to
+    whichever source syncs first. Nothing is cleared up front, so queries
+    keep seeing the previous version of each product until its replacement
+    is upserted. ``force=True`` re-embeds every item in place.
+    """
+    target = target if target is not None else collection
+
+    existing = target.get(include=["metadatas"])
+    stored = {}
+    for doc_id, meta in zip(existing.get("ids") or [], existing.get("metadatas") or []):
+        meta = meta or {}
+        if meta.get("source", source) == source:
+            stored[doc_id] = meta.get("content_hash")
+
+    ids, documents, metadatas = [], [], []
+    seen = set()
+    added = updated = 0
+    for doc_id, document, metadata in items:
+        seen.add(doc_id)
+        metadata = index_metadata(document, metadata, source)
+        if not force and stored.get(doc_id) == metadata["content_hash"]:
+            continue
+        if doc_id in stored:
+            updated += 1
+        else:
+            added += 1
+        ids.append(doc_id)
+        documents.append(document)
+        metadatas.append(metadata)
+
+    summary = {"source": source, "added": added, "updated": updated, "deleted": 0,
+               "unchanged": len(seen) - added - updated}
+    upserted = 0
+    if ids:
+        summary["ingest"] = ingest_documents(ids, documents, metadatas, batch_size=batch_size, target=target)
+        upserted = summary["ingest"]["upserted"]
+
+    removed = [doc_id for doc_id in stored if doc_id not in seen]
+    if removed:
+        target.delete(ids=removed)
+        summary["deleted"] = len(removed)
+
+    # Only a write that landed changes what readers would see
+    if upserted or removed:
+        bump_index_version()
+    if target is collection and not summary.get("ingest", {}).get("failed"):
+        # A complete sync leaves the file in place, so startup never has to open Chroma to guess
+        if force or not stored:
+            record_embedding_backend()
+        elif recorded_embedding_backend() is None:
+            record_embedding_backend(embedding_backend_id("torch"))  # entries from before it was recorded
+    print(f"[EmbeddingService] 🔄 Sync '{source}': {added} added, {updated} updated, "
+          f"{summary['deleted']} deleted, {summary['unchanged']} unchanged")
+    return summary
+
+
+def generate_embeddings(batch_size=EMBEDDING_BATCH_SIZE, force=False):
+    """Incrementally index ``products_data.products`` (only changed products are re-embedded)."""
+    print("[EmbeddingService] 🚀 Starting regeneration process...")
+    print(f"[EmbeddingService] 📦 Total products loaded: {len(products)}")
+
+    summary = sync_collection(catalog_items(products), source="catalog", batch_size=batch_size, force=force)
 
     try:
         final_count = collection.count()
         print(f"[EmbeddingService] 📊 Final count in collection: {final_count}")
-        print(f"[EmbeddingService] ✅ Successfully added {success_count}/{len(products)} products")
     except Exception as e:
         print(f"[EmbeddingService] ⚠️ Could not count final embeddings: {e}")
+    return summary
+
+
+# ---- Embedding Backend Drift ----
+# Backends serving the same model (PyTorch float, ONNX, ONNX int8) produce
+# close but not identical vectors. The backend that built the product index
+# is recorded next to it; when the configured backend differs, queries are
+# embedded in a slightly different space than the documents.
+# EMBEDDING_DRIFT_ACTION: "warn" (log only), "verify" (measure recall@k of
+# the current backend against the float model), "reindex" (re-embed the
+# collection with the current backend) or "off". verify and reindex run from
+# ``load_embeddings.py``; at startup AgentConfig.ready() only compares the
+# recorded backend file with the configured one (warn_on_backend_drift).
+EMBEDDING_BACKEND_FILE = os.path.join("./product_db", "embedding_backend")
+EMBEDDING_DRIFT_ACTION = os.getenv("EMBEDDING_DRIFT_ACTION", "warn")
+EMBEDDING_MIN_RECALL = float(os.getenv("EMBEDDING_MIN_RECALL", "0.9"))
+
+# Shopper-style queries for recall checks, on top of every product name
+DRIFT_QUERIES = [
+    "cheap gaming laptop", "laptop for video editing", "monitor with 144Hz", "4k monitor for design work",
+    "quiet mechanical keyboard", "wireless mouse for gaming", "fast nvme ssd", "external hard drive backup",
+    "graphics card under 500", "router with vpn support", "desktop for streaming", "usb-c cable",
+]
+
+
+def record_embedding_backend(backend_id=None):
+    os.makedirs(os.path.dirname(EMBEDDING_BACKEND_FILE), exist_ok=True)
+    with open(EMBEDDING_BACKEND_FILE, "w") as f:
+        f.write(backend_id or embedding_backend_id())
+
+
+def recorded_embedding_backend():
+    """Backend written next to the product index, or None if it was never recorded. Reads one file."""
+    try:
+        with open(EMBEDDING_BACKEND_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def indexed_embedding_backend():
+    """Backend that built the product index; indexes from before this was recorded were built with PyTorch."""
+    recorded = recorded_embedding_backend()
+    if recorded is not None:
+        return recorded
+    return embedding_backend_id("torch") if collection.count() else None
+
+
+def reembed_collection(batch_size=EMBEDDING_BATCH_SIZE, target=None):
+    """Re-embed every stored document (any source) with the current backend, in place."""
+    target = target if target is not None else collection
+    data = target.get(include=["documents", "metadatas"])
+    ids = list(data.get("ids") or [])
+    summary = ingest_documents(ids, list(data.get("documents") or []), list(data.get("metadatas") or []),
+                               batch_size=batch_size, target=target)
+    if summary["failed"] == 0 and target is collection:
+        record_embedding_backend()
+    if summary["upserted"]:
+        bump_index_version()
+    return summary
+
+
+def _top_k(matrix, queries, k):
+    scores = np.asarray(queries, dtype=np.float32) @ matrix.T
+    k = min(k, matrix.shape[0])
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def verify_embedding_recall(k=3, queries=None, max_docs=2000, target=None):
+    """
+    recall@k of the current backend end to end (its query vectors against the
+    stored index) relative to the float model (float query vectors against
+    float document vectors), over the first ``max_docs`` stored documents.
+    """
+    target = target if target is not None else collection
+    data = target.get(include=["documents", "metadatas", "embeddings"], limit=max_docs)
+    documents = list(data.get("documents") or [])
+    if not documents:
+        return {"recall": None, "k": k, "queries": 0, "docs": 0}
+    if queries is None:
+        names = {(meta or {}).get("name") for meta in data.get("metadatas") or []}
+        queries = sorted(name for name in names if name) + DRIFT_QUERIES
+    reference = get_model("embedding:float")
+
+    stored = _normalized(data["embeddings"])
+    float_docs = _normalized(reference(documents))
+    current_top = _top_k(stored, _normalized(embedding_fn(queries)), k)
+    float_top = _top_k(float_docs, _normalized(reference(queries)), k)
+    overlap = [len(set(a) & set(b)) / len(b) for a, b in zip(current_top.tolist(), float_top.tolist())]
+    return {
+        "recall": round(float(np.mean(overlap)), 4),
+        "k": k,
+        "queries": len(queries),
+        "docs": len(documents),
+        "index_backend": indexed_embedding_backend(),
+        "query_backend": embedding_backend_id(),
+    }
+
+
+def check_embedding_drift(action=EMBEDDING_DRIFT_ACTION):
+    """Compare the configured backend with the one that built the index and act per ``action``."""
+    indexed = indexed_embedding_backend()
+    current = embedding_backend_id()
+    if action == "off" or indexed is None:
+        return None
+    drifted = indexed != current
+    if action == "reindex" and drifted:
+        print(f"[EmbeddingService] 🔁 Index built with {indexed}, re-embedding with {current}")
+        return reembed_collection()
+    if action == "verify":
+        report = verify_embedding_recall()
+        level = "⚠️" if report["recall"] is not None and report["recall"] < EMBEDDING_MIN_RECALL else "✅"
+        print(f"[EmbeddingService] {level} recall@{report['k']} vs float model: {report['recall']} "
+              f"(index {indexed}, queries {current})")
+        return report
+    if drifted:
+        print(f"[EmbeddingService] ⚠️ Index built with {indexed} but queries use {current}; "
+              f"run load_embeddings.py --drift-action reindex (or verify)")
+    return None
+
+
+def warn_on_backend_drift():
+    """Startup check: compares the recorded backend file with the configured backend; never opens Chroma."""
+    recorded = recorded_embedding_backend()
+    if EMBEDDING_DRIFT_ACTION == "off" or recorded is None or recorded == embedding_backend_id():
+        return False
+    print(f"[EmbeddingService] ⚠️ Index built with {recorded} but queries use {embedding_backend_id()}; "
+          f"run load_embeddings.py --drift-action reindex (or verify)")
+    return True
 
 
 def query_similar_products(user_query, n_results=5):
@@ -86,3 +470,4 @@ def query_similar_products(user_query, n_results=5):
     metas = metas_list[0] if metas_list else []
 
     return list(zip(docs, metas))
+
@@ -0,0 +1,272 @@
+# agent/history_cache.py
+"""
+Hot cache of the most recent ``ChatMessage`` rows per session.
+
+Every chat turn reads the session's history twice (5 messages for the
+prompt, 50 for the response). ``memory_service.get_history`` serves those
+reads from here once a session has been loaded from the database, and
+``save_message`` appends each new row (write-through), so an active
+session's history costs at most one indexed id lookup instead of a load.
+
+``HISTORY_CACHE_BACKEND`` selects the implementation:
+
+* ``local`` (default): per-process ring buffers of ``HISTORY_CACHE_SIZE``
+  messages, evicted least-recently-used when the total cached text passes
+  ``HISTORY_CACHE_MAX_BYTES`` and dropped ``HISTORY_CACHE_TTL`` seconds
+  after they were loaded (reads do not extend it).
+* ``django``: the Django cache framework (``CACHES["default"]``, e.g.
+  Redis or memcached), shared by every worker. Appends are read-modify-
+  write, which is fine because a session's turns arrive one at a time.
+* ``none``: always read the database.
+
+Staleness: with several worker processes, another worker may have saved
+messages a local buffer does not have. With ``HISTORY_CACHE_VALIDATE`` on
+(the default for ``local``), ``get_history`` passes the id of the session's
+newest stored row (one indexed query) and a buffer that does not contain it
+is dropped and reloaded. Messages other workers have not flushed yet are
+not visible to any backend until their write-behind flush.
+
+Fill/append race: ``fill`` takes the token from ``fill_token()`` taken
+before the rows were read; if a message of the session was appended since,
+the fill is skipped (the message might be missing from those rows) and the
+next read loads again.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+HISTORY_CACHE_BACKEND = os.getenv("HISTORY_CACHE_BACKEND", "local")
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "50"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "1800"))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_CACHE_VALIDATE = os.getenv("HISTORY_CACHE_VALIDATE", "1" if HISTORY_CACHE_BACKEND == "local" else "0") == "1"
+# Sessions whose last append is remembered for the fill/append check
+_APPEND_LOG_SIZE = 10000
+
+# Rough per-message overhead of a model instance on top of its text
+_MESSAGE_OVERHEAD = 600
+
+
+def _message_bytes(message):
+    return _MESSAGE_OVERHEAD + sys.getsizeof(getattr(message, "message", "") or "")
+
+
+def _has_row(messages, newest_id):
+    """False if the database holds a newer row (``newest_id``) than the cached messages."""
+    return newest_id is None or any(getattr(m, "pk", None) == newest_id for m in messages)
+
+
+class LocalHistoryCache:
+    def __init__(self, size=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL, max_bytes=HISTORY_CACHE_MAX_BYTES):
+        self.size = size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # session_id -> [deque of messages, complete, loaded_at, bytes]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._appended = OrderedDict()  # session_id -> sequence number of its last append
+        self._forgotten = 0  # highest sequence number dropped from _appended
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def _drop(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._sessions:
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def get(self, session_id, limit, newest_id=None):
+        """
+        The last ``limit`` messages (oldest first), or None if the cache cannot
+        answer. ``newest_id``: id of the session's newest stored row; a buffer
+        without it missed another process's writes and is dropped.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                self._drop(session_id)
+                entry = None
+            if entry is not None and not _has_row(entry[0], newest_id):
+                self._drop(session_id)
+                self.stale += 1
+                entry = None
+            # A partial buffer only answers requests it fully covers
+            if entry is None or (limit > len(entry[0]) and not entry[1]):
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            messages = list(entry[0])
+        return messages[-limit:] if limit else []
+
+    def fill_token(self):
+        """Take before reading the rows to ``fill`` with."""
+        with self._lock:
+            return self._seq
+
+    def fill(self, session_id, messages, complete, token=None):
+        """
+        Seed a session from the database (``complete``: ``messages`` is the
+        whole session). Skipped if the session had an append since ``token``.
+        """
+        buffer = deque(messages[-self.size:], maxlen=self.size)
+        size = sum(_message_bytes(m) for m in buffer)
+        with self._lock:
+            if token is not None and (token < self._forgotten or self._appended.get(session_id, 0) > token):
+                return
+            self._drop(session_id)
+            self._sessions[session_id] = [buffer, complete and len(messages) <= self.size, time.monotonic(), size]
+            self._bytes += size
+            self._evict()
+
+    def _log_append(self, session_id):
+        self._seq += 1
+        self._appended[session_id] = self._seq
+        self._appended.move_to_end(session_id)
+        if len(self._appended) > _APPEND_LOG_SIZE:
+            self._forgotten = self._appended.popitem(last=False)[1]
+
+    def append(self, session_id, message):
+        """Write-through for a saved message; sessions not in the cache are left to load on read."""
+        with self._lock:
+            self._log_append(session_id)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            buffer = entry[0]
+            if len(buffer) == buffer.maxlen:
+                entry[3] -= _message_bytes(buffer[0])
+                self._bytes -= _message_bytes(buffer[0])
+                entry[1] = False  # the oldest message falls out of the ring
+            buffer.append(message)
+            added = _message_bytes(message)
+            entry[3] += added
+            self._bytes += added
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def invalidate(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+                self._bytes = 0
+            else:
+                self._drop(session_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "local",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "stale": self.stale,
+            }
+
+
+class DjangoHistoryCache:
+    """Same interface on top of ``django.core.cache`` (shared across workers)."""
+
+    def __init__(self, size=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL, alias="default"):
+        self.size = size
+        self.ttl = ttl
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    @staticmethod
+    def _key(session_id):
+        return f"chat-history:{session_id}"
+
+    def get(self, session_id, limit, newest_id=None):
+        entry = self._cache.get(self._key(session_id))
+        if entry is not None and not _has_row(entry["messages"], newest_id):
+            entry = None
+        if entry is None or (limit > len(entry["messages"]) and not entry["complete"]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["messages"][-limit:] if limit else []
+
+    def fill_token(self):
+        return None
+
+    def fill(self, session_id, messages, complete, token=None):
+        entry = {"messages": list(messages[-self.size:]), "complete": complete and len(messages) <= self.size}
+        self._cache.set(self._key(session_id), entry, timeout=self.ttl)
+
+    def append(self, session_id, message):
+        key = self._key(session_id)
+        entry = self._cache.get(key)
+        if entry is None:
+            return
+        entry["messages"].append(message)
+        if len(entry["messages"]) > self.size:
+            entry["messages"] = entry["messages"][-self.size:]
+            entry["complete"] = False
+        self._cache.set(key, entry, timeout=self.ttl)
+
+    def invalidate(self, session_id=None):
+        if session_id is not None:
+            self._cache.delete(self._key(session_id))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"backend": "django", "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+
+class NullHistoryCache:
+    def get(self, session_id, limit, newest_id=None):
+        return None
+
+    def fill_token(self):
+        return None
+
+    def fill(self, session_id, messages, complete, token=None):
+        pass
+
+    def append(self, session_id, message):
+        pass
+
+    def invalidate(self, session_id=None):
+        pass
+
+    def stats(self):
+        return {"backend": "none"}
+
+
+BACKENDS = {
+    "local": LocalHistoryCache,
+    "django": DjangoHistoryCache,
+    "none": NullHistoryCache,
+}
+
+
+def make_history_cache(backend=HISTORY_CACHE_BACKEND):
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown HISTORY_CACHE_BACKEND '{backend}' (expected one of {sorted(BACKENDS)})")
+
+
+history_cache = make_history_cache()
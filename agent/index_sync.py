@@ -0,0 +1,135 @@
+# agent/index_sync.py
+"""
+Background sync of ``Product`` changes into the product vector index.
+
+``agent.signals`` marks primary keys dirty (saved) or deleted after each
+commit. A single daemon thread waits ``INDEX_SYNC_DELAY`` seconds after the
+first mark, drains everything that accumulated meanwhile, and applies it as
+one embedding batch plus one delete, so a burst of admin edits costs one
+forward pass instead of N encodes inside the request. Changes that fail to
+apply (a failed embedding batch, a Chroma error) go back on the queue and
+are retried after another ``INDEX_SYNC_DELAY``.
+
+Bulk ``QuerySet.update()`` / ``bulk_create`` bypass model signals; run
+``load_embeddings.py`` after those.
+"""
+import atexit
+import os
+import threading
+import time
+
+from django.db import close_old_connections
+
+INDEX_AUTOSYNC = os.getenv("INDEX_AUTOSYNC", "1") == "1"
+INDEX_SYNC_DELAY = float(os.getenv("INDEX_SYNC_DELAY", "2.0"))
+
+
+class IndexSyncQueue:
+    def __init__(self, delay=INDEX_SYNC_DELAY):
+        self.delay = delay
+        self._dirty = set()
+        self._deleted = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.flushes = 0
+
+    def mark_dirty(self, pk):
+        with self._lock:
+            self._deleted.discard(pk)
+            self._dirty.add(pk)
+        self._ensure_worker()
+
+    def mark_deleted(self, pk):
+        with self._lock:
+            self._dirty.discard(pk)
+            self._deleted.add(pk)
+        self._ensure_worker()
+
+    def pending(self):
+        with self._lock:
+            return len(self._dirty) + len(self._deleted)
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="index-sync", daemon=True)
+                    self._thread.start()
+        self._wakeup.set()
+
+    def _drain(self):
+        with self._lock:
+            dirty, deleted = self._dirty, self._deleted
+            self._dirty, self._deleted = set(), set()
+        return dirty, deleted
+
+    def _requeue(self, dirty, deleted):
+        """Put back changes that were not applied; a newer mark for the same pk wins."""
+        with self._lock:
+            self._dirty |= {pk for pk in dirty if pk not in self._deleted}
+            self._deleted |= {pk for pk in deleted if pk not in self._dirty}
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Let the burst accumulate before paying for one batched encode
+            time.sleep(self.delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[IndexSync] ❌ Sync failed, will retry: {e}")
+            finally:
+                close_old_connections()
+            if self.pending():
+                self._wakeup.set()  # retry requeued changes after another delay
+
+    def flush(self):
+        """Apply all pending changes now. Returns ``(upserted, deleted)`` counts."""
+        dirty, deleted = self._drain()
+        if not dirty and not deleted:
+            return 0, 0
+
+        from agent.catalog import model_items
+        from agent.embedding_service import bump_index_version, collection, upsert_items
+        from agent.models import Product
+
+        upserted, removed = set(), set()
+        try:
+            rows = list(Product.objects.filter(pk__in=dirty))
+            # Rows deleted after being marked dirty are removed instead
+            deleted |= dirty - {row.pk for row in rows}
+
+            summary = upsert_items(model_items(rows), source="db")
+            failed_ids = set(summary["failed_ids"]) if summary else set()
+            upserted = {row.pk for row in rows if str(row.pk) not in failed_ids}
+            if deleted:
+                collection.delete(ids=[str(pk) for pk in deleted])
+                removed = deleted
+        finally:
+            # Anything not applied goes back on the queue, including everything if a call raised
+            retry_dirty, retry_deleted = dirty - upserted - removed, deleted - dirty - removed
+            self._requeue(retry_dirty, retry_deleted)
+            if upserted or removed:
+                bump_index_version()
+
+        self.flushes += 1
+        requeued = len(retry_dirty) + len(retry_deleted)
+        print(f"[IndexSync] 🔄 Synced {len(upserted)} changed and {len(removed)} deleted products"
+              + (f", {requeued} requeued" if requeued else ""))
+        return len(upserted), len(removed)
+
+
+index_sync = IndexSyncQueue()
+
+
+def _flush_at_exit():
+    if index_sync.pending():
+        try:
+            index_sync.flush()
+        except Exception as e:
+            print(f"[IndexSync] ⚠️ Could not flush pending changes at exit: {e}")
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,126 @@
+# agent/lexical_index.py
+"""
+BM25 inverted index over the product documents, for exact model strings.
+
+MiniLM often ranks "RTX 2060" or "XPS 13" below loosely similar products;
+a lexical index gets those right. It is built once per index version from
+the documents already stored in the product collection (the text produced by
+``build_product_text`` / ``build_product_text_from_model``), with postings
+kept as NumPy arrays so scoring a query is a handful of vectorized adds.
+
+It also keeps a lookup of normalized model names, so a query that names a
+product exactly can be answered without running the embedding model at all.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from agent.embedding_service import collection, current_index_version
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Units that are merged with a preceding number, so "1 TB" and "1TB" index the same
+_UNITS = {"gb", "tb", "mb", "hz", "dpi", "inch", "mm", "w"}
+
+
+def tokenize(text):
+    tokens = _TOKEN_RE.findall(text.lower())
+    merged = []
+    for tok in tokens:
+        if merged and tok in _UNITS and merged[-1].isdigit():
+            merged[-1] += tok
+        else:
+            merged.append(tok)
+    return merged
+
+
+class BM25Index:
+    def __init__(self, documents, metadatas, k1=1.5, b=0.75, version=0):
+        self.documents = documents
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.version = version
+
+        doc_tokens = [tokenize(doc) for doc in documents]
+        self.doc_len = np.array([len(t) for t in doc_tokens], dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if len(doc_tokens) else 0.0
+
+        postings = defaultdict(lambda: ([], []))
+        for idx, tokens in enumerate(doc_tokens):
+            for term, tf in Counter(tokens).items():
+                postings[term][0].append(idx)
+                postings[term][1].append(tf)
+
+        n_docs = len(documents)
+        self.postings = {}
+        self.idf = {}
+        for term, (idxs, tfs) in postings.items():
+            self.postings[term] = (np.array(idxs, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            df = len(idxs)
+            self.idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+        # Normalized model/name token sequences -> document index, longest first
+        names = {}
+        for idx, meta in enumerate(metadatas):
+            for key in ("model", "name"):
+                value = (meta or {}).get(key)
+                if value:
+                    names.setdefault(tuple(tokenize(str(value))), idx)
+        self.names = sorted(names.items(), key=lambda item: -len(item[0]))
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query, n_results=10):
+        """Indices and BM25 scores of the best ``n_results`` documents (zero-score docs excluded)."""
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / (self.avg_len or 1.0))
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            idxs, tfs = posting
+            scores[idxs] += self.idf[term] * tfs * (self.k1 + 1) / (tfs + norm[idxs])
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = min(n_results, len(hits))
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+    def exact_matches(self, query):
+        """Documents whose full model name (or product name) appears as a token run in ``query``."""
+        tokens = tokenize(query)
+        found = []
+        for name_tokens, idx in self.names:
+            n = len(name_tokens)
+            if n and idx not in found and any(tuple(tokens[i:i + n]) == name_tokens
+                                              for i in range(len(tokens) - n + 1)):
+                found.append(idx)
+        return found
+
+    def results(self, idxs):
+        return [(self.documents[i], self.metadatas[i]) for i in idxs]
+
+
+# ---- Process-wide index, rebuilt when the product index version changes ----
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_lexical_index():
+    global _index
+    version = current_index_version()
+    if _index is not None and _index.version == version:
+        return _index
+    with _index_lock:
+        if _index is None or _index.version != version:
+            data = collection.get(include=["documents", "metadatas"])
+            _index = BM25Index(list(data.get("documents") or []), list(data.get("metadatas") or []),
+                               version=version)
+            print(f"[LexicalIndex] Built BM25 index over {len(_index)} products ({len(_index.postings)} terms)")
+    return _index
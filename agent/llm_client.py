@@ -0,0 +1,131 @@
+# agent/llm_client.py
+"""
+Pooled HTTP clients for the Groq (OpenAI-compatible) chat completions API.
+
+The sync path reuses one ``requests.Session`` so turns share keep-alive
+connections. The async path reuses one ``httpx.AsyncClient`` per event loop:
+under uvicorn that is one client for the whole process, under WSGI (where
+Django spins a loop per async request) it degrades to a client per loop.
+"""
+import asyncio
+import json
+import os
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "mixtral-8x7b-32768")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_api_key():
+    return os.getenv("GROQ_API_KEY", "")
+
+
+def build_headers(api_key):
+    return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+
+def build_payload(messages, **extra):
+    payload = {"model": GROQ_MODEL, "messages": messages}
+    payload.update(extra)
+    return payload
+
+
+def get_session():
+    """Process-wide ``requests.Session`` with a connection pool sized for the LLM host."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_KEEPALIVE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_client():
+    """Shared keep-alive ``httpx.AsyncClient`` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def post_chat_completion(messages, api_key):
+    """Blocking chat completion call. Returns the decoded JSON body."""
+    r = get_session().post(
+        GROQ_API_URL,
+        headers=build_headers(api_key),
+        json=build_payload(messages),
+        timeout=LLM_TIMEOUT,
+    )
+    return r.json()
+
+
+async def apost_chat_completion(messages, api_key):
+    """Async chat completion call over the shared client. Returns the decoded JSON body."""
+    client = get_async_client()
+    r = await client.post(GROQ_API_URL, headers=build_headers(api_key), json=build_payload(messages))
+    return r.json()
+
+
+class IncompleteStream(RuntimeError):
+    pass
+
+
+async def astream_chat_completion(messages, api_key):
+    """
+    Stream a chat completion over the shared client.
+
+    Yields content deltas as they arrive from the OpenAI-style SSE stream
+    (``data: {...}`` lines, terminated by ``data: [DONE]``). Raises
+    ``IncompleteStream`` if the body ends without ``[DONE]``, so callers can
+    tell a truncated reply from a finished one.
+    """
+    client = get_async_client()
+    async with client.stream(
+        "POST",
+        GROQ_API_URL,
+        headers=build_headers(api_key),
+        json=build_payload(messages, stream=True),
+    ) as r:
+        r.raise_for_status()
+        finished = False
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                finished = True
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            choices = chunk.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                yield delta
+        if not finished:
+            raise IncompleteStream("LLM stream ended before [DONE]")
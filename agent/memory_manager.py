@@ -1,51 +1,295 @@
 # agent/memory_manager.py
+"""
+Long-term conversation memory in Chroma, one entry per chat turn.
 
-import chromadb
-from chromadb.utils import embedding_functions
+Entry ids are time-ordered (``{session_id}-{time_ns}-{pid}-{seq}``), so adding a
+turn never reads the collection first, however long the session is. Each
+entry's metadata carries ``session_id`` and the turn's unix time ``ts``.
 
-# ---- Chroma Client Setup ----
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
+Writes are buffered: ``add_memory`` only enqueues, and a daemon thread
+drains the queue every ``MEMORY_FLUSH_INTERVAL`` seconds (or once
+``MEMORY_BATCH_SIZE`` turns are waiting) into one ``collection.add`` with
+one embedding forward pass for the whole batch. Callers that already have
+an embedding for the turn can pass it and skip the forward pass entirely.
+Pending turns are flushed at interpreter exit; ``MEMORY_WRITE_BEHIND=0``
+writes synchronously instead.
+
+Recall (``recall_memory``) takes the current message's embedding, the one
+product retrieval already computed, so it costs no extra forward pass. The
+chat pipeline also stores that vector as the turn's embedding, so recall
+compares messages with messages. Turns still waiting in the write buffer
+are scored from the buffer, so recall never flushes on the request path.
+Without an embedding, recall reads at most ``MEMORY_RECALL_SCAN`` stored
+turns from the last ``MEMORY_RECALL_WINDOW`` seconds and keeps the newest
+``MEMORY_RECALL_CANDIDATES``.
+
+With ``MODEL_SERVER_SOCKET`` set, the memory collection lives in the model
+server: batches are written and recall candidates fetched over its socket,
+and the worker never opens ``./chroma_db``.
+"""
+import atexit
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+from agent.model_registry import get_collection, get_embedding_function
+from agent.model_server import get_client, use_model_server
+from agent.tokens import estimate_tokens
+
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "1") == "1"
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "0.5"))
+MEMORY_BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", "64"))
+MEMORY_RECALL = os.getenv("MEMORY_RECALL", "1") == "1"
+MEMORY_RECALL_CANDIDATES = int(os.getenv("MEMORY_RECALL_CANDIDATES", "20"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+MEMORY_HALF_LIFE = float(os.getenv("MEMORY_HALF_LIFE", "1800"))  # seconds for recency weight to halve
+MEMORY_SIMILARITY_WEIGHT = float(os.getenv("MEMORY_SIMILARITY_WEIGHT", "0.7"))
+MEMORY_RECALL_WINDOW = float(os.getenv("MEMORY_RECALL_WINDOW", "7200"))  # seconds searched without an embedding
+MEMORY_RECALL_SCAN = int(os.getenv("MEMORY_RECALL_SCAN", "200"))  # stored turns read without an embedding
 
 # ---- Embedding Function ----
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
-
-# ---- Get or Create Collection ----
-collection = chroma_client.get_or_create_collection(
-    name="conversation_memory",
-    embedding_function=embedding_fn  # type: ignore[arg-type]
-)
-
-def add_memory(user_message: str, bot_reply: str, session_id: str):
-    """Add user and bot messages to Chroma."""
-    try:
-        existing = collection.get(where={"session_id": session_id})
-        next_id = len(existing["ids"]) + 1
+# Same object as embedding_service.embedding_fn, so both collections share one copy of the weights.
+embedding_fn = get_embedding_function()
+
+# ---- Collection ----
+# Opened on first use, and never in workers that send memory to the model server
+collection = get_collection("./chroma_db", "conversation_memory")
+
+# Tie-breaker for turns recorded in the same nanosecond by this process
+_sequence = itertools.count()
+
+
+def memory_id(session_id, ts_ns=None):
+    """Time-ordered id for a new entry: needs no read of existing entries."""
+    ts_ns = time.time_ns() if ts_ns is None else ts_ns
+    return f"{session_id}-{ts_ns:020d}-{os.getpid()}-{next(_sequence)}"
+
+
+def write_memories(entries):
+    """Store ``(id, document, metadata, embedding or None)`` entries with one add and at most one forward pass."""
+    if not entries:
+        return
+    if use_model_server():
+        get_client().write_memories(entries)
+        return
+    missing = [i for i, entry in enumerate(entries) if entry[3] is None]
+    embeddings = [entry[3] for entry in entries]
+    if missing:
+        for i, vec in zip(missing, embedding_fn([entries[i][1] for i in missing])):
+            embeddings[i] = vec
+    collection.add(
+        ids=[entry[0] for entry in entries],
+        documents=[entry[1] for entry in entries],
+        metadatas=[entry[2] for entry in entries],
+        embeddings=[np.asarray(vec, dtype=np.float32) for vec in embeddings],
+    )
+
+
+class MemoryWriter:
+    def __init__(self, interval=MEMORY_FLUSH_INTERVAL, batch_size=MEMORY_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+
+    def enqueue(self, entry):
+        with self._lock:
+            self._pending.append(entry)
+            full = len(self._pending) >= self.batch_size
+        self._ensure_worker()
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def pending_for(self, session_id):
+        """Unwritten entries of one session, in add order."""
+        with self._lock:
+            return [entry for entry in self._pending if entry[2]["session_id"] == session_id]
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[MemoryManager] Error while writing memories: {e}")
+
+    def flush(self):
+        """Write everything pending now. Returns the number of entries written."""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+            if not entries:
+                return 0
+            for i in range(0, len(entries), self.batch_size):
+                try:
+                    write_memories(entries[i:i + self.batch_size])
+                except Exception:
+                    self.failures += 1
+                    self.written += i
+                    with self._lock:
+                        self._pending = entries[i:] + self._pending  # keep order for the retry
+                    raise
+            self.flushes += 1
+            self.written += len(entries)
+            return len(entries)
+
+    def stats(self):
+        return {"enabled": MEMORY_WRITE_BEHIND, "pending": self.pending(), "flushes": self.flushes,
+                "written": self.written, "failures": self.failures}
+
+
+memory_writer = MemoryWriter()
 
-        collection.add(
-            documents=[f"User: {user_message}\nBot: {bot_reply}"],
-            metadatas=[{"session_id": session_id}],
-            ids=[f"{session_id}-{next_id}"]
+
+def _flush_at_exit():
+    if memory_writer.pending():
+        try:
+            memory_writer.flush()
+        except Exception as e:
+            print(f"[MemoryManager] Could not flush pending memories at exit: {e}")
+
+
+atexit.register(_flush_at_exit)
+
+
+def add_memory(user_message: str, bot_reply: str, session_id: str, embedding=None):
+    """Add user and bot messages to Chroma (buffered unless ``MEMORY_WRITE_BEHIND=0``)."""
+    try:
+        ts_ns = time.time_ns()
+        entry = (
+            memory_id(session_id, ts_ns),
+            f"User: {user_message}\nBot: {bot_reply}",
+            {"session_id": session_id, "ts": ts_ns / 1e9},
+            embedding,
         )
+        if MEMORY_WRITE_BEHIND:
+            memory_writer.enqueue(entry)
+        else:
+            write_memories([entry])
     except Exception as e:
         print(f"[MemoryManager] Error while adding memory: {e}")
 
-def get_memory(session_id: str, n_results: int = 5):
-    """Fetch recent conversation history for a session."""
+def _recency(ts, now, half_life):
+    return 0.5 ** (max(0.0, now - ts) / half_life) if half_life > 0 else 1.0
+
+
+def memory_candidates(session_id, query_emb=None, before=None, n_candidates=MEMORY_RECALL_CANDIDATES):
+    """
+    ``(ids, documents, metadatas, similarities)`` of the stored turns recall
+    picks from: the ``n_candidates`` nearest to ``query_emb``, or without it
+    the newest ``n_candidates`` (similarity 0) of at most
+    ``MEMORY_RECALL_SCAN`` turns from the ``MEMORY_RECALL_WINDOW`` seconds
+    before ``before``.
+    """
+    if use_model_server():
+        return get_client().memory_candidates(session_id, query_emb=query_emb, before=before,
+                                              n_candidates=n_candidates)
+    where = {"session_id": session_id}
+    if before is not None:
+        where = {"$and": [where, {"ts": {"$lt": before}}]}
+
+    if query_emb is None:
+        # Bounded: a window and a limit instead of every turn the session ever had
+        since = (before if before is not None else time.time()) - MEMORY_RECALL_WINDOW
+        clauses = where["$and"] if "$and" in where else [where]
+        results = collection.get(where={"$and": clauses + [{"ts": {"$gte": since}}]}, limit=MEMORY_RECALL_SCAN,
+                                 include=["documents", "metadatas"])
+        rows = sorted(zip(results.get("ids") or [], results.get("documents") or [], results.get("metadatas") or []),
+                      key=lambda row: -(row[2] or {}).get("ts", 0.0))[:n_candidates]
+        return [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [0.0] * len(rows)
+
+    results = collection.query(
+        query_embeddings=[np.asarray(query_emb, dtype=np.float32)],
+        where=where,
+        n_results=n_candidates,
+        include=["documents", "metadatas", "distances"],
+    )
+    ids = (results.get("ids") or [[]])[0]
+    docs = (results.get("documents") or [[]])[0]
+    metas = (results.get("metadatas") or [[]])[0]
+    # Default "l2" space on unit vectors: squared distance = 2 - 2 * cosine
+    sims = [1.0 - float(d) / 2.0 for d in (results.get("distances") or [[]])[0]]
+    return list(ids), list(docs), list(metas), sims
+
+
+def _pending_candidates(session_id, query_emb, before):
+    """Candidates from turns not written yet, scored like stored ones (0 similarity without vectors)."""
+    query = np.asarray(query_emb, dtype=np.float32) if query_emb is not None else None
+    candidates = []
+    for entry_id, doc, meta, vec in memory_writer.pending_for(session_id):
+        if before is not None and meta["ts"] >= before:
+            continue
+        sim = 0.0
+        if query is not None and vec is not None:
+            sim = 1.0 - float(np.sum((np.asarray(vec, dtype=np.float32) - query) ** 2)) / 2.0
+        candidates.append((entry_id, doc, meta, sim))
+    return candidates
+
+
+def recall_memory(session_id, query_emb=None, max_tokens=MEMORY_TOKEN_BUDGET, before=None,
+                  n_candidates=MEMORY_RECALL_CANDIDATES):
+    """
+    Past turns of ``session_id`` worth putting in the prompt, oldest first.
+
+    Candidates are the ``n_candidates`` entries nearest to ``query_emb`` (the
+    current message's embedding, already computed for product retrieval), or
+    the most recent ones without it. Each is scored
+    ``w * similarity + (1 - w) * recency`` with recency halving every
+    ``MEMORY_HALF_LIFE`` seconds, and the best are kept while they fit in
+    ``max_tokens``. ``before`` (unix time) skips turns newer than that, e.g.
+    ones already in the prompt as recent history.
+    """
+    # Read-your-writes from the buffer; snapshot it first so a flush in between shows up twice, not never
+    pending = _pending_candidates(session_id, query_emb, before)
+    ids, docs, metas, sims = memory_candidates(session_id, query_emb=query_emb, before=before,
+                                               n_candidates=n_candidates)
+    stored = set(ids)
+    candidates = list(zip(docs, metas, sims)) + [(doc, meta, sim) for entry_id, doc, meta, sim in pending
+                                                 if entry_id not in stored]
+
+    now = time.time()
+    w = MEMORY_SIMILARITY_WEIGHT if query_emb is not None else 0.0
+    scored = sorted(
+        ((w * sim + (1 - w) * _recency((meta or {}).get("ts", 0.0), now, MEMORY_HALF_LIFE), doc, meta)
+         for doc, meta, sim in candidates),
+        key=lambda item: -item[0],
+    )
+
+    picked, used = [], 0
+    for _, doc, meta in scored:
+        cost = estimate_tokens(doc)
+        if used + cost > max_tokens:
+            continue
+        picked.append(((meta or {}).get("ts", 0.0), doc))
+        used += cost
+    return [doc for _, doc in sorted(picked, key=lambda item: item[0])]
+
+
+def get_memory(session_id: str, n_results: int = 5, query_emb=None, max_tokens=MEMORY_TOKEN_BUDGET):
+    """Fetch the most relevant (with ``query_emb``) or most recent past turns for a session."""
     try:
-        results = collection.query(
-            query_texts=["recent conversation"],
-            where={"session_id": session_id},
-            n_results=n_results
-        )
-        docs = results.get("documents")
-        if not docs:  # handle None or empty
-            return []
-        # flatten nested list
-        return [doc for sublist in docs for doc in sublist]
+        return recall_memory(session_id, query_emb=query_emb, max_tokens=max_tokens)[-n_results:]
     except Exception as e:
         print(f"[MemoryManager] Error while fetching memory: {e}")
         return []
-
-
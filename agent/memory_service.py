@@ -1,6 +1,9 @@
 # agent/memory_service.py
 from .models import ChatMessage  # Import your Django model
+from agent.history_cache import HISTORY_CACHE_SIZE, HISTORY_CACHE_VALIDATE, history_cache
+from agent.message_buffer import MESSAGE_WRITE_BEHIND, message_buffer
 from datetime import datetime
+from django.db.models import Q
 import pytz
 
 PAKISTAN_TZ = pytz.timezone("Asia/Karachi")
@@ -8,13 +11,73 @@ PAKISTAN_TZ = pytz.timezone("Asia/Karachi")
 def save_message(session_id, sender, message):
     timestamp = datetime.now(PAKISTAN_TZ)
     # DB me save karein
-    message_obj = ChatMessage.objects.create(
-        session_id=session_id,
-        sender=sender,
-        message=message,
-        timestamp=timestamp
-    )
+    if MESSAGE_WRITE_BEHIND:
+        # Inserted by the background flush; readers see it via the cache / pending buffer
+        message_obj = ChatMessage(session_id=session_id, sender=sender, message=message, timestamp=timestamp)
+        message_buffer.enqueue(message_obj)
+    else:
+        message_obj = ChatMessage.objects.create(
+            session_id=session_id,
+            sender=sender,
+            message=message,
+            timestamp=timestamp
+        )
+    # Write-through: active sessions keep answering history reads from memory
+    history_cache.append(session_id, message_obj)
     return message_obj
 
+def _recent_rows(session_id, limit):
+    """The last ``limit`` messages, oldest first, including any still in the write-behind buffer."""
+    # Snapshot pending first: a flush between the two reads then shows up as duplicates (dropped by pk), not gaps
+    pending = message_buffer.pending_for(session_id) if MESSAGE_WRITE_BEHIND else []
+    rows = ChatMessage.objects.filter(session_id=session_id).order_by("-timestamp", "-pk")[:limit][::-1]
+    if pending:
+        flushed = {m.pk for m in rows}
+        rows += [m for m in pending if m.pk is None or m.pk not in flushed]
+    return rows[-limit:]
+
+def _newest_id(session_id):
+    """Id of the session's newest stored row, so cached history can tell if another worker wrote since."""
+    return (ChatMessage.objects.filter(session_id=session_id)
+            .order_by("-timestamp", "-pk").values_list("pk", flat=True).first())
+
 def get_history(session_id, limit=10):
-    return ChatMessage.objects.filter(session_id=session_id).order_by("-timestamp")[:limit][::-1]
+    newest_id = _newest_id(session_id) if HISTORY_CACHE_VALIDATE else None
+    cached = history_cache.get(session_id, limit, newest_id=newest_id)
+    if cached is not None:
+        return cached
+    if limit > HISTORY_CACHE_SIZE:
+        return _recent_rows(session_id, limit)
+    # Load a full ring buffer so the follow-up reads of this turn hit the cache
+    token = history_cache.fill_token()
+    rows = _recent_rows(session_id, HISTORY_CACHE_SIZE)
+    history_cache.fill(session_id, rows, complete=len(rows) < HISTORY_CACHE_SIZE, token=token)
+    return rows[-limit:] if limit else []
+
+def get_history_page(session_id, limit=50, before=None, since=None):
+    """
+    Cursor pagination over a session's history, oldest first within the page.
+
+    ``before``: the ``limit`` messages immediately older than message id
+    ``before`` (default: the newest ones). ``since``: the ``limit`` messages
+    immediately newer than message id ``since``. Cursors compare on
+    ``(timestamp, id)``, which the ``(session_id, timestamp)`` index serves
+    without an offset scan. Returns ``(messages, has_more)``.
+    """
+    if MESSAGE_WRITE_BEHIND and message_buffer.pending_for(session_id):
+        message_buffer.flush()  # cursors need ids, so persist this session's pending messages first
+    qs = ChatMessage.objects.filter(session_id=session_id)
+    if since is not None:
+        anchor = ChatMessage.objects.filter(session_id=session_id, pk=since).values_list("timestamp", flat=True).first()
+        if anchor is None:
+            return [], False
+        qs = qs.filter(Q(timestamp__gt=anchor) | Q(timestamp=anchor, pk__gt=since))
+        rows = list(qs.order_by("timestamp", "pk")[:limit + 1])
+        return rows[:limit], len(rows) > limit
+    if before is not None:
+        anchor = ChatMessage.objects.filter(session_id=session_id, pk=before).values_list("timestamp", flat=True).first()
+        if anchor is None:
+            return [], False
+        qs = qs.filter(Q(timestamp__lt=anchor) | Q(timestamp=anchor, pk__lt=before))
+    rows = list(qs.order_by("-timestamp", "-pk")[:limit + 1])
+    return rows[:limit][::-1], len(rows) > limit
@@ -0,0 +1,123 @@
+# agent/message_buffer.py
+"""
+Write-behind buffer for ``ChatMessage`` rows.
+
+``save_message`` used to run one ``INSERT`` (one SQLite write transaction)
+per message inside the request. With ``MESSAGE_WRITE_BEHIND`` on, it only
+enqueues the unsaved instance; a daemon thread flushes the queue with one
+``bulk_create`` per batch every ``MESSAGE_FLUSH_INTERVAL`` seconds or as soon
+as ``MESSAGE_FLUSH_SIZE`` messages are waiting.
+
+* Ordering: there is one FIFO queue and batches are inserted in queue order,
+  so ids follow the order of ``save_message`` calls within each session.
+  Timestamps are the time ``save_message`` ran, not the flush time.
+* Ids: a message has no id (``pk`` is None) until its batch is flushed.
+* Read-your-writes: ``pending_for(session_id)`` exposes unflushed messages so
+  ``get_history`` can merge them (the history cache already holds them).
+* Shutdown: pending messages are flushed at interpreter exit.
+* Backpressure: if ``MESSAGE_BUFFER_MAX`` messages are waiting (e.g. the
+  database is locked for a long time) the caller flushes synchronously.
+"""
+import atexit
+import os
+import threading
+
+from django.db import close_old_connections, transaction
+
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "1") == "1"
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.2"))
+MESSAGE_FLUSH_SIZE = int(os.getenv("MESSAGE_FLUSH_SIZE", "200"))
+MESSAGE_BUFFER_MAX = int(os.getenv("MESSAGE_BUFFER_MAX", "10000"))
+
+
+class MessageWriteBuffer:
+    def __init__(self, interval=MESSAGE_FLUSH_INTERVAL, flush_size=MESSAGE_FLUSH_SIZE, max_pending=MESSAGE_BUFFER_MAX):
+        self.interval = interval
+        self.flush_size = max(1, flush_size)
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one bulk insert at a time keeps batches in order
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+
+    def enqueue(self, message):
+        with self._lock:
+            self._pending.append(message)
+            count = len(self._pending)
+        self._ensure_worker()
+        if count >= self.max_pending:
+            self.flush()
+        elif count >= self.flush_size:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def pending_for(self, session_id):
+        """Unflushed messages of one session, in save order."""
+        with self._lock:
+            return [m for m in self._pending if m.session_id == session_id]
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[MessageBuffer] ❌ Flush failed, will retry: {e}")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Insert everything pending now. Returns the number of rows written."""
+        from agent.models import ChatMessage
+
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+            if not batch:
+                return 0
+            try:
+                with transaction.atomic():
+                    for i in range(0, len(batch), self.flush_size):
+                        ChatMessage.objects.bulk_create(batch[i:i + self.flush_size])
+            except Exception:
+                self.failures += 1
+                with self._lock:
+                    self._pending = batch + self._pending  # keep order for the retry
+                raise
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    def stats(self):
+        return {"enabled": MESSAGE_WRITE_BEHIND, "pending": self.pending(), "flushes": self.flushes,
+                "written": self.written, "failures": self.failures}
+
+
+message_buffer = MessageWriteBuffer()
+
+
+def _flush_at_exit():
+    if message_buffer.pending():
+        try:
+            message_buffer.flush()
+        except Exception as e:
+            print(f"[MessageBuffer] ⚠️ Could not flush pending messages at exit: {e}")
+
+
+atexit.register(_flush_at_exit)
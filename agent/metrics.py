@@ -0,0 +1,75 @@
+# agent/metrics.py
+"""
+Minimal in-process metrics for tuning (no exporter dependency).
+
+``Histogram`` counts observations into fixed upper-bound buckets, like a
+Prometheus histogram, and reports them as a plain dict for ``stats_api``.
+``StageTimings`` times the steps of one request and reports them in a
+``Server-Timing`` header, which load tests read per request.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _finite(value):
+    return None if value == float("inf") else value  # keep snapshots valid JSON
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot: above the largest bucket
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (``inf`` if above every bucket)."""
+        with self._lock:
+            if not self._count:
+                return 0.0
+            target = q * self._count
+            seen = 0
+            for bound, count in zip(self.buckets + [float("inf")], self._counts):
+                seen += count
+                if seen >= target:
+                    return bound
+        return float("inf")
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        labels = [f"le_{b:g}" for b in self.buckets] + ["inf"]
+        return {
+            "count": count,
+            "mean": round(total / count, 3) if count else 0.0,
+            "p50": _finite(self.quantile(0.5)),
+            "p99": _finite(self.quantile(0.99)),
+            "buckets": dict(zip(labels, counts)),
+        }
+
+
+class StageTimings:
+    def __init__(self):
+        self.stages = {}  # stage name -> milliseconds, in the order first entered
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+
+    def header(self):
+        """``Server-Timing`` value, e.g. ``retrieve;dur=12.3, llm;dur=840.0``."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.stages.items())
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0006_remove_product_buttons_remove_product_compatibility_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session_id', 'timestamp'], name='chatmsg_session_ts_idx'),
+        ),
+    ]
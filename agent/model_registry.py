@@ -0,0 +1,262 @@
+# agent/model_registry.py
+"""
+Process-wide registry of heavy models and Chroma clients, loaded lazily on first use.
+
+Nothing is loaded at import time, so ``manage.py`` commands, migrations and
+admin-only workers never pay for weights they do not use. Each model is
+loaded at most once per process and shared by every module that asks for it.
+Set ``AGENT_WARMUP_MODELS`` (e.g. ``embedding,whisper`` or ``all``) to load
+models eagerly when the app starts instead of on the first request.
+
+``EMBEDDING_BACKEND`` picks how the embedding model runs: ``torch``
+(sentence-transformers, default), ``onnx`` (ONNX Runtime, float32) or
+``onnx-int8`` (ONNX Runtime, dynamically quantized weights). All three serve
+the same model; ``embedding:float`` is always the PyTorch float model, used
+as the reference when checking a quantized backend's recall.
+
+With ``MODEL_SERVER_SOCKET`` set, ``embedding`` and ``whisper`` resolve to
+proxies for the sidecar in ``agent.model_server`` instead of local weights.
+
+Chroma clients are shared the same way: one ``PersistentClient`` per path,
+and one embedding function object handed to every collection, so the
+product and conversation-memory collections run on the same weights.
+Collections (``get_collection``) are opened on first use as well, so a
+worker that sends everything to the model server never opens Chroma.
+"""
+import os
+import sys
+import threading
+import time
+
+import chromadb
+from chromadb.api.types import Documents, EmbeddingFunction
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL_NAME", "base")  # "small" or "medium" for better accuracy
+
+_loaders = {}
+_models = {}
+_lock = threading.Lock()
+_load_locks = {}  # one lock per model, so loading Whisper never blocks the embedding model
+_clients = {}
+
+
+def register(name, loader):
+    """Register a zero-argument ``loader`` for ``name``. Re-registering drops a loaded instance."""
+    with _lock:
+        _loaders[name] = loader
+        _load_locks.setdefault(name, threading.Lock())
+        _models.pop(name, None)
+
+
+def get_model(name):
+    model = _models.get(name)
+    if model is not None:
+        return model
+    if name not in _loaders:
+        raise KeyError(f"No model registered under '{name}'")
+    with _load_locks[name]:
+        model = _models.get(name)
+        if model is None:
+            start = time.perf_counter()
+            model = _loaders[name]()
+            _models[name] = model
+            print(f"[ModelRegistry] Loaded '{name}' in {time.perf_counter() - start:.2f}s")
+    return model
+
+
+def is_loaded(name):
+    return name in _models
+
+
+def loaded_models():
+    return list(_models)
+
+
+def warm_up(names=None):
+    """Load ``names`` now (default: from ``AGENT_WARMUP_MODELS``; ``all`` loads every registered model)."""
+    if names is None:
+        names = [n.strip() for n in os.getenv("AGENT_WARMUP_MODELS", "").split(",") if n.strip()]
+    if "all" in names:
+        names = [n for n in _loaders if ":" not in n]  # variants like embedding:float load on demand
+    for name in names:
+        get_model(name)
+
+
+# ---- Built-in models ----
+
+def embedding_backend_id(backend=None):
+    """Identity of the vector space produced by an embedding backend, e.g. ``all-MiniLM-L6-v2:onnx-int8``."""
+    return f"{EMBEDDING_MODEL_NAME}:{backend or EMBEDDING_BACKEND}"
+
+
+def _load_float_embedding():
+    from chromadb.utils import embedding_functions
+    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)
+
+
+def load_embedding_backend(backend):
+    if backend == "torch":
+        return _load_float_embedding()
+    if backend in ("onnx", "onnx-int8"):
+        from agent.onnx_embedding import OnnxEmbeddingFunction
+        return OnnxEmbeddingFunction(quantize=backend == "onnx-int8")
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (expected torch, onnx or onnx-int8)")
+
+
+def _load_embedding():
+    from agent.model_server import RemoteEmbeddingFunction, use_model_server
+    if use_model_server():
+        return RemoteEmbeddingFunction()
+    return load_embedding_backend(EMBEDDING_BACKEND)
+
+
+def _load_whisper():
+    from agent.model_server import RemoteWhisper, use_model_server
+    if use_model_server():
+        return RemoteWhisper()
+    import whisper
+    return whisper.load_model(WHISPER_MODEL_NAME)
+
+
+register("embedding", _load_embedding)
+register("embedding:float", _load_float_embedding)
+register("whisper", _load_whisper)
+
+
+class LazyEmbeddingFunction(EmbeddingFunction):
+    """
+    Chroma-compatible embedding function that defers to the shared
+    ``embedding`` model, loading it on the first call rather than when a
+    collection is opened.
+
+    It reports itself to Chroma as the ``sentence_transformer`` function the
+    collections were created with (every backend serves the same MiniLM
+    vectors), so opening a collection persisted with that config does not
+    raise an embedding-function conflict.
+    """
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input: Documents):
+        return get_model("embedding")(input)
+
+    @staticmethod
+    def name():
+        return "sentence_transformer"
+
+    def get_config(self):
+        # Same shape SentenceTransformerEmbeddingFunction persists
+        return {"model_name": EMBEDDING_MODEL_NAME, "device": "cpu", "normalize_embeddings": False, "kwargs": {}}
+
+    @staticmethod
+    def build_from_config(config):
+        return get_embedding_function()
+
+
+_embedding_function = LazyEmbeddingFunction()
+
+
+def get_embedding_function():
+    """The one embedding function object every collection in this process should use."""
+    return _embedding_function
+
+
+def get_chroma_client(path):
+    """One ``chromadb.PersistentClient`` per on-disk path, shared across modules."""
+    key = os.path.abspath(path)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = chromadb.PersistentClient(path=path)
+                _clients[key] = client
+    return client
+
+
+class LazyCollection:
+    """
+    Stands in for a Chroma collection and opens it (and its client) on the
+    first attribute access, e.g. ``collection.query(...)``.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self._collection = None
+        self._open_lock = threading.Lock()
+
+    def open(self):
+        if self._collection is None:
+            with self._open_lock:
+                if self._collection is None:
+                    client = get_chroma_client(self.path)
+                    self._collection = client.get_or_create_collection(
+                        name=self.name,
+                        embedding_function=get_embedding_function(),  # type: ignore[arg-type]
+                    )
+        return self._collection
+
+    def is_open(self):
+        return self._collection is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.open(), attr)
+
+
+_collections = {}
+
+
+def get_collection(path, name):
+    """The shared, lazily opened collection ``name`` in the Chroma store at ``path``."""
+    key = (os.path.abspath(path), name)
+    with _lock:
+        collection = _collections.get(key)
+        if collection is None:
+            collection = _collections[key] = LazyCollection(path, name)
+    return collection
+
+
+# ---- Memory footprint ----
+
+def _rss_bytes():
+    """Current resident set size (Linux ``/proc``), falling back to peak RSS elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _weight_bytes(model, depth=0):
+    """Bytes held by a model's parameters and buffers (or ONNX file); unwraps Chroma's wrapper (``_model``)."""
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    path = getattr(model, "path", None)  # ONNX backends: the weights are the model file
+    if isinstance(path, str) and os.path.exists(path):
+        return os.path.getsize(path)
+    inner = getattr(model, "_model", None)
+    if inner is not None and depth < 3:
+        return _weight_bytes(inner, depth + 1)
+    return None
+
+
+def footprint_report():
+    """Loaded models with their weight sizes, shared Chroma clients, and process RSS (in MB)."""
+    mb = 1024 * 1024
+    models = {}
+    for name, model in list(_models.items()):
+        size = _weight_bytes(model)
+        models[name] = {"weights_mb": round(size / mb, 1) if size is not None else None}
+    return {
+        "pid": os.getpid(),
+        "rss_mb": round(_rss_bytes() / mb, 1),
+        "models": models,
+        "chroma_clients": sorted(_clients),
+    }
@@ -0,0 +1,385 @@
+# agent/model_server.py
+"""
+Optional local model server: one sidecar process owns the models and the
+product index, and web workers call it over a UNIX socket.
+
+Every web worker that loads MiniLM, Whisper and the Chroma/NumPy/BM25
+indexes keeps its own copy. With ``MODEL_SERVER_SOCKET`` set, workers load
+none of them: the ``embedding`` and ``whisper`` registry entries become thin
+proxies (``RemoteEmbeddingFunction``, ``RemoteWhisper``),
+``retrieval.retrieve`` forwards the whole lookup, and conversation memory
+writes and recall candidates go through ``memory_write`` /
+``memory_candidates``. Chroma collections open lazily, so a worker on the
+chat path never opens one. Admin-side product sync (``agent.index_sync``)
+still writes the product collection from the process that saved the rows.
+Run the server with::
+
+    MODEL_SERVER_SOCKET=/tmp/agent-models.sock python -m agent.model_server
+
+Wire format, both directions: an 8-byte header ``!II`` (JSON length,
+payload length), a JSON object, then raw bytes (float32 vectors, audio).
+Payloads over ``MODEL_SERVER_SHM_THRESHOLD`` bytes go through a
+``multiprocessing.shared_memory`` block whose name is sent instead; the
+receiver copies it out and unlinks it. The product embedding matrix itself
+is already shared between processes via the memory-mapped snapshot in
+``agent.vector_index``.
+
+Each calling thread keeps one connection. A call is resent on a fresh
+connection only when the old one turns out to be dead (connection reset or
+broken pipe); after a timeout or a short read the connection is dropped and
+the error raised, since the server may already have run the request.
+
+Requests run on ``MODEL_SERVER_WORKERS`` threads. At most
+``MODEL_SERVER_QUEUE_SIZE`` more may wait; beyond that the server answers
+``busy`` immediately and the client raises ``ModelServerBusy`` instead of
+piling up latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "")
+MODEL_SERVER_WORKERS = int(os.getenv("MODEL_SERVER_WORKERS", str(min(4, os.cpu_count() or 1))))
+MODEL_SERVER_QUEUE_SIZE = int(os.getenv("MODEL_SERVER_QUEUE_SIZE", "64"))
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "60"))
+MODEL_SERVER_SHM_THRESHOLD = int(os.getenv("MODEL_SERVER_SHM_THRESHOLD", str(256 * 1024)))
+MODEL_SERVER_PRELOAD = os.getenv("MODEL_SERVER_PRELOAD", "embedding")
+
+_HEADER = struct.Struct("!II")
+
+
+class ModelServerError(RuntimeError):
+    pass
+
+
+class ModelServerBusy(ModelServerError):
+    pass
+
+
+def use_model_server():
+    """True in web workers configured to call the sidecar (never inside the sidecar itself)."""
+    return bool(MODEL_SERVER_SOCKET) and os.environ.get("MODEL_SERVER_ROLE") != "server"
+
+
+# ---- Framing ----
+
+def _to_shared_memory(payload):
+    block = shared_memory.SharedMemory(create=True, size=len(payload))
+    block.buf[:len(payload)] = payload
+    name = block.name
+    # The receiver unlinks it; stop this process's tracker from unlinking it again at exit
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return name
+
+
+def _from_shared_memory(name, size):
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
+
+
+def encode_frame(header, payload=b""):
+    if len(payload) > MODEL_SERVER_SHM_THRESHOLD:
+        header = {**header, "shm": _to_shared_memory(payload), "shm_size": len(payload)}
+        payload = b""
+    body = json.dumps(header).encode("utf-8")
+    return _HEADER.pack(len(body), len(payload)) + body + payload
+
+
+def decode_body(body, payload):
+    header = json.loads(body.decode("utf-8"))
+    if "shm" in header:
+        payload = _from_shared_memory(header.pop("shm"), header.pop("shm_size"))
+    return header, payload
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("model server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _vectors_payload(vectors):
+    matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    return {"shape": list(matrix.shape)}, matrix.tobytes()
+
+
+def _vectors_from(header, payload):
+    return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+
+# ---- Client (web workers) ----
+
+class _StaleConnection(ConnectionResetError):
+    """Reset or broken pipe before any byte of the reply arrived."""
+
+
+class ModelServerClient:
+    """Blocking client with one persistent connection per calling thread."""
+
+    def __init__(self, path=None, timeout=MODEL_SERVER_TIMEOUT):
+        self.path = path or MODEL_SERVER_SOCKET
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self._local.sock = sock
+        return sock
+
+    def _roundtrip(self, sock, frame):
+        try:
+            sock.sendall(frame)
+            first = sock.recv(_HEADER.size)
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise _StaleConnection() from e  # nothing of the reply was read
+        if not first:
+            raise ConnectionError("model server closed the connection")
+        body_len, payload_len = _HEADER.unpack(first + _recv_exact(sock, _HEADER.size - len(first)))
+        body = _recv_exact(sock, body_len)
+        return decode_body(body, _recv_exact(sock, payload_len) if payload_len else b"")
+
+    def _discard(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def call(self, op, payload=b"", **params):
+        frame = encode_frame({"op": op, **params}, payload)
+        sock = getattr(self._local, "sock", None)
+        try:
+            try:
+                header, data = self._roundtrip(sock or self._connect(), frame)
+            except _StaleConnection:
+                # Stale connection (server restarted): reconnect once and resend
+                if sock is None:
+                    raise
+                self._discard()
+                header, data = self._roundtrip(self._connect(), frame)
+        except OSError:
+            # Timeout or short read: a late reply would desync the next call, so never reuse the socket
+            self._discard()
+            raise
+        if header.get("error") == "busy":
+            raise ModelServerBusy(f"model server queue full ({op})")
+        if "error" in header:
+            raise ModelServerError(header["error"])
+        return header, data
+
+    def embed(self, texts):
+        header, data = self.call("embed", texts=list(texts))
+        return _vectors_from(header, data)
+
+    def retrieve(self, user_message, n_results=3, query_emb=None, mode=None):
+        params, payload = _vectors_payload([query_emb]) if query_emb is not None else ({}, b"")
+        header, data = self.call("retrieve", payload, text=user_message, n_results=n_results, mode=mode, **params)
+        query_emb = _vectors_from(header, data)[0] if data else None
+        return query_emb, [tuple(item) for item in header["results"]]
+
+    def transcribe(self, audio_bytes, suffix=".wav", **options):
+        header, _ = self.call("transcribe", audio_bytes, suffix=suffix, options=options)
+        return header["result"]
+
+    def write_memories(self, entries):
+        """``(id, document, metadata, embedding or None)`` entries, as ``memory_manager.write_memories``."""
+        vectors = [entry[3] for entry in entries if entry[3] is not None]
+        params, payload = _vectors_payload(vectors) if vectors else ({}, b"")
+        self.call("memory_write", payload, entries=[[e[0], e[1], e[2], e[3] is not None] for e in entries], **params)
+
+    def memory_candidates(self, session_id, query_emb=None, before=None, n_candidates=20):
+        params, payload = _vectors_payload([query_emb]) if query_emb is not None else ({}, b"")
+        header, _ = self.call("memory_candidates", payload, session_id=session_id, before=before,
+                              n_candidates=n_candidates, **params)
+        return header["ids"], header["docs"], header["metas"], header["sims"]
+
+    def stats(self):
+        return self.call("stats")[0]
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = ModelServerClient()
+    return _client
+
+
+class RemoteEmbeddingFunction:
+    """Stands in for the embedding model in workers; same call signature."""
+
+    def __call__(self, input):
+        return list(get_client().embed(input))
+
+
+class RemoteWhisper:
+    """Stands in for the Whisper model in workers: ``transcribe(path)`` ships the file bytes."""
+
+    def transcribe(self, audio_file_path, **options):
+        with open(audio_file_path, "rb") as f:
+            audio = f.read()
+        return get_client().transcribe(audio, suffix=os.path.splitext(audio_file_path)[1] or ".wav", **options)
+
+
+# ---- Server (sidecar) ----
+
+class ModelServer:
+    def __init__(self, path=MODEL_SERVER_SOCKET, workers=MODEL_SERVER_WORKERS, queue_size=MODEL_SERVER_QUEUE_SIZE):
+        from agent.metrics import Histogram
+
+        self.path = path
+        self.capacity = workers + queue_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-server")
+        self.inflight = 0
+        self.rejected = 0
+        self.handled = {}
+        self.latency_ms = Histogram((1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 5000))
+        self.handlers = {
+            "ping": lambda header, payload: ({"ok": True}, b""),
+            "embed": self.handle_embed,
+            "retrieve": self.handle_retrieve,
+            "transcribe": self.handle_transcribe,
+            "memory_write": self.handle_memory_write,
+            "memory_candidates": self.handle_memory_candidates,
+            "stats": self.handle_stats,
+        }
+
+    def handle_embed(self, header, payload):
+        from agent.embedding_service import embed_query, embedding_fn
+        texts = header["texts"]
+        # Single queries share the server-side cache and micro-batcher across all workers
+        vectors = [embed_query(texts[0])] if len(texts) == 1 else embedding_fn(texts)
+        return _vectors_payload(vectors)
+
+    def handle_retrieve(self, header, payload):
+        from agent.retrieval import retrieve
+        query_emb = _vectors_from(header, payload)[0] if payload else None
+        query_emb, results = retrieve(header["text"], n_results=header.get("n_results", 3),
+                                      query_emb=query_emb, mode=header.get("mode"))
+        out, data = _vectors_payload([query_emb]) if query_emb is not None else ({}, b"")
+        out["results"] = [[doc, meta] for doc, meta in results]
+        return out, data
+
+    def handle_transcribe(self, header, payload):
+        import tempfile
+        from agent.model_registry import get_model
+        with tempfile.NamedTemporaryFile(suffix=header.get("suffix", ".wav"), delete=False) as tmp:
+            tmp.write(payload)
+            path = tmp.name
+        try:
+            result = get_model("whisper").transcribe(path, **header.get("options", {}))
+        finally:
+            os.remove(path)
+        return {"result": {"text": str(result.get("text", ""))}}, b""
+
+    def handle_memory_write(self, header, payload):
+        from agent.memory_manager import write_memories
+        vectors = iter(_vectors_from(header, payload)) if payload else iter(())
+        write_memories([(entry_id, doc, meta, next(vectors) if has_vector else None)
+                        for entry_id, doc, meta, has_vector in header["entries"]])
+        return {"ok": True}, b""
+
+    def handle_memory_candidates(self, header, payload):
+        from agent.memory_manager import memory_candidates
+        query_emb = _vectors_from(header, payload)[0] if payload else None
+        ids, docs, metas, sims = memory_candidates(header["session_id"], query_emb=query_emb,
+                                                   before=header.get("before"),
+                                                   n_candidates=header.get("n_candidates", 20))
+        return {"ids": ids, "docs": docs, "metas": metas, "sims": sims}, b""
+
+    def handle_stats(self, header, payload):
+        from agent.model_registry import footprint_report
+        return {
+            "inflight": self.inflight,
+            "capacity": self.capacity,
+            "rejected": self.rejected,
+            "handled": dict(self.handled),
+            "latency_ms": self.latency_ms.snapshot(),
+            "memory": footprint_report(),
+        }, b""
+
+    def _dispatch(self, header, payload):
+        start = time.perf_counter()
+        op = header.get("op")
+        try:
+            return self.handlers[op](header, payload)
+        except KeyError:
+            return {"error": f"unknown op '{op}'"}, b""
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}, b""
+        finally:
+            self.handled[op] = self.handled.get(op, 0) + 1
+            self.latency_ms.observe((time.perf_counter() - start) * 1000.0)
+
+    async def _serve_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    body_len, payload_len = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                except asyncio.IncompleteReadError:
+                    break
+                body = await reader.readexactly(body_len)
+                payload = await reader.readexactly(payload_len) if payload_len else b""
+                header, payload = decode_body(body, payload)
+                if self.inflight >= self.capacity:
+                    self.rejected += 1
+                    writer.write(encode_frame({"error": "busy"}))
+                else:
+                    self.inflight += 1
+                    try:
+                        out, data = await loop.run_in_executor(self.pool, self._dispatch, header, payload)
+                    finally:
+                        self.inflight -= 1
+                    writer.write(encode_frame(out, data))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._serve_connection, path=self.path)
+        print(f"[ModelServer] Listening on {self.path} (capacity {self.capacity})")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve embed/retrieve/transcribe/memory calls to web workers.")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET or "/tmp/agent-models.sock")
+    parser.add_argument("--workers", type=int, default=MODEL_SERVER_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=MODEL_SERVER_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    os.environ["MODEL_SERVER_ROLE"] = "server"
+    from agent.model_registry import warm_up
+    warm_up([name.strip() for name in MODEL_SERVER_PRELOAD.split(",") if name.strip()])
+
+    asyncio.run(ModelServer(args.socket, args.workers, args.queue_size).serve())
+
+
+if __name__ == "__main__":
+    main()
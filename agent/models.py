@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
@@ -41,8 +42,27 @@ class ChatMessage(models.Model):
     session_id = models.CharField(max_length=100, default="default")
     sender = models.CharField(max_length=50)  # "user" or "agent"
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when save_message is called, not when the write-behind buffer inserts the row
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # History reads filter by session and order by time
+            models.Index(fields=["session_id", "timestamp"], name="chatmsg_session_ts_idx"),
+        ]
 
     def __str__(self):
         return f"[{self.session_id}] {self.sender}: {self.message[:50]}"
 
+
+
+class ConversationSummary(models.Model):
+    """Rolling summary of the turns of a session that no longer fit in the prompt."""
+    session_id = models.CharField(max_length=100, unique=True)
+    summary = models.TextField(blank=True, default="")
+    last_message_id = models.BigIntegerField(default=0)  # newest ChatMessage folded into the summary
+    folded_messages = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"[{self.session_id}] summary of {self.folded_messages} messages"
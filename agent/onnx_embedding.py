@@ -0,0 +1,90 @@
+# agent/onnx_embedding.py
+"""
+ONNX Runtime embedding function for all-MiniLM-L6-v2 on CPU.
+
+Runs the ONNX export of the same model the default backend serves through
+PyTorch, optionally with int8 dynamically-quantized weights. Tokenization
+pads to the longest text in the batch rather than a fixed 256 tokens, so a
+short shopper query costs a short forward pass.
+
+The model files (``model.onnx`` + ``tokenizer.json``) come from
+``EMBEDDING_ONNX_DIR`` if set (e.g. an export made with ``optimum``), else
+from the archive Chroma downloads for its default embedding function. The
+int8 model is written next to the float one on first use
+(``model.int8.onnx``); quantizing needs the ``onnx`` package.
+"""
+import os
+import threading
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction
+
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "")
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # 0 = onnxruntime default
+MAX_TOKENS = 256  # sentence-transformers max_seq_length for this model
+
+_quantize_lock = threading.Lock()
+
+
+def model_dir():
+    """Directory holding ``model.onnx`` and ``tokenizer.json``, downloading Chroma's copy if needed."""
+    if EMBEDDING_ONNX_DIR:
+        return EMBEDDING_ONNX_DIR
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+    default = ONNXMiniLM_L6_V2()
+    default._download_model_if_not_exists()
+    return os.path.join(default.DOWNLOAD_PATH, default.EXTRACTED_FOLDER_NAME)
+
+
+def quantized_model_path(directory):
+    """Path of the int8 model, quantizing ``model.onnx`` once if it does not exist yet."""
+    src = os.path.join(directory, "model.onnx")
+    dst = os.path.join(directory, "model.int8.onnx")
+    with _quantize_lock:
+        if not os.path.exists(dst):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            tmp = f"{dst}.tmp"
+            quantize_dynamic(src, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, dst)
+            print(f"[OnnxEmbedding] Wrote int8 model to {dst}")
+    return dst
+
+
+class OnnxEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, quantize=False, directory=None, threads=EMBEDDING_ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        directory = directory or model_dir()
+        path = quantized_model_path(directory) if quantize else os.path.join(directory, "model.onnx")
+        options = ort.SessionOptions()
+        options.log_severity_level = 3
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.quantize = quantize
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_TOKENS)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")  # pad to the longest in the batch
+
+    def __call__(self, input: Documents):
+        if not input:
+            return []
+        encoded = self.tokenizer.encode_batch(list(input))
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, then L2 normalization (as the sentence-transformers pipeline does)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        norms[norms == 0] = 1e-12
+        return [row for row in (pooled / norms).astype(np.float32)]
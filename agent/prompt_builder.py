@@ -0,0 +1,154 @@
+# agent/prompt_builder.py
+"""
+Chat prompt assembly with per-section token budgets.
+
+The first message is always ``SALES_CHATBOT_PROMPT`` exactly as written, so
+every request starts with the same bytes and providers that cache prompt
+prefixes can reuse it. Everything that changes per turn comes after it, in
+its own message:
+
+1. conversation summary (system)
+2. recalled memory (system)
+3. recent history, one ``user``/``assistant`` message per turn
+4. retrieved products (system)
+5. the current user message
+
+Each section is first cut to its own budget (``PROMPT_*_TOKENS``; history,
+summary and memory reuse ``HISTORY_TOKEN_BUDGET``, ``SUMMARY_TOKEN_BUDGET``
+and ``MEMORY_TOKEN_BUDGET``). If the total still passes
+``PROMPT_TOKEN_BUDGET``, sections are trimmed in ``TRIM_ORDER``, lowest
+priority first: whole pieces are dropped (the oldest memory, summary line or
+turn; the lowest-ranked product line), then the last piece is clipped. The
+static prefix is never trimmed. Token counts are
+``agent.tokens.estimate_tokens`` plus ``MESSAGE_OVERHEAD_TOKENS`` per message.
+"""
+import os
+
+from agent.conversation_summary import HISTORY_TOKEN_BUDGET, SUMMARY_TOKEN_BUDGET
+from agent.memory_manager import MEMORY_TOKEN_BUDGET
+from agent.metrics import Histogram
+from agent.prompts import SALES_CHATBOT_PROMPT
+from agent.tokens import clip_to_tokens, estimate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+PROMPT_PRODUCT_TOKENS = int(os.getenv("PROMPT_PRODUCT_TOKENS", "800"))
+PROMPT_USER_TOKENS = int(os.getenv("PROMPT_USER_TOKENS", "500"))
+# Role and delimiter tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# The current message is clipped, never dropped, when the prompt is over budget
+MIN_USER_TOKENS = 32
+
+SECTION_BUDGETS = {
+    "summary": SUMMARY_TOKEN_BUDGET,
+    "memory": MEMORY_TOKEN_BUDGET,
+    "history": HISTORY_TOKEN_BUDGET,
+    "products": PROMPT_PRODUCT_TOKENS,
+    "user": PROMPT_USER_TOKENS,
+}
+# Trimmed first to last when the whole prompt is over budget
+TRIM_ORDER = ("memory", "summary", "history", "products", "user")
+
+ROLES = {"user": "user", "agent": "assistant"}
+
+PREFIX_TOKENS = estimate_tokens(SALES_CHATBOT_PROMPT) + MESSAGE_OVERHEAD_TOKENS
+
+prompt_tokens = Histogram((500, 1000, 1500, 2000, 2500, 3000, 4000, 6000, 8000))
+
+
+class Section:
+    """
+    One variable part of the prompt, as ``(role, text)`` pieces.
+
+    ``separate`` sections send each piece as its own message (history);
+    the others join their pieces under ``header`` in one message. ``drop``
+    says which end loses pieces first when trimming.
+    """
+
+    def __init__(self, name, pieces, role="system", header="", separate=False, drop="front"):
+        self.name = name
+        self.pieces = [(r, t) for r, t in pieces if t]
+        self.role = role
+        self.header = header
+        self.separate = separate
+        self.drop = drop
+        self.trimmed = False
+
+    def tokens(self):
+        if not self.pieces:
+            return 0
+        if self.separate:
+            return sum(estimate_tokens(t) + MESSAGE_OVERHEAD_TOKENS for _, t in self.pieces)
+        return (estimate_tokens(self.header) + MESSAGE_OVERHEAD_TOKENS
+                + sum(estimate_tokens(t) + 1 for _, t in self.pieces))
+
+    def trim_to(self, budget):
+        """Drop pieces, then clip the one left, until the section fits in ``budget`` (0 empties it)."""
+        while self.pieces and self.tokens() > budget:
+            self.trimmed = True
+            if len(self.pieces) > 1:
+                self.pieces.pop(0 if self.drop == "front" else -1)
+                continue
+            role, text = self.pieces[0]
+            room = budget - (self.tokens() - estimate_tokens(text))
+            if room <= 0:
+                self.pieces = []
+            else:
+                self.pieces = [(role, clip_to_tokens(text, max(1, room - 1)))]  # 1 for the "…"
+                break
+
+    def messages(self):
+        if not self.pieces:
+            return []
+        if self.separate:
+            return [{"role": r, "content": t} for r, t in self.pieces]
+        body = "\n".join(t for _, t in self.pieces)
+        return [{"role": self.role, "content": f"{self.header}\n{body}" if self.header else body}]
+
+
+def history_pieces(history):
+    """``ChatMessage``-like rows as ``(role, text)``; unknown senders are treated as the user."""
+    return [(ROLES.get(getattr(m, "sender", ""), "user"), getattr(m, "message", "")) for m in history]
+
+
+def build_prompt(user_message, product_context="", history=(), summary="", memory=(),
+                 budgets=None, total_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Returns ``(messages, report)``. ``history`` is the recent turns, oldest
+    first, without the current message; ``memory`` is a list of recalled
+    entries. ``report`` has the estimated ``total_tokens``, the tokens of
+    each section, and the sections that were trimmed.
+    """
+    budgets = {**SECTION_BUDGETS, **(budgets or {})}
+    sections = {
+        "summary": Section("summary", [("system", line) for line in (summary or "").splitlines()],
+                           header="Summary of the conversation so far:"),
+        "memory": Section("memory", [("system", m) for m in memory], header="Earlier in this conversation:"),
+        "history": Section("history", history_pieces(history), separate=True),
+        "products": Section("products", [("system", line) for line in (product_context or "").splitlines()],
+                            header="Products relevant to the customer's message:", drop="back"),
+        "user": Section("user", [("user", user_message)], separate=True),
+    }
+    for name, section in sections.items():
+        section.trim_to(budgets[name])
+
+    total = PREFIX_TOKENS + sum(s.tokens() for s in sections.values())
+    for name in TRIM_ORDER:
+        if total <= total_budget:
+            break
+        section = sections[name]
+        before = section.tokens()
+        floor = MIN_USER_TOKENS if name == "user" else 0
+        section.trim_to(max(floor, before - (total - total_budget)))
+        total -= before - section.tokens()
+
+    messages = [{"role": "system", "content": SALES_CHATBOT_PROMPT}]
+    for name in ("summary", "memory", "history", "products", "user"):
+        messages += sections[name].messages()
+    report = {
+        "total_tokens": total,
+        "prefix_tokens": PREFIX_TOKENS,
+        "sections": {name: s.tokens() for name, s in sections.items()},
+        "trimmed": [name for name, s in sections.items() if s.trimmed],
+    }
+    prompt_tokens.observe(total)
+    return messages, report
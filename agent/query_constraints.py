@@ -0,0 +1,203 @@
+# agent/query_constraints.py
+"""
+Rule-based extraction of hard constraints from a shopper's message.
+
+"gaming laptop under $1000" or "monitors with 144Hz" carry filters the
+vector search cannot enforce by similarity alone. ``parse_constraints``
+pulls out the product category (the nine categories in ``prompts.py``), a
+price range and numeric spec bounds, using regexes only, in microseconds.
+
+Category, price and spec bounds become a Chroma ``where`` clause
+(``to_where``) over the normalized numeric metadata written at ingestion
+(``agent.specs``), and the same bounds are re-checked on candidates
+(``matches``) for indexes built before that metadata existed.
+
+Superlatives ("cheapest", "fastest SSD", "most RAM") set ``rank_by``: the
+answer is a sort over ``agent.spec_index``, not a similarity search.
+"""
+import re
+from dataclasses import dataclass, field
+
+from agent.specs import spec_value
+
+# Category -> phrases that name it. Ambiguous words ("display", "switch") are left out.
+CATEGORY_SYNONYMS = {
+    "Laptops": ("laptop", "laptops", "notebook", "notebooks", "ultrabook", "macbook"),
+    "Desktops": ("desktop", "desktops", "gaming pc", "tower pc", "pc tower", "workstation"),
+    "Monitors": ("monitor", "monitors", "screen", "screens"),
+    "Keyboards": ("keyboard", "keyboards"),
+    "Mice": ("mouse", "mice"),
+    "Graphics Cards": ("graphics card", "graphics cards", "gpu", "gpus", "video card", "video cards"),
+    "Storage Devices": ("ssd", "ssds", "hdd", "hdds", "hard drive", "hard drives", "nvme", "storage device"),
+    "Networking Equipment": ("router", "routers", "network switch", "networking", "wifi", "wi-fi", "modem"),
+    "Accessories": ("accessory", "accessories", "cable", "cables", "case fan", "cpu cooler"),
+}
+_CATEGORY_PATTERNS = [
+    (category, re.compile(r"\b(?:" + "|".join(re.escape(s) for s in synonyms) + r")\b"))
+    for category, synonyms in CATEGORY_SYNONYMS.items()
+]
+
+_NUM = r"(\d+(?:[.,]\d+)*)(?![.,]?\d)\s*(k)?"
+_MONEY = r"(?:\$|usd\s*)?\s*" + _NUM + r"\s*(?:\$|usd|dollars?|bucks)?"
+_UNIT_AHEAD = r"(?![\s-]*(?:gb|tb|mb|hz|dpi|inch|\"|mm))"
+
+_PRICE_RANGE_RE = re.compile(r"(?:between|from)\s+" + _MONEY + r"\s*(?:and|to|-)\s*" + _MONEY + _UNIT_AHEAD)
+_PRICE_DASH_RE = re.compile(r"\$\s*" + _NUM + r"\s*(?:-|to)\s*\$?\s*" + _NUM + _UNIT_AHEAD)
+_PRICE_MAX_RE = re.compile(
+    r"(?:under|below|less than|cheaper than|up to|at most|max(?:imum)?|within|budget(?: of| is)?|<=?)\s*"
+    + _MONEY + _UNIT_AHEAD)
+_PRICE_MIN_RE = re.compile(
+    r"(?:over|above|more than|at least|min(?:imum)?|starting at|>=?)\s*" + _MONEY + _UNIT_AHEAD)
+_PRICE_AROUND_RE = re.compile(r"(?:around|about|approximately|roughly|~)\s*" + _MONEY + _UNIT_AHEAD)
+
+# Spec units -> metadata field they bound. GB is resolved to memory or storage by context.
+_SPEC_RE = re.compile(
+    r"(?:(at least|minimum|min|over|above|more than|under|below|less than|at most|up to|max)\s+)?"
+    r"(\d+(?:\.\d+)?)[\s-]*(tb|gb|hz|dpi|mb/s|inch|\")"
+)
+_STORAGE_HINT = re.compile(r"\b(ssd|hdd|nvme|storage|drive|capacity|disk)\b")
+_MEMORY_HINT = re.compile(r"\b(ram|memory|ddr\d?)\b")
+_UPPER_WORDS = {"under", "below", "less than", "at most", "up to", "max"}
+
+# Superlative phrase -> (spec field, descending). First match wins, so specific phrases come first.
+_RANKINGS = [
+    (re.compile(r"\b(?:fastest|highest|best|quickest)\s+write\b"), ("write_speed_mbs", True)),
+    (re.compile(r"\b(?:fastest|highest|best)\s+refresh\b|\bhighest\s+hz\b"), ("refresh_rate_hz", True)),
+    (re.compile(r"\b(?:highest|most)\s+dpi\b"), ("dpi", True)),
+    (re.compile(r"\b(?:most|highest|biggest|largest|max(?:imum)?)\s+(?:ram|memory)\b"), ("memory_gb", True)),
+    (re.compile(r"\b(?:most|biggest|largest|highest)\s+(?:storage|capacity|space)\b"), ("storage_gb", True)),
+    (re.compile(r"\b(?:fastest|quickest)\s+(?:ssd|ssds|nvme|drive|drives|storage|read)\b"), ("read_speed_mbs", True)),
+    (re.compile(r"\b(?:biggest|largest)\s+(?:screen|monitor|display)\b"), ("size_inch", True)),
+    (re.compile(r"\b(?:smallest)\s+(?:screen|monitor|display)\b"), ("size_inch", False)),
+    (re.compile(r"\b(?:cheapest|least expensive|lowest price[ds]?|most affordable)\b"), ("price", False)),
+    (re.compile(r"\b(?:most expensive|priciest|highest price[ds]?)\b"), ("price", True)),
+]
+
+
+@dataclass
+class Constraints:
+    categories: list = field(default_factory=list)
+    price_min: float = None
+    price_max: float = None
+    specs: dict = field(default_factory=dict)  # field -> (min or None, max or None)
+    rank_by: tuple = None                       # (field, descending) for superlative queries
+
+    def __bool__(self):
+        return bool(self.categories or self.price_min is not None or self.price_max is not None or self.specs)
+
+    def category_only(self):
+        """Looser fallback: keep the category, drop price and spec bounds."""
+        return Constraints(categories=list(self.categories))
+
+    def to_where(self):
+        """Chroma ``where`` clause for category, price and spec bounds, or None."""
+        clauses = []
+        if len(self.categories) == 1:
+            clauses.append({"category": self.categories[0]})
+        elif self.categories:
+            clauses.append({"category": {"$in": list(self.categories)}})
+        if self.price_min is not None:
+            clauses.append({"price": {"$gte": self.price_min}})
+        if self.price_max is not None:
+            clauses.append({"price": {"$lte": self.price_max}})
+        for name, (lo, hi) in self.specs.items():
+            if lo is not None:
+                clauses.append({name: {"$gte": lo}})
+            if hi is not None:
+                clauses.append({name: {"$lte": hi}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def matches(self, meta):
+        """Whether one product's metadata satisfies every constraint (missing specs fail spec bounds)."""
+        meta = meta or {}
+        if self.categories and meta.get("category") not in self.categories:
+            return False
+        price = _as_float(meta.get("price"))
+        if self.price_min is not None and (price is None or price < self.price_min):
+            return False
+        if self.price_max is not None and (price is None or price > self.price_max):
+            return False
+        for name, (lo, hi) in self.specs.items():
+            value = spec_value(meta, name)
+            if value is None or (lo is not None and value < lo) or (hi is not None and value > hi):
+                return False
+        return True
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _money(number, k_suffix):
+    value = float(number.replace(",", ""))
+    return value * 1000 if k_suffix else value
+
+
+def _spec_field(unit, value, text):
+    if unit in ("hz",):
+        return "refresh_rate_hz"
+    if unit == "dpi":
+        return "dpi"
+    if unit == "mb/s":  # megabytes; "Mbps" is a network rate and matches no spec field
+        return "read_speed_mbs"
+    if unit in ("inch", '"'):
+        return "size_inch"
+    if _STORAGE_HINT.search(text) or unit == "tb":
+        return "storage_gb"
+    if _MEMORY_HINT.search(text):
+        return "memory_gb"
+    return "storage_gb" if value >= 128 else "memory_gb"
+
+
+def parse_constraints(message):
+    text = message.lower()
+    c = Constraints()
+
+    for category, pattern in _CATEGORY_PATTERNS:
+        if pattern.search(text):
+            c.categories.append(category)
+    # "laptop with a 1TB SSD": storage words alongside another category describe a spec
+    if len(c.categories) > 1 and "Storage Devices" in c.categories:
+        c.categories.remove("Storage Devices")
+
+    m = _PRICE_RANGE_RE.search(text) or _PRICE_DASH_RE.search(text)
+    if m:
+        lo, hi = _money(m.group(1), m.group(2)), _money(m.group(3), m.group(4))
+        c.price_min, c.price_max = min(lo, hi), max(lo, hi)
+    else:
+        m = _PRICE_MAX_RE.search(text)
+        if m:
+            c.price_max = _money(m.group(1), m.group(2))
+        m = _PRICE_MIN_RE.search(text)
+        if m:
+            c.price_min = _money(m.group(1), m.group(2))
+        m = _PRICE_AROUND_RE.search(text)
+        if m and c.price_min is None and c.price_max is None:
+            value = _money(m.group(1), m.group(2))
+            c.price_min, c.price_max = value * 0.8, value * 1.2
+
+    for m in _SPEC_RE.finditer(text):
+        word, number, unit = m.groups()
+        value = float(number)
+        if unit == "tb":
+            value *= 1000
+        # Words right around the number decide RAM vs storage ("16GB RAM and 1TB SSD")
+        name = _spec_field(unit, value, text[max(0, m.start() - 15):m.end() + 15])
+        lo, hi = c.specs.get(name, (None, None))
+        if word in _UPPER_WORDS:
+            hi = value
+        else:
+            lo = value  # "144Hz monitor" means at least 144Hz
+        c.specs[name] = (lo, hi)
+
+    for pattern, ranking in _RANKINGS:
+        if pattern.search(text):
+            c.rank_by = ranking
+            break
+
+    return c
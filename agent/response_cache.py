@@ -0,0 +1,162 @@
+# agent/response_cache.py
+"""
+Semantic cache for LLM replies.
+
+An entry is keyed on the (normalized) query embedding plus the set of product
+ids that retrieval returned for it. A lookup hits when a live entry with the
+same product set has cosine similarity >= ``threshold`` to the new query, so
+"price of MacBook Pro 15" and "how much is the macbook pro" share one reply
+as long as they retrieve the same products. Entries are also indexed by
+normalized query text, so queries answered without an embedding (the
+lexical exact-match path) can still hit on a repeat.
+
+Entries expire after ``ttl`` seconds, the cache holds at most ``max_entries``
+(least recently used evicted first), and everything is dropped when the
+product index version changes (see ``embedding_service.bump_index_version``).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from agent.catalog import product_key
+from agent.embedding_service import current_index_version, normalize_query
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2048"))
+
+
+def product_ids(similar_products):
+    """Stable id set for a retrieval result."""
+    return frozenset(product_key(meta) for _, meta in similar_products)
+
+
+def _normalize(vec):
+    v = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class SemanticResponseCache:
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, version_fn=current_index_version):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._version_fn = version_fn
+        self._version = version_fn()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (vector or None, product_ids, value, created_at, text_key)
+        self._by_products = {}         # product_ids -> set of keys
+        self._by_text = {}             # (normalized text, product_ids) -> key
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        version = self._version_fn()
+        if version != self._version:
+            self._version = version
+            self._clear()
+            self.invalidations += 1
+
+    def _clear(self):
+        self._entries.clear()
+        self._by_products.clear()
+        self._by_text.clear()
+
+    def _drop(self, key):
+        _, ids, _, _, text_key = self._entries.pop(key)
+        keys = self._by_products.get(ids)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_products[ids]
+        if self._by_text.get(text_key) == key:
+            del self._by_text[text_key]
+
+    def _find(self, vec, ids, text_key, now):
+        key = self._by_text.get(text_key)
+        if key is not None:
+            if now - self._entries[key][3] <= self.ttl:
+                return key
+            self._drop(key)
+        if vec is None:
+            return None
+        best_key, best_sim = None, self.threshold
+        for key in list(self._by_products.get(ids, ())):
+            entry_vec, _, _, created_at, _ = self._entries[key]
+            if now - created_at > self.ttl:
+                self._drop(key)
+                continue
+            if entry_vec is None:
+                continue
+            sim = float(np.dot(vec, entry_vec))
+            if sim >= best_sim:
+                best_key, best_sim = key, sim
+        return best_key
+
+    def lookup(self, query_emb, ids, text=None):
+        """Return the cached value for the same or a near-identical query over the same products, or None."""
+        if not ids or (query_emb is None and text is None):
+            return None
+        vec = _normalize(query_emb) if query_emb is not None else None
+        text_key = (normalize_query(text), ids) if text is not None else None
+        now = time.monotonic()
+        with self._lock:
+            self._check_version()
+            best_key = self._find(vec, ids, text_key, now)
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][2]
+
+    def store(self, query_emb, ids, value, text=None):
+        if not ids or (query_emb is None and text is None):
+            return
+        vec = _normalize(query_emb) if query_emb is not None else None
+        text_key = (normalize_query(text), ids) if text is not None else None
+        with self._lock:
+            self._check_version()
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = (vec, ids, value, time.monotonic(), text_key)
+            self._by_products.setdefault(ids, set()).add(key)
+            if text_key is not None:
+                old = self._by_text.get(text_key)
+                if old is not None:
+                    self._drop(old)
+                self._by_text[text_key] = key
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# ---- Process-wide cache used by the chat pipeline ----
+response_cache = SemanticResponseCache()
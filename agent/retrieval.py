@@ -0,0 +1,180 @@
+# agent/retrieval.py
+"""
+Product retrieval backends behind ``query_similar_products_rag``.
+
+``RETRIEVAL_BACKEND`` selects the implementation:
+
+* ``chroma`` (default): HNSW query on the persistent Chroma collection.
+* ``numpy``: brute-force matmul over a memory-mapped snapshot of the same
+  collection (see ``agent.vector_index``), for small and medium catalogs.
+
+Both return a list of ``(document, metadata)`` pairs, best match first.
+
+``RETRIEVAL_MODE=hybrid`` fuses the vector backend with a BM25 index over
+the same documents (``agent.lexical_index``) by reciprocal-rank fusion, and
+answers queries that name a product's exact model without embedding them.
+
+Category, price and spec constraints parsed from the message
+(``agent.query_constraints``, on unless ``QUERY_CONSTRAINTS=0``) are pushed
+into the search: a ``where`` clause for Chroma, a row mask for NumPy, and a
+metadata check on lexical candidates. If nothing qualifies the search is
+repeated with the category alone and then unfiltered, so the LLM still gets
+the closest products.
+
+Superlative queries ("cheapest monitor", "fastest SSD under $200") are
+answered by ``ranked_search``: a sort over the columnar spec index
+(``agent.spec_index``) with the same filters, and no embedding at all.
+
+With ``MODEL_SERVER_SOCKET`` set, ``retrieve`` runs in the model server
+sidecar (``agent.model_server``) and web workers hold no index in memory.
+"""
+import os
+
+from agent.catalog import product_key
+from agent.embedding_service import collection, embed_query
+from agent.model_server import get_client, use_model_server
+from agent.query_constraints import parse_constraints
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Candidates taken from each retriever before fusion, per requested result
+HYBRID_CANDIDATES_PER_RESULT = 5
+QUERY_CONSTRAINTS = os.getenv("QUERY_CONSTRAINTS", "1") == "1"
+# Spec bounds are re-checked after the Chroma query (older indexes lack numeric spec metadata)
+SPEC_FILTER_OVERFETCH = 10
+
+
+def search_chroma(query_emb, n_results=3, constraints=None):
+    where = constraints.to_where() if constraints else None
+    check_specs = bool(constraints and constraints.specs)
+    results = collection.query(
+        query_embeddings=[query_emb],
+        n_results=n_results * SPEC_FILTER_OVERFETCH if check_specs else n_results,
+        where=where,
+        include=['documents', 'metadatas']
+    )
+
+    similar_products = []
+
+    # Ensure results and inner lists exist
+    documents_list = results.get('documents')
+    metadatas_list = results.get('metadatas')
+
+    if documents_list and metadatas_list:
+        docs_list = documents_list[0] if len(documents_list) > 0 and documents_list[0] else []
+        metas_list = metadatas_list[0] if len(metadatas_list) > 0 and metadatas_list[0] else []
+
+        for doc, meta in zip(docs_list, metas_list):
+            if check_specs and not constraints.matches(meta):
+                continue
+            similar_products.append((doc, meta))
+
+    return similar_products[:n_results]
+
+
+def search_numpy(query_emb, n_results=3, constraints=None):
+    from agent.vector_index import get_numpy_index
+    return get_numpy_index().query(query_emb, n_results=n_results, constraints=constraints)
+
+
+BACKENDS = {
+    "chroma": search_chroma,
+    "numpy": search_numpy,
+}
+
+
+def search_products(query_emb, n_results=3, backend=None, constraints=None):
+    backend = backend or RETRIEVAL_BACKEND
+    try:
+        search = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND '{backend}' (expected one of {sorted(BACKENDS)})")
+    if constraints:
+        # Full constraints, then category only, then unfiltered
+        for attempt in (constraints, constraints.category_only()):
+            if attempt:
+                results = search(query_emb, n_results=n_results, constraints=attempt)
+                if results:
+                    return results
+    return search(query_emb, n_results=n_results)
+
+
+def reciprocal_rank_fusion(rankings, n_results, k=RRF_K):
+    """Fuse ranked ``(document, metadata)`` lists: score = sum of 1 / (k + rank) per list."""
+    scores, items = {}, {}
+    for ranking in rankings:
+        for rank, (doc, meta) in enumerate(ranking, start=1):
+            key = product_key(meta)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(key, (doc, meta))
+    ordered = sorted(scores, key=lambda key: -scores[key])
+    return [items[key] for key in ordered[:n_results]]
+
+
+def hybrid_search(user_message, n_results=3, query_emb=None, constraints=None):
+    """
+    Lexical + vector retrieval. Returns ``(query_emb, results)``; ``query_emb``
+    is None when an exact model-name match made the embedding unnecessary.
+    Exact matches ignore ``constraints``: the shopper named the product.
+    """
+    from agent.lexical_index import get_lexical_index
+    lexical = get_lexical_index()
+
+    exact = lexical.exact_matches(user_message)
+    if exact:
+        return query_emb, lexical.results(exact[:n_results])
+
+    if query_emb is None:
+        query_emb = embed_query(user_message)
+    candidates = max(n_results * HYBRID_CANDIDATES_PER_RESULT, n_results)
+    vector_results = search_products(query_emb, n_results=candidates, constraints=constraints)
+    lexical_idx, _ = lexical.search(user_message, n_results=candidates)
+    lexical_results = lexical.results(lexical_idx)
+    if constraints:
+        lexical_results = [(doc, meta) for doc, meta in lexical_results if constraints.matches(meta)]
+    return query_emb, reciprocal_rank_fusion([vector_results, lexical_results], n_results)
+
+
+def ranked_search(constraints, n_results=3):
+    """Top products by ``constraints.rank_by`` among those matching the filters (category-only fallback)."""
+    from agent.spec_index import get_spec_index
+    index = get_spec_index()
+    name, descending = constraints.rank_by
+    for attempt in (constraints, constraints.category_only()):
+        rows = index.top_n(name, n_results, descending=descending, mask=index.mask_for(attempt))
+        if len(rows):
+            return index.results(rows)
+    return []
+
+
+def needs_query_embedding(user_message, mode=None):
+    """
+    Whether ``retrieve`` will embed ``user_message`` here: not in model-server
+    mode (the sidecar embeds) nor for superlative queries. Hybrid exact matches
+    are not checked, since that scans every product name.
+    """
+    if use_model_server():
+        return False
+    constraints = parse_constraints(user_message) if QUERY_CONSTRAINTS else None
+    return not (constraints is not None and constraints.rank_by)
+
+
+def retrieve(user_message, n_results=3, query_emb=None, mode=None):
+    """
+    Entry point for the chat pipeline. Returns ``(query_emb, results)`` so the
+    caller can reuse the embedding (``None`` if retrieval did not need one).
+    """
+    if use_model_server():
+        return get_client().retrieve(user_message, n_results=n_results, query_emb=query_emb, mode=mode)
+    mode = mode or RETRIEVAL_MODE
+    constraints = parse_constraints(user_message) if QUERY_CONSTRAINTS else None
+    if constraints is not None and constraints.rank_by:
+        ranked = ranked_search(constraints, n_results=n_results)
+        if ranked:
+            return query_emb, ranked
+    if mode == "hybrid":
+        return hybrid_search(user_message, n_results=n_results, query_emb=query_emb, constraints=constraints)
+    if query_emb is None:
+        query_emb = embed_query(user_message)
+    return query_emb, search_products(query_emb, n_results=n_results, constraints=constraints)
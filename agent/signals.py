@@ -0,0 +1,20 @@
+# agent/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from agent.index_sync import index_sync
+from agent.models import Product
+
+
+@receiver(post_save, sender=Product, dispatch_uid="agent.product_saved_index_sync")
+def product_saved(sender, instance, **kwargs):
+    pk = instance.pk
+    # Only queue once the row is committed, so the sync thread reads the new values
+    transaction.on_commit(lambda: index_sync.mark_dirty(pk))
+
+
+@receiver(post_delete, sender=Product, dispatch_uid="agent.product_deleted_index_sync")
+def product_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: index_sync.mark_deleted(pk))
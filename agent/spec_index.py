@@ -0,0 +1,158 @@
+# agent/spec_index.py
+"""
+In-memory columnar index of normalized product specs.
+
+Comparison queries ("fastest SSD", "most RAM under $1500") are sorts and
+range filters, not similarity searches. ``SpecIndex`` keeps one float64
+NumPy column per numeric spec (NaN where a product has none), so filtering
+and top-N over the whole catalog are a few vectorized operations.
+
+The index is built from the product collection and refreshed incrementally
+when the index version changes: only rows whose ``content_hash`` changed
+are re-parsed, and removed products are swap-deleted.
+"""
+import threading
+
+import numpy as np
+
+from agent.embedding_service import collection, current_index_version
+from agent.specs import NUMERIC_FIELDS, spec_value
+
+
+class SpecIndex:
+    """Columnar spec table: one float64 array per numeric field, rows keyed by index id."""
+
+    def __init__(self, version=0):
+        self.version = version
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.hashes = []
+        self.categories = np.empty(0, dtype=object)
+        self.columns = {name: np.empty(0, dtype=np.float64) for name in NUMERIC_FIELDS}
+        self._pos = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _row_values(self, meta):
+        return [np.nan if (v := spec_value(meta, name)) is None else v for name in NUMERIC_FIELDS]
+
+    def upsert(self, doc_id, document, meta):
+        meta = meta or {}
+        values = self._row_values(meta)
+        pos = self._pos.get(doc_id)
+        if pos is None:
+            pos = len(self.ids)
+            self._pos[doc_id] = pos
+            self.ids.append(doc_id)
+            self.documents.append(document)
+            self.metadatas.append(meta)
+            self.hashes.append(meta.get("content_hash"))
+            self.categories = np.append(self.categories, meta.get("category") or "")
+            for name, value in zip(NUMERIC_FIELDS, values):
+                self.columns[name] = np.append(self.columns[name], value)
+            return
+        self.documents[pos] = document
+        self.metadatas[pos] = meta
+        self.hashes[pos] = meta.get("content_hash")
+        self.categories[pos] = meta.get("category") or ""
+        for name, value in zip(NUMERIC_FIELDS, values):
+            self.columns[name][pos] = value
+
+    def remove(self, doc_id):
+        """Swap-remove: the last row takes the removed row's slot."""
+        pos = self._pos.pop(doc_id, None)
+        if pos is None:
+            return
+        last = len(self.ids) - 1
+        if pos != last:
+            moved = self.ids[last]
+            self._pos[moved] = pos
+            for seq in (self.ids, self.documents, self.metadatas, self.hashes):
+                seq[pos] = seq[last]
+            self.categories[pos] = self.categories[last]
+            for col in self.columns.values():
+                col[pos] = col[last]
+        for seq in (self.ids, self.documents, self.metadatas, self.hashes):
+            seq.pop()
+        self.categories = self.categories[:last]
+        for name in self.columns:
+            self.columns[name] = self.columns[name][:last]
+
+    def refresh(self, ids, documents, metadatas):
+        """Sync with a full listing; only rows with a new ``content_hash`` are re-parsed."""
+        seen = set()
+        changed = 0
+        for doc_id, document, meta in zip(ids, documents, metadatas):
+            seen.add(doc_id)
+            pos = self._pos.get(doc_id)
+            digest = (meta or {}).get("content_hash")
+            if pos is not None and digest is not None and self.hashes[pos] == digest:
+                continue
+            self.upsert(doc_id, document, meta)
+            changed += 1
+        removed = [doc_id for doc_id in list(self._pos) if doc_id not in seen]
+        for doc_id in removed:
+            self.remove(doc_id)
+        return changed, len(removed)
+
+    def mask_for(self, constraints):
+        """Boolean row mask for a ``Constraints`` object (NaN never satisfies a bound)."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if constraints is None:
+            return mask
+        if constraints.categories:
+            mask &= np.isin(self.categories, constraints.categories)
+        bounds = [("price", constraints.price_min, constraints.price_max)]
+        bounds += [(name, lo, hi) for name, (lo, hi) in constraints.specs.items()]
+        for name, lo, hi in bounds:
+            col = self.columns[name]
+            if lo is not None:
+                mask &= col >= lo
+            if hi is not None:
+                mask &= col <= hi
+        return mask
+
+    def top_n(self, field, n=3, descending=True, mask=None):
+        """Row indices of the ``n`` products with the highest (or lowest) ``field``, skipping NaN."""
+        col = self.columns[field]
+        valid = ~np.isnan(col)
+        if mask is not None:
+            valid &= mask
+        rows = np.flatnonzero(valid)
+        if not len(rows) or n <= 0:
+            return rows[:0]
+        keys = -col[rows] if descending else col[rows]
+        k = min(n, len(rows))
+        top = rows[np.argpartition(keys, k - 1)[:k]] if k < len(rows) else rows
+        return top[np.argsort(-col[top] if descending else col[top], kind="stable")]
+
+    def value_of(self, doc_id, field):
+        pos = self._pos.get(doc_id)
+        if pos is None:
+            return None
+        value = self.columns[field][pos]
+        return None if np.isnan(value) else float(value)
+
+    def results(self, rows):
+        return [(self.documents[i], self.metadatas[i]) for i in rows]
+
+
+# ---- Process-wide index, refreshed when the product index version changes ----
+_index = SpecIndex(version=None)
+_index_lock = threading.Lock()
+
+
+def get_spec_index():
+    version = current_index_version()
+    if _index.version == version:
+        return _index
+    with _index_lock:
+        if _index.version != version:
+            data = collection.get(include=["documents", "metadatas"])
+            changed, removed = _index.refresh(list(data.get("ids") or []), list(data.get("documents") or []),
+                                              list(data.get("metadatas") or []))
+            _index.version = version
+            print(f"[SpecIndex] {len(_index)} products, {changed} re-parsed, {removed} removed")
+    return _index
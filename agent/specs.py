@@ -0,0 +1,85 @@
+# agent/specs.py
+"""
+Numeric spec normalization.
+
+``Product`` stores every spec as free text ("16GB DDR4", "1TB SSD + 2TB HDD",
+"144Hz", "16000 DPI"). ``normalize_specs`` parses those into typed numbers
+(GB, Hz, DPI, MB/s, inches, price) once, at ingestion; the results are
+written into the vector index metadata under the ``SPEC_FIELDS`` names so
+Chroma ``where`` clauses and ``spec_index.SpecIndex`` can range-filter and
+sort on them without re-parsing text per query.
+"""
+import re
+
+_VALUE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(tb|gb|hz|dpi|mb/s|-inch|inch|\")?", re.IGNORECASE)
+
+# field -> (free-text keys to read, unit the number must carry)
+SPEC_FIELDS = {
+    "memory_gb": (("memory",), "gb"),
+    "storage_gb": (("storage", "capacity"), "gb"),
+    "refresh_rate_hz": (("refresh_rate",), "hz"),
+    "dpi": (("dpi",), "dpi"),
+    "read_speed_mbs": (("read_speed",), "mb/s"),
+    "write_speed_mbs": (("write_speed",), "mb/s"),
+    "size_inch": (("size", "display"), "inch"),
+}
+NUMERIC_FIELDS = tuple(SPEC_FIELDS) + ("price",)
+
+
+def _parse(text, unit):
+    total = None
+    for number, found_unit in _VALUE_RE.findall(str(text)):
+        found_unit = (found_unit or "").lower().lstrip("-").replace('"', "inch")
+        value = float(number)
+        if unit == "gb" and found_unit == "tb":
+            value *= 1000
+        elif found_unit != unit:
+            continue
+        # "1TB SSD + 2TB HDD" -> total capacity
+        total = value if total is None or unit != "gb" else total + value
+    return total
+
+
+def spec_value(meta, name):
+    """
+    Numeric value of spec ``name`` for one product, or None. Reads the
+    normalized field (e.g. ``memory_gb``) if present, else parses the
+    free-text field (e.g. ``memory``). TB is converted to GB.
+    """
+    value = meta.get(name)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if name == "price":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    keys, unit = SPEC_FIELDS[name]
+    for key in keys:
+        text = meta.get(key)
+        if text is None:
+            continue
+        if isinstance(text, (int, float)):
+            return float(text)
+        parsed = _parse(text, unit)
+        if parsed is not None:
+            return parsed
+    return None
+
+
+def product_fields(p):
+    """Plain dict of a product, whether it is a ``products_data`` dict or a ``Product`` row."""
+    if isinstance(p, dict):
+        return p
+    return {f.name: getattr(p, f.name) for f in p._meta.concrete_fields}
+
+
+def normalize_specs(p):
+    """Typed numeric specs of one product (only the fields that parse)."""
+    fields = product_fields(p)
+    out = {}
+    for name in NUMERIC_FIELDS:
+        value = spec_value(fields, name)
+        if value is not None:
+            out[name] = value
+    return out
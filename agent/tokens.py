@@ -0,0 +1,28 @@
+# agent/tokens.py
+"""
+Local token estimate for prompt budgeting, with no tokenizer download.
+
+Counts words and punctuation the way BPE vocabularies roughly split them:
+one token per punctuation mark, one per short word, and one per ~4
+characters of longer words. It tends to overestimate slightly, which is
+the safe direction for a budget.
+"""
+import re
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return sum(max(1, (len(piece) + 3) // 4) for piece in _PIECE_RE.findall(text))
+
+
+def clip_to_tokens(text, max_tokens):
+    """``text`` cut at the last piece that fits in ``max_tokens`` (by ``estimate_tokens``), with "…" if cut."""
+    used = 0
+    for match in _PIECE_RE.finditer(text or ""):
+        used += max(1, (len(match.group()) + 3) // 4)
+        if used > max_tokens:
+            return text[:match.start()].rstrip() + "…"
+    return text or ""
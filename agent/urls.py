@@ -4,5 +4,9 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),  # root of /agent/
     path("chat/", views.chat_api, name="chat_api"),
+    path("chat/async/", views.chat_api_async, name="chat_api_async"),
+    path("chat/stream/", views.chat_stream_api, name="chat_stream_api"),
     path("voice/", views.voice_api, name="voice_api"),
+    path("history/", views.history_api, name="history_api"),
+    path("stats/", views.stats_api, name="stats_api"),
 ]
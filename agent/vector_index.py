@@ -0,0 +1,208 @@
+# agent/vector_index.py
+"""
+In-process NumPy vector index over the product collection.
+
+For catalogs up to tens of thousands of items a brute-force dot product over
+a contiguous matrix beats an HNSW query through Chroma's SQLite-backed
+persistence. Embeddings are L2-normalized and stored as one float32 (or
+float16, ``NUMPY_INDEX_DTYPE``) matrix that is memory-mapped from disk, so
+every worker on a box shares the same page-cache copy.
+
+The on-disk snapshot is exported from Chroma once per index version (see
+``embedding_service.current_index_version``) into its own directory, so a
+re-index never mutates files another process has mapped.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from agent.embedding_service import collection, current_index_version
+from agent.specs import spec_value
+
+NUMPY_INDEX_DIR = os.getenv("NUMPY_INDEX_DIR", "./product_db/numpy_index")
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")
+
+# Rows scored per step when upcasting a float16 matrix, to bound temporary memory
+_FLOAT16_CHUNK = 8192
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _nan_if_none(value):
+    return np.nan if value is None else value
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorIndex:
+    def __init__(self, ids, documents, metadatas, matrix, version=0):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.matrix = matrix
+        self.version = version
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _column(self, name):
+        """Per-row metadata column as a NumPy array, built once per snapshot."""
+        columns = self._columns
+        if name not in columns:
+            if name == "category":
+                columns[name] = np.array([(m or {}).get("category") or "" for m in self.metadatas], dtype=object)
+            elif name == "price":
+                columns[name] = np.array([_as_float((m or {}).get("price")) for m in self.metadatas], dtype=np.float64)
+            else:
+                columns[name] = np.array([_nan_if_none(spec_value(m or {}, name)) for m in self.metadatas],
+                                         dtype=np.float64)
+        return columns[name]
+
+    def mask_for(self, constraints):
+        """Boolean row mask for a ``Constraints`` object (NaN specs never satisfy a bound)."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if constraints.categories:
+            mask &= np.isin(self._column("category"), constraints.categories)
+        bounds = [("price", constraints.price_min, constraints.price_max)]
+        bounds += [(name, lo, hi) for name, (lo, hi) in constraints.specs.items()]
+        for name, lo, hi in bounds:
+            col = self._column(name)
+            if lo is not None:
+                mask &= col >= lo
+            if hi is not None:
+                mask &= col <= hi
+        return mask
+
+    @classmethod
+    def from_collection(cls, source=None, dtype=NUMPY_INDEX_DTYPE, version=None):
+        source = source if source is not None else collection
+        data = source.get(include=["embeddings", "documents", "metadatas"])
+        embeddings = data.get("embeddings")
+        if embeddings is None or len(embeddings) == 0:
+            matrix = np.zeros((0, 0), dtype=dtype)
+        else:
+            matrix = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        return cls(
+            ids=list(data.get("ids") or []),
+            documents=list(data.get("documents") or []),
+            metadatas=list(data.get("metadatas") or []),
+            matrix=np.ascontiguousarray(matrix, dtype=dtype),
+            version=current_index_version() if version is None else version,
+        )
+
+    def save(self, path):
+        """Write ``embeddings.npy`` + ``meta.json`` into a fresh directory ``path``."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "embeddings.npy"), self.matrix)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"version": self.version, "ids": self.ids,
+                       "documents": self.documents, "metadatas": self.metadatas}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        return cls(meta["ids"], meta["documents"], meta["metadatas"], matrix, meta["version"])
+
+    def scores(self, query_emb):
+        q = np.asarray(query_emb, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm:
+            q = q / norm
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ q
+        out = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), _FLOAT16_CHUNK):
+            block = self.matrix[start:start + _FLOAT16_CHUNK]
+            out[start:start + len(block)] = block.astype(np.float32) @ q
+        return out
+
+    def top_k(self, query_emb, n_results, mask=None):
+        """Indices and scores of the ``n_results`` best rows (optionally restricted to ``mask``)."""
+        if not len(self.ids) or n_results <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.scores(query_emb)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            available = int(np.count_nonzero(mask))
+        else:
+            available = len(scores)
+        k = min(n_results, available)
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if k < len(scores):
+            idx = np.argpartition(-scores, k - 1)[:k]
+        else:
+            idx = np.arange(len(scores))
+        idx = idx[np.argsort(-scores[idx], kind="stable")][:k]
+        return idx, scores[idx]
+
+    def query(self, query_emb, n_results=3, mask=None, constraints=None):
+        """Same shape as ``query_similar_products_rag``: a list of ``(document, metadata)``."""
+        if constraints:
+            mask = self.mask_for(constraints) if mask is None else mask & self.mask_for(constraints)
+        idx, _ = self.top_k(query_emb, n_results, mask=mask)
+        return [(self.documents[i], self.metadatas[i]) for i in idx]
+
+
+# ---- Process-wide snapshot, reloaded when the index version changes ----
+_index = None
+_index_lock = threading.Lock()
+
+
+def _snapshot_dir(version):
+    return os.path.join(NUMPY_INDEX_DIR, f"v{version}-{NUMPY_INDEX_DTYPE}")
+
+
+def _export_snapshot(version):
+    """Build the snapshot for ``version`` in a temp dir and rename it into place."""
+    os.makedirs(NUMPY_INDEX_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=NUMPY_INDEX_DIR, prefix=".building-")
+    try:
+        NumpyVectorIndex.from_collection(version=version).save(tmp_dir)
+        try:
+            os.rename(tmp_dir, _snapshot_dir(version))
+        except OSError:
+            pass  # another worker exported this version first
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    _prune_snapshots(keep=_snapshot_dir(version))
+
+
+def _prune_snapshots(keep):
+    for name in os.listdir(NUMPY_INDEX_DIR):
+        path = os.path.join(NUMPY_INDEX_DIR, name)
+        if path != keep and not name.startswith(".") and os.path.isdir(path):
+            # Safe on POSIX: processes that still map the old files keep their pages
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_numpy_index():
+    """The current snapshot, exporting it from Chroma first if this version has none yet."""
+    global _index
+    version = current_index_version()
+    if _index is not None and _index.version == version:
+        return _index
+    with _index_lock:
+        if _index is None or _index.version != version:
+            path = _snapshot_dir(version)
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                _export_snapshot(version)
+            _index = NumpyVectorIndex.load(path)
+            print(f"[VectorIndex] Loaded {len(_index)} vectors ({NUMPY_INDEX_DTYPE}) for index version {version}")
+    return _index
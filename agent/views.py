@@ -1,70 +1,77 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from .voice_utils import text_to_speech, speech_to_text
-from agent.casual_responses import casual_responses
-from datetime import datetime
-from agent.embedding_service import collection, embedding_fn
-import pytz
 import os
 import json
 import tempfile
 import base64
-import requests
-import random
 
-from agent.memory_service import save_message, get_history
-from agent.prompts import SALES_CHATBOT_PROMPT
+from agent.chat_pipeline import (
+    arun_chat_turn,
+    astream_chat_turn,
+    fallback_response,
+    query_similar_products_rag,
+    run_chat_turn,
+    serialize_message,
+)
+from agent.embedding_service import embedding_batcher, query_cache
+from agent.history_cache import history_cache
+from agent.message_buffer import message_buffer
+from agent.metrics import StageTimings
+from agent.prompt_builder import prompt_tokens
+from agent.memory_manager import memory_writer
+from agent.memory_service import get_history_page
+from agent.model_server import get_client, use_model_server
+from agent.model_registry import footprint_report
+from agent.response_cache import response_cache
+
+HISTORY_PAGE_MAX = 200
 
-# Pakistan timezone
-PAKISTAN_TZ = pytz.timezone("Asia/Karachi")
 
 def index(request):
     return render(request, "index.html")
 
-def query_similar_products_rag(user_message, n_results=3):
-    """
-    Generate embeddings for the user message and query ChromaDB
-    to retrieve similar products safely.
-    """
-    query_emb = embedding_fn([user_message])[0]
-    results = collection.query(
-        query_embeddings=[query_emb],
-        n_results=n_results,
-        include=['documents', 'metadatas']
-    )
 
-    similar_products = []
+@csrf_exempt
+def chat_api(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=400)
 
-    # Ensure results and inner lists exist
-    documents_list = results.get('documents')
-    metadatas_list = results.get('metadatas')
+    data = json.loads(request.body.decode("utf-8"))
+    user_message = data.get("message", "")
+    session_id = data.get("session_id", "default")
 
-    if documents_list and metadatas_list:
-        docs_list = documents_list[0] if len(documents_list) > 0 and documents_list[0] else []
-        metas_list = metadatas_list[0] if len(metadatas_list) > 0 and metadatas_list[0] else []
+    timings = StageTimings()
+    response = JsonResponse(run_chat_turn(session_id, user_message, timings))
+    response["Server-Timing"] = timings.header()
+    return response
 
-        for doc, meta in zip(docs_list, metas_list):
-            similar_products.append((doc, meta))
 
-    return similar_products
+@csrf_exempt
+async def chat_api_async(request):
+    """Same contract as ``chat_api``; serve under ASGI so slow LLM replies don't pin worker threads."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=400)
 
+    data = json.loads(request.body.decode("utf-8"))
+    user_message = data.get("message", "")
+    session_id = data.get("session_id", "default")
 
+    timings = StageTimings()
+    response = JsonResponse(await arun_chat_turn(session_id, user_message, timings))
+    response["Server-Timing"] = timings.header()
+    return response
 
 
-def fallback_response(user_message):
-    """
-    Simple fallback: try casual responses or generic message
+@csrf_exempt
+async def chat_stream_api(request):
     """
-    lower_msg = user_message.lower()
-    for keyword, response in casual_responses.items():
-        if keyword in lower_msg:
-            return response
-    return "Sorry, I don't have information about that product. Please ask about available products or categories."
-
+    Streaming variant of ``chat_api`` as Server-Sent Events.
 
-@csrf_exempt
-def chat_api(request):
+    Emits ``token`` events as the LLM produces text and a final ``done`` event
+    with ``reply``, ``lead_stage``, ``emotion`` and ``history``.
+    """
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request"}, status=400)
 
@@ -72,77 +79,54 @@ def chat_api(request):
     user_message = data.get("message", "")
     session_id = data.get("session_id", "default")
 
-    save_message(session_id, "user", user_message)
+    response = StreamingHttpResponse(astream_chat_turn(session_id, user_message), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # stop nginx from buffering the stream
+    return response
 
-    reply_text = None
-    lead_stage, emotion = "cold", "neutral"
 
-    # --- Step 1: Use RAG to fetch similar products ---
+def history_api(request):
+    """
+    Cursor-paginated chat history: ``GET ?session_id=...&limit=50`` returns the
+    newest page; pass ``before=<id>`` for older pages or ``since=<id>`` for
+    messages newer than one the client already has. The ``history`` in chat
+    responses can list messages with ``id: null`` (not written yet); page
+    with the ``before``/``since`` ids returned here instead.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request"}, status=400)
     try:
-        similar_products = query_similar_products_rag(user_message, n_results=3)
-        if similar_products:
-            product_context = "\n".join([f"{meta['name']}: {doc}" for doc, meta in similar_products])
-        else:
-            product_context = ""
-    except Exception:
-        product_context = ""
-
-    # --- Step 2: Call LLM if context is available ---
-    GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
-    if GROQ_API_KEY and product_context:
-        try:
-            history = get_history(session_id, limit=5)
-            history_text = "\n".join([f"{getattr(h, 'sender', 'unknown')}: {getattr(h, 'message', '')}" for h in history])
-
-            system_prompt = SALES_CHATBOT_PROMPT.replace("{product_context}", product_context)
-            payload = {
-                "model": "mixtral-8x7b-32768",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message},
-                    {"role": "assistant", "content": history_text}
-                ]
-            }
-            headers = {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"}
-
-            r = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload, timeout=20)
-            resp_json = r.json()
-
-            if "choices" in resp_json:
-                raw_reply = resp_json["choices"][0]["message"]["content"].strip()
-                try:
-                    parsed = json.loads(raw_reply.replace("'", '"'))
-                    reply_text = parsed.get("reply", raw_reply)
-                    lead_stage = parsed.get("lead_stage", "warm")
-                    emotion = parsed.get("emotion", "happy")
-                except json.JSONDecodeError:
-                    reply_text = raw_reply
-
-        except Exception:
-            reply_text = None
-
-    # --- Step 3: Fallback if no LLM or empty context ---
-    if not reply_text:
-        if product_context:
-            # If RAG returned products but LLM failed, list them
-            reply_text = "Here are some products that might match your query:\n"
-            for doc, meta in similar_products:
-                reply_text += f"- {meta['name']} ({meta.get('model', 'N/A')}): ${meta.get('price', 'N/A')}\n"
-        else:
-            # Casual/fallback response
-            reply_text = fallback_response(user_message)
-
-    save_message(session_id, "agent", reply_text)
-
-    history = get_history(session_id, limit=50)
-    history_data = [
-        {"sender": getattr(h, "sender", "unknown"),
-         "message": getattr(h, "message", ""),
-         "timestamp": getattr(h, "timestamp", datetime.now()).astimezone(PAKISTAN_TZ).strftime("%d-%m-%Y %I:%M:%S %p")}
-        for h in history
-    ]
-
-    return JsonResponse({"reply": reply_text, "lead_stage": lead_stage, "emotion": emotion, "history": history_data})
+        limit = max(1, min(int(request.GET.get("limit", 50)), HISTORY_PAGE_MAX))
+        before = int(request.GET["before"]) if request.GET.get("before") else None
+        since = int(request.GET["since"]) if request.GET.get("since") else None
+    except ValueError:
+        return JsonResponse({"error": "limit, before and since must be integers"}, status=400)
+    session_id = request.GET.get("session_id", "default")
+
+    messages, has_more = get_history_page(session_id, limit=limit, before=before, since=since)
+    # Cursors are row ids, so messages that are not written yet (pk None) can't be one
+    ids = [m.pk for m in messages if m.pk is not None]
+    return JsonResponse({
+        "messages": [serialize_message(m) for m in messages],
+        "has_more": has_more,
+        "before": ids[0] if ids else None,    # cursor for the next older page
+        "since": ids[-1] if ids else since,   # cursor for polling newer messages
+    })
+
+
+def stats_api(request):
+    """Process-local cache and batching counters, for tuning thresholds and sizes."""
+    return JsonResponse({
+        "response_cache": response_cache.stats(),
+        "query_embedding_cache": query_cache.stats(),
+        "history_cache": history_cache.stats(),
+        "message_buffer": message_buffer.stats(),
+        "memory_writer": memory_writer.stats(),
+        "prompt_tokens": prompt_tokens.snapshot(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "memory": footprint_report(),
+        "model_server": get_client().stats() if use_model_server() else None,
+    })
 
 
 @csrf_exempt
@@ -151,29 +135,38 @@ def voice_api(request):
         return JsonResponse({"error": "Invalid request"}, status=400)
 
     action = request.GET.get("action", "tts")
+    timings = StageTimings()
 
     if action == "tts":
         data = json.loads(request.body.decode("utf-8"))
         text = data.get("text", "")
-        audio_path = text_to_speech(text)
-        with open(audio_path, "rb") as f:
-            audio_bytes = f.read()
-        os.remove(audio_path)
-        audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
-        return JsonResponse({"audio_base64": audio_base64})
+        with timings.stage("synthesize"):
+            audio_path = text_to_speech(text)
+        with timings.stage("encode"):
+            with open(audio_path, "rb") as f:
+                audio_bytes = f.read()
+            os.remove(audio_path)
+            audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
+        response = JsonResponse({"audio_base64": audio_base64})
+        response["Server-Timing"] = timings.header()
+        return response
 
     elif action == "stt":
         audio_file = request.FILES.get("audio")
         if not audio_file:
             return JsonResponse({"error": "No audio file provided"}, status=400)
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            for chunk in audio_file.chunks():
-                tmp.write(chunk)
-            temp_path = tmp.name
+        with timings.stage("upload"):
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+                for chunk in audio_file.chunks():
+                    tmp.write(chunk)
+                temp_path = tmp.name
 
-        text = speech_to_text(temp_path)
+        with timings.stage("transcribe"):
+            text = speech_to_text(temp_path)
         os.remove(temp_path)
-        return JsonResponse({"text": text})
+        response = JsonResponse({"text": text})
+        response["Server-Timing"] = timings.header()
+        return response
 
     return JsonResponse({"error": "Invalid action. Use ?action=tts or ?action=stt"}, status=400)
@@ -1,17 +1,43 @@
 # agent/voice_utils.py
 import tempfile
 import os
-import whisper
-from gtts import gTTS
+import time
+import wave
+from agent.model_registry import get_model
 
-# Load Whisper model once at module level (base model is small & fast)
-whisper_model = whisper.load_model("base")  # you can change to "small" or "medium" for better accuracy
+# Whisper is loaded by the model registry on the first transcription
+# (WHISPER_MODEL_NAME, default "base"), so text-only workers never load it.
+
+# VOICE_BACKEND=stub answers without gTTS (network) or Whisper, after
+# VOICE_STUB_LATENCY_MS, so load tests can run the voice endpoints offline.
+VOICE_BACKEND = os.getenv("VOICE_BACKEND", "real")
+VOICE_STUB_LATENCY_MS = float(os.getenv("VOICE_STUB_LATENCY_MS", "0"))
+VOICE_STUB_TRANSCRIPT = os.getenv("VOICE_STUB_TRANSCRIPT", "Do you have gaming laptops under 1500 dollars?")
+
+def _stub_wait():
+    if VOICE_STUB_LATENCY_MS > 0:
+        time.sleep(VOICE_STUB_LATENCY_MS / 1000.0)
+
+def _stub_audio(text):
+    """Silent 16 kHz WAV, as long as the text would take to read (~15 chars/sec)."""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
+    with wave.open(temp_file, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(b"\x00\x00" * int(16000 * max(0.5, len(text) / 15.0)))
+    temp_file.close()
+    return temp_file.name
 
 def text_to_speech(text, lang='en'):
     """
     Convert text to speech using gTTS.
     Returns path to the temporary MP3 file.
     """
+    if VOICE_BACKEND == "stub":
+        _stub_wait()
+        return _stub_audio(text)
+    from gtts import gTTS  # imported here so the stub backend runs without it
     tts = gTTS(text=text, lang=lang)
     temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
     tts.save(temp_file.name)
@@ -22,8 +48,11 @@ def speech_to_text(audio_file_path):
     Convert audio file to text using OpenAI Whisper.
     Supports wav, mp3, m4a, etc.
     """
+    if VOICE_BACKEND == "stub":
+        _stub_wait()
+        return VOICE_STUB_TRANSCRIPT
     try:
-        result = whisper_model.transcribe(audio_file_path)
+        result = get_model("whisper").transcribe(audio_file_path)
         text = str(result.get("text", "")).strip()  # force to string to avoid PyLance warning
         if not text:
             return "Sorry, I could not understand the audio."
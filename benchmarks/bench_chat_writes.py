@@ -0,0 +1,113 @@
+# benchmarks/bench_chat_writes.py
+"""
+ChatMessage write throughput with and without the write-behind buffer.
+
+Runs ``--sessions`` concurrent session threads against a throwaway SQLite
+database (never ``db.sqlite3``). Each simulated turn does what a chat view
+does with the database: save the user message, read 5 messages of history,
+save the agent reply, read 50. The LLM and retrieval are left out so the
+numbers isolate persistence. The same workload runs once with synchronous
+``INSERT``s and once through ``message_buffer``. The report gives turns/sec,
+per-turn p50/p99 and the number of flushes.
+
+    python -m benchmarks.bench_chat_writes [--sessions 128] [--turns 20]
+"""
+import argparse
+import os
+import threading
+import time
+
+from benchmarks.bench_history import setup
+
+
+def run(sessions, turns, write_behind, tag):
+    from django.db import close_old_connections
+    from agent import memory_service
+    from agent.history_cache import history_cache
+    from agent.message_buffer import message_buffer
+    from agent.models import ChatMessage
+    from benchmarks.common import summarize
+
+    # The flag is read at call time, so both modes run in one process
+    memory_service.MESSAGE_WRITE_BEHIND = write_behind
+    history_cache.invalidate()
+    flushes_before = message_buffer.flushes
+    latencies = [[] for _ in range(sessions)]
+    errors = []
+    start = threading.Barrier(sessions + 1)
+
+    def worker(i):
+        session_id = f"{tag}-{i}"
+        start.wait()
+        try:
+            for turn in range(turns):
+                t0 = time.perf_counter()
+                memory_service.save_message(session_id, "user", f"question {turn}")
+                memory_service.get_history(session_id, limit=5)
+                memory_service.save_message(session_id, "agent", f"answer {turn}")
+                memory_service.get_history(session_id, limit=50)
+                latencies[i].append(time.perf_counter() - t0)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            close_old_connections()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(sessions)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    message_buffer.flush()
+    drained = time.perf_counter() - t0
+
+    stored = ChatMessage.objects.filter(session_id__startswith=f"{tag}-").count()
+    done = sum(len(l) for l in latencies)
+    return {
+        "write_behind": write_behind,
+        "turns": done,
+        "turns_per_sec": round(done / elapsed, 1),
+        "seconds": round(elapsed, 2),
+        "seconds_until_flushed": round(drained, 2),
+        "turn_latency": summarize([x for l in latencies for x in l]),
+        "flushes": message_buffer.flushes - flushes_before,
+        "stored_messages": stored,
+        "expected_messages": 2 * done,
+        "errors": errors[:5],
+        "error_count": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=128)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--db", default="/tmp/chat_writes_bench.sqlite3")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    setup(args.db)
+    from django.core.management import call_command
+    from benchmarks.common import write_results
+
+    call_command("migrate", "agent", verbosity=0)
+    report = {"sessions": args.sessions, "turns_per_session": args.turns}
+    for name, write_behind in (("sync", False), ("write_behind", True)):
+        report[name] = run(args.sessions, args.turns, write_behind, tag=name)
+        r = report[name]
+        print(f"{name:13s} {r['turns_per_sec']:8.1f} turns/s  p50 {r['turn_latency']['p50_ms']} ms  "
+              f"p99 {r['turn_latency']['p99_ms']} ms  stored {r['stored_messages']}/{r['expected_messages']}  "
+              f"errors {r['error_count']}")
+    if report["sync"]["turns_per_sec"]:
+        report["speedup"] = round(report["write_behind"]["turns_per_sec"] / report["sync"]["turns_per_sec"], 2)
+        print("speedup:", report["speedup"])
+
+    print("Results written to", write_results("chat_writes", report, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_embedding.py
+"""
+Compare embedding backends (PyTorch float, ONNX float, ONNX int8) on the bundled catalog.
+
+For each backend reports single-query latency, batch ingestion throughput,
+and recall@k against the PyTorch float model, both after re-indexing with
+the backend ("reindexed": backend queries vs backend documents) and without
+("mixed": backend queries vs float documents, i.e. an unrebuilt index).
+
+    python -m benchmarks.bench_embedding [--backends torch,onnx,onnx-int8] [--repeat 20] [--k 3]
+"""
+import argparse
+import time
+
+import numpy as np
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(docs, queries, k):
+    return np.argsort(-(queries @ docs.T), axis=1, kind="stable")[:, :k]
+
+
+def _recall(found, expected):
+    return round(float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found.tolist(), expected.tolist())])), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the query set for latency")
+    parser.add_argument("--batch-size", type=int, default=64, help="documents per forward pass for throughput")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    from agent.catalog import catalog_items
+    from agent.embedding_service import DRIFT_QUERIES
+    from agent.model_registry import load_embedding_backend
+    from benchmarks.common import summarize, time_calls, write_results
+
+    items = catalog_items()
+    documents = [document for _, document, _ in items]
+    queries = [meta["name"] for _, _, meta in items] + DRIFT_QUERIES
+
+    reference = load_embedding_backend("torch")
+    float_docs = _normalized(reference(documents))
+    float_top = _top_k(float_docs, _normalized(reference(queries)), args.k)
+
+    report = {"k": args.k, "queries": len(queries), "documents": len(documents), "repeat": args.repeat,
+              "batch_size": args.batch_size, "backends": {}}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            embed = reference if backend == "torch" else load_embedding_backend(backend)
+        except Exception as e:
+            print(f"{backend:>10}: skipped ({e})")
+            report["backends"][backend] = {"error": str(e)}
+            continue
+        embed(queries[:1])  # warm up
+
+        latencies = time_calls(lambda text: embed([text]), [(q,) for q in queries], args.repeat)
+
+        start = time.perf_counter()
+        backend_docs = []
+        for i in range(0, len(documents), args.batch_size):
+            backend_docs.extend(embed(documents[i:i + args.batch_size]))
+        elapsed = time.perf_counter() - start
+        backend_docs = _normalized(backend_docs)
+
+        backend_queries = _normalized(embed(queries))
+        report["backends"][backend] = {
+            "query": summarize(latencies),
+            "ingest_docs_per_sec": round(len(documents) / elapsed, 1) if elapsed > 0 else 0.0,
+            f"recall@{args.k}_reindexed": _recall(_top_k(backend_docs, backend_queries, args.k), float_top),
+            f"recall@{args.k}_mixed": _recall(_top_k(float_docs, backend_queries, args.k), float_top),
+            "max_abs_diff": round(float(np.abs(backend_docs - float_docs).max()), 5),
+        }
+        print(f"{backend:>10}: {report['backends'][backend]}")
+
+    torch_p50 = report["backends"].get("torch", {}).get("query", {}).get("p50_ms")
+    for stats in report["backends"].values():
+        if torch_p50 and "query" in stats and stats["query"]["p50_ms"]:
+            stats["p50_speedup_vs_torch"] = round(torch_p50 / stats["query"]["p50_ms"], 2)
+
+    print("Results written to", write_results("embedding", report, args.output))
+
+
+if __name__ == "__main__":
+    main()
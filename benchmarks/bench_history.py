@@ -0,0 +1,124 @@
+# benchmarks/bench_history.py
+"""
+ChatMessage history latency before and after the (session_id, timestamp) index.
+
+Seeds a throwaway SQLite database (never ``db.sqlite3``) with ``--messages``
+rows spread over ``--sessions`` sessions, migrated to just before the index.
+Then it times the uncached ``get_history`` query and a ``before`` cursor page
+for random sessions. It applies the index migration and times the same
+queries again.
+
+    python -m benchmarks.bench_history [--messages 2000000] [--sessions 20000] [--samples 500]
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import django
+from django.conf import settings
+
+INDEX_MIGRATION = "0007_chatmessage_session_timestamp_index"
+PREVIOUS_MIGRATION = "0006_remove_product_buttons_remove_product_compatibility_and_more"
+
+
+def setup(db_path):
+    # Only the agent app: the benchmark needs its models and migrations, nothing else
+    settings.configure(
+        INSTALLED_APPS=["django.contrib.contenttypes", "agent"],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": db_path}},
+        USE_TZ=True,
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+    )
+    django.setup()
+
+
+def seed(n_messages, n_sessions, chunk=50000):
+    from django.db import connection, transaction
+    table = "agent_chatmessage"
+    start = datetime(2025, 1, 1)  # naive UTC, the format Django stores with USE_TZ on SQLite
+    rng = random.Random(0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(0, n_messages, chunk):
+            rows = []
+            for i in range(offset, min(offset + chunk, n_messages)):
+                # Interleaved sessions, as in production: each session's rows are scattered through the table
+                ts = start + timedelta(seconds=i)
+                rows.append((f"session-{rng.randrange(n_sessions)}", "user" if i % 2 else "agent",
+                             f"message {i}", ts.isoformat(sep=" ")))
+            cursor.executemany(
+                f"INSERT INTO {table} (session_id, sender, message, timestamp) VALUES (%s, %s, %s, %s)", rows)
+            print(f"  seeded {min(offset + chunk, n_messages)}/{n_messages}", end="\r")
+    print()
+
+
+def measure(sessions, samples, limit):
+    from agent.memory_service import get_history_page
+    from agent.models import ChatMessage
+    from benchmarks.common import summarize
+
+    rng = random.Random(1)
+    picks = [rng.choice(sessions) for _ in range(samples)]
+    latest, paged = [], []
+    for session_id in picks:
+        t0 = time.perf_counter()
+        rows = ChatMessage.objects.filter(session_id=session_id).order_by("-timestamp")[:limit][::-1]
+        latest.append(time.perf_counter() - t0)
+        if rows:
+            t0 = time.perf_counter()
+            get_history_page(session_id, limit=limit, before=rows[0].pk)
+            paged.append(time.perf_counter() - t0)
+    return {"get_history": summarize(latest), "before_cursor_page": summarize(paged)}
+
+
+def query_plan(session_id, limit):
+    from django.db import connection
+    from agent.models import ChatMessage
+    sql, params = ChatMessage.objects.filter(session_id=session_id).order_by("-timestamp")[:limit].query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--db", default="/tmp/history_bench.sqlite3")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    setup(args.db)
+    from django.core.management import call_command
+    from benchmarks.common import write_results
+
+    call_command("migrate", "agent", PREVIOUS_MIGRATION, verbosity=0)
+    print(f"Seeding {args.messages} messages over {args.sessions} sessions into {args.db}")
+    t0 = time.perf_counter()
+    seed(args.messages, args.sessions)
+    seed_seconds = time.perf_counter() - t0
+
+    sessions = [f"session-{i}" for i in range(args.sessions)]
+    report = {"messages": args.messages, "sessions": args.sessions, "samples": args.samples, "limit": args.limit,
+              "seed_seconds": round(seed_seconds, 1)}
+
+    report["before"] = {**measure(sessions, args.samples, args.limit), "plan": query_plan(sessions[0], args.limit)}
+    print("before:", report["before"])
+
+    t0 = time.perf_counter()
+    call_command("migrate", "agent", INDEX_MIGRATION, verbosity=0)
+    report["index_build_seconds"] = round(time.perf_counter() - t0, 1)
+
+    report["after"] = {**measure(sessions, args.samples, args.limit), "plan": query_plan(sessions[0], args.limit)}
+    print("after: ", report["after"])
+
+    print("Results written to", write_results("history", report, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_prompt_size.py
+"""
+Prompt size per turn over a long conversation, with the rolling summary.
+
+Plays ``--turns`` turns of a synthetic sales chat into a throwaway SQLite
+database (never ``db.sqlite3``). Replies get longer as the chat goes on,
+the way product comparisons do. For every turn it builds the history part of
+the prompt with ``conversation_summary.history_context`` and assembles it
+with ``prompt_builder.build_prompt``, which reports the estimated size of the
+system prompt, products, summary, recent messages and user message. It also reports how many
+messages are verbatim in the last prompt, how many were folded into the
+summary, and how long building the history took. ``last5`` is the previous
+prompt (the last 5 messages, no summary) for comparison.
+
+    python -m benchmarks.bench_prompt_size [--turns 200] [--mode extractive]
+"""
+import argparse
+import os
+import time
+
+from benchmarks.bench_history import setup
+
+PRODUCT_CONTEXT = "\n".join(
+    f"Product {i}: 16GB RAM, 1TB NVMe SSD, 27 inch 165Hz IPS display, price ${999 + i * 100}" for i in range(3))
+
+
+def user_turn(i):
+    return f"Turn {i}: what about something with more storage under ${1200 + 50 * i}? Does it ship to Lahore?"
+
+
+def agent_turn(i):
+    detail = " It has a 1TB NVMe SSD, 16GB RAM and a 165Hz panel, and ships in 3-5 days." * (1 + i % 4)
+    return f"Here is option {i} for you.{detail}"
+
+
+def run(turns, mode):
+    from agent import conversation_summary
+    from agent.memory_service import save_message
+    from agent.message_buffer import message_buffer
+    from agent.models import ConversationSummary
+    from agent.prompt_builder import build_prompt
+    from agent.prompts import SALES_CHATBOT_PROMPT
+    from agent.tokens import estimate_tokens
+    from benchmarks.common import summarize
+
+    session_id = f"bench-{mode}"
+    system_tokens = estimate_tokens(SALES_CHATBOT_PROMPT.replace("{product_context}", PRODUCT_CONTEXT))
+    sizes, build = [], []
+    conversation_summary.CONVERSATION_SUMMARY = mode != "last5"
+    for i in range(turns):
+        message = user_turn(i)
+        save_message(session_id, "user", message)
+        message_buffer.flush()  # as if the background flush ran between turns
+        t0 = time.perf_counter()
+        summary, recent = conversation_summary.history_context(session_id, mode="extractive" if mode == "last5" else mode)
+        build.append(time.perf_counter() - t0)
+        if mode == "last5":
+            history_text = conversation_summary.render_history(recent)
+            sizes.append(system_tokens + estimate_tokens(history_text) + estimate_tokens(message))
+        else:
+            _, report = build_prompt(message, PRODUCT_CONTEXT, history=recent[:-1], summary=summary)
+            sizes.append(report["total_tokens"])
+        save_message(session_id, "agent", agent_turn(i))
+    conversation_summary.CONVERSATION_SUMMARY = True
+    conversation_summary.summary_executor.submit(lambda: None).result()  # let the background folds land
+
+    record = ConversationSummary.objects.filter(session_id=session_id).first()
+    quarter = max(1, turns // 4)
+    return {
+        "mode": mode,
+        "system_prompt_tokens": system_tokens,
+        "prompt_tokens_first_quarter": round(sum(sizes[:quarter]) / quarter, 1),
+        "prompt_tokens_last_quarter": round(sum(sizes[-quarter:]) / quarter, 1),
+        "prompt_tokens_max": max(sizes),
+        "history_tokens_max": max(sizes) - system_tokens,
+        "recent_messages_last_turn": len(recent),
+        "folded_messages": record.folded_messages if record else 0,
+        "history_build": summarize(build),
+        "prompt_tokens_per_turn": sizes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--mode", default="extractive", choices=["extractive", "llm"],
+                        help="summarizer to measure against the previous last-5-messages prompt")
+    parser.add_argument("--db", default="/tmp/prompt_size_bench.sqlite3")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    setup(args.db)
+    from django.core.management import call_command
+    from benchmarks.common import write_results
+
+    call_command("migrate", "agent", verbosity=0)
+    report = {"turns": args.turns}
+    for mode in ("last5", args.mode):
+        r = report[mode] = run(args.turns, mode)
+        print(f"{mode:10s} prompt tokens first/last quarter {r['prompt_tokens_first_quarter']}/"
+              f"{r['prompt_tokens_last_quarter']}  max {r['prompt_tokens_max']}  "
+              f"recent {r['recent_messages_last_turn']} folded {r['folded_messages']}  build p50 {r['history_build']['p50_ms']} ms")
+
+    print("Results written to", write_results("prompt_size", report, args.output))
+
+
+if __name__ == "__main__":
+    main()
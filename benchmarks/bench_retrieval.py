@@ -0,0 +1,55 @@
+# benchmarks/bench_retrieval.py
+"""
+Compare retrieval backends on the bundled catalog.
+
+Embeds a fixed query set once, then times top-k search per backend and
+reports latency percentiles plus top-k overlap with the Chroma results.
+
+    python -m benchmarks.bench_retrieval [--repeat 200] [--k 3] [--dtype float16]
+"""
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dtype", default=None, help="NumPy index dtype (float32/float16)")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/)")
+    args = parser.parse_args()
+    if args.dtype:
+        os.environ["NUMPY_INDEX_DTYPE"] = args.dtype
+
+    from agent.embedding_service import embed_query
+    from agent.products_data import products
+    from agent.retrieval import BACKENDS
+    from benchmarks.common import summarize, time_calls, write_results
+
+    queries = [p["name"] for p in products] + [
+        "cheap gaming laptop", "monitor with 144Hz", "quiet keyboard", "fast nvme ssd",
+        "wireless mouse for gaming", "router with vpn support", "graphics card under 500",
+    ]
+    embeddings = [embed_query(q) for q in queries]
+
+    def keys(results):
+        return [meta.get("model") for _, meta in results]
+
+    reference = {i: keys(BACKENDS["chroma"](emb, n_results=args.k)) for i, emb in enumerate(embeddings)}
+
+    report = {"k": args.k, "queries": len(queries), "repeat": args.repeat, "backends": {}}
+    for name, search in BACKENDS.items():
+        search(embeddings[0], n_results=args.k)  # load / warm up
+        latencies = time_calls(lambda emb: search(emb, n_results=args.k), [(e,) for e in embeddings], args.repeat)
+        overlap = [
+            len(set(keys(search(emb, n_results=args.k))) & set(reference[i])) / max(1, len(reference[i]))
+            for i, emb in enumerate(embeddings)
+        ]
+        report["backends"][name] = {**summarize(latencies), "overlap_with_chroma": round(sum(overlap) / len(overlap), 4)}
+        print(f"{name:>8}: {report['backends'][name]}")
+
+    print("Results written to", write_results("retrieval", report, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# benchmarks/llm_standin.py
+"""
+Offline stand-in for the Groq (OpenAI-compatible) chat completions API.
+
+Point the app at it to load-test or benchmark the chat path with no network
+and no paid key:
+
+    python -m benchmarks.llm_standin --port 8765 --latency-ms 300 --tokens-per-sec 200
+    GROQ_API_URL=http://127.0.0.1:8765/openai/v1/chat/completions GROQ_API_KEY=offline python manage.py runserver
+
+Any POST whose path ends in ``/chat/completions`` is answered. With
+``"stream": true`` the answer is an SSE stream of one delta per word, ending
+with ``data: [DONE]``, the format ``llm_client.astream_chat_completion``
+reads. Otherwise it is a single JSON body with ``choices`` and ``usage``.
+
+Modes:
+
+* ``synthetic`` (default): the reply is the JSON object the sales prompt
+  asks for (``reply``, ``lead_stage``, ``emotion``), with ``--reply-tokens``
+  words. Timing is ``--latency-ms`` (+- ``--jitter-ms``) to the first token,
+  then ``--tokens-per-sec``. ``--error-rate`` answers that share of requests
+  with ``--error-status``; ``--disconnect-rate`` drops that share of streams
+  halfway. Every random choice is seeded from ``--seed`` and the request
+  itself (its content and how many times it was seen before), so a rerun of
+  the same workload behaves the same even under concurrency.
+* ``record``: forwards each request to ``--upstream`` (the real API, with the
+  caller's ``Authorization`` header) and appends the request, response,
+  status and upstream latency to ``--cassette`` (JSON lines). Streams are
+  fetched whole from upstream and re-streamed to the caller.
+* ``replay``: serves responses from ``--cassette`` by request key (model,
+  messages and parameters; ``stream`` excluded, so either form can be
+  replayed). Repeated keys are served in recorded order, cycling. Timing
+  is the recorded latency, or the synthetic settings with
+  ``--replay-timing configured``. Misses get a 404, or a synthetic answer
+  with ``--replay-miss synthetic``.
+
+``GET /stats`` returns request, error and replay counters; ``GET /health``
+returns ``{"ok": true}``.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+
+from agent.tokens import estimate_tokens
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+            500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+_WORDS = ("this", "laptop", "has", "a", "fast", "processor", "and", "plenty", "of", "memory", "for", "gaming",
+          "editing", "the", "display", "is", "bright", "with", "great", "colors", "it", "ships", "in", "three",
+          "days", "would", "you", "like", "to", "see", "more", "options", "within", "your", "budget")
+
+
+def request_key(payload):
+    """Stable key of a completion request, ignoring ``stream``."""
+    canonical = {k: v for k, v in payload.items() if k != "stream"}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def prompt_tokens(payload):
+    return sum(estimate_tokens(str(m.get("content", ""))) + 4 for m in payload.get("messages", []))
+
+
+def completion_body(payload, content, key):
+    completion_tokens = estimate_tokens(content)
+    usage = {"prompt_tokens": prompt_tokens(payload), "completion_tokens": completion_tokens}
+    usage["total_tokens"] = usage["prompt_tokens"] + completion_tokens
+    return {
+        "id": f"chatcmpl-{key[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "standin"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def chunk_body(payload, key, delta, finish_reason=None):
+    return {
+        "id": f"chatcmpl-{key[:24]}",
+        "object": "chat.completion.chunk",
+        "model": payload.get("model", "standin"),
+        "choices": [{"index": 0, "delta": {"content": delta} if delta else {}, "finish_reason": finish_reason}],
+    }
+
+
+def split_deltas(content):
+    """One delta per word, keeping the whitespace so the joined deltas equal ``content``."""
+    deltas, start = [], 0
+    for i in range(1, len(content)):
+        if content[i] == " " and content[i - 1] != " ":
+            deltas.append(content[start:i])
+            start = i
+    deltas.append(content[start:])
+    return [d for d in deltas if d]
+
+
+class Cassette:
+    """Recorded request/response pairs, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._served = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+        except FileNotFoundError:
+            pass
+        return self
+
+    def __len__(self):
+        return sum(len(v) for v in self._entries.values())
+
+    def next(self, key):
+        """The next recorded entry for ``key`` (cycling through repeats), or None."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            i = self._served.get(key, 0)
+            self._served[key] = i + 1
+            return entries[i % len(entries)]
+
+    def append(self, entry):
+        with self._lock:
+            self._entries.setdefault(entry["key"], []).append(entry)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class StandinServer:
+    def __init__(self, host="127.0.0.1", port=8765, mode="synthetic", latency_ms=300.0, jitter_ms=0.0,
+                 tokens_per_sec=200.0, reply_tokens=60, error_rate=0.0, error_status=503, disconnect_rate=0.0,
+                 seed=0, cassette=None, upstream=None, replay_timing="recorded", replay_miss="error"):
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.disconnect_rate = disconnect_rate
+        self.seed = seed
+        self.cassette = Cassette(cassette).load() if cassette else None
+        self.upstream = upstream
+        self.replay_timing = replay_timing
+        self.replay_miss = replay_miss
+        self._seen = {}
+        self._upstream_client = None
+        self.counters = {"requests": 0, "streams": 0, "errors_injected": 0, "disconnects": 0,
+                         "replay_hits": 0, "replay_misses": 0, "recorded": 0, "upstream_errors": 0}
+
+    # ---- behaviour ----
+
+    def _rng(self, key):
+        n = self._seen.get(key, 0)
+        self._seen[key] = n + 1
+        return random.Random(f"{self.seed}:{key}:{n}")
+
+    def synthetic_content(self, rng):
+        words = [rng.choice(_WORDS) for _ in range(max(1, self.reply_tokens))]
+        reply = " ".join(words).capitalize() + "."
+        return json.dumps({"reply": reply, "lead_stage": rng.choice(("cold", "warm", "hot")), "emotion": "happy"})
+
+    def first_token_delay(self, rng):
+        return max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def token_delay(self):
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    async def answer(self, payload, authorization=""):
+        """``(status, content_or_error_body, first_token_s, token_s, disconnect)`` for one request."""
+        key = request_key(payload)
+        rng = self._rng(key)
+        if self.mode == "replay":
+            entry = self.cassette.next(key)
+            if entry is None:
+                self.counters["replay_misses"] += 1
+                if self.replay_miss != "synthetic":
+                    return 404, {"error": {"message": "no recorded response for this request", "key": key}}, 0, 0, False
+            else:
+                self.counters["replay_hits"] += 1
+                if self.replay_timing == "recorded":
+                    first, per_token = entry["latency_ms"] / 1000.0, 0.0
+                else:
+                    first, per_token = self.first_token_delay(rng), self.token_delay()
+                if entry["status"] != 200:
+                    return entry["status"], entry["response"], first, 0, False
+                return 200, entry["response"]["choices"][0]["message"]["content"], first, per_token, False
+        elif self.mode == "record":
+            return await self.record(payload, key, authorization)
+
+        if rng.random() < self.error_rate:
+            self.counters["errors_injected"] += 1
+            return self.error_status, {"error": {"message": "injected error", "type": "standin"}}, \
+                self.first_token_delay(rng), 0, False
+        disconnect = rng.random() < self.disconnect_rate
+        return 200, self.synthetic_content(rng), self.first_token_delay(rng), self.token_delay(), disconnect
+
+    async def record(self, payload, key, authorization):
+        import httpx
+
+        if self._upstream_client is None:
+            self._upstream_client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+        upstream_payload = {k: v for k, v in payload.items() if k != "stream"}
+        start = time.perf_counter()
+        try:
+            r = await self._upstream_client.post(self.upstream, json=upstream_payload,
+                                                 headers={"Authorization": authorization})
+            status, body = r.status_code, r.json()
+        except Exception as e:
+            self.counters["upstream_errors"] += 1
+            return 502, {"error": {"message": f"upstream failed: {e}"}}, 0, 0, False
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        self.cassette.append({"key": key, "request": upstream_payload, "status": status, "response": body,
+                              "latency_ms": round(latency_ms, 1)})
+        self.counters["recorded"] += 1
+        if status != 200:
+            return status, body, 0, 0, False
+        # Already waited for upstream; relay without adding more delay
+        return 200, body["choices"][0]["message"]["content"], 0, 0, False
+
+    # ---- HTTP ----
+
+    @staticmethod
+    def _head(status, headers):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    def _json_response(self, writer, status, body):
+        data = json.dumps(body).encode()
+        writer.write(self._head(status, {"Content-Type": "application/json", "Content-Length": len(data)}) + data)
+
+    async def _stream(self, writer, payload, key, content, first, per_token, disconnect):
+        def chunk(text):
+            data = text.encode()
+            return f"{len(data):x}\r\n".encode() + data + b"\r\n"
+
+        writer.write(self._head(200, {"Content-Type": "text/event-stream", "Transfer-Encoding": "chunked"}))
+        await asyncio.sleep(first)
+        deltas = split_deltas(content)
+        for i, delta in enumerate(deltas):
+            if disconnect and i >= len(deltas) // 2:
+                self.counters["disconnects"] += 1
+                writer.transport.abort()
+                return False
+            if i and per_token:
+                await asyncio.sleep(per_token)
+            writer.write(chunk(f"data: {json.dumps(chunk_body(payload, key, delta))}\n\n"))
+            await writer.drain()
+        writer.write(chunk(f"data: {json.dumps(chunk_body(payload, key, '', 'stop'))}\n\n"))
+        writer.write(chunk("data: [DONE]\n\n") + b"0\r\n\r\n")
+        return True
+
+    async def handle(self, method, path, headers, body, writer):
+        """Returns False when the connection must be closed."""
+        if method == "GET" and path.rstrip("/") == "/health":
+            self._json_response(writer, 200, {"ok": True})
+            return True
+        if method == "GET" and path.rstrip("/") == "/stats":
+            self._json_response(writer, 200, {"mode": self.mode, **self.counters})
+            return True
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            self._json_response(writer, 404, {"error": {"message": f"no route for {method} {path}"}})
+            return True
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            self._json_response(writer, 400, {"error": {"message": "invalid JSON body"}})
+            return True
+
+        self.counters["requests"] += 1
+        key = request_key(payload)
+        status, content, first, per_token, disconnect = await self.answer(payload, headers.get("authorization", ""))
+        if status != 200:
+            await asyncio.sleep(first)
+            self._json_response(writer, status, content)
+            return True
+        if payload.get("stream"):
+            self.counters["streams"] += 1
+            return await self._stream(writer, payload, key, content, first, per_token, disconnect)
+        await asyncio.sleep(first + per_token * max(0, len(split_deltas(content)) - 1))
+        self._json_response(writer, 200, completion_body(payload, content, key))
+        return True
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, path, _version = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                keep_open = await self.handle(method, path, headers, body, writer)
+                await writer.drain()
+                if not keep_open or headers.get("connection", "").lower() == "close":
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._serve_connection, self.host, self.port, limit=16 * 1024 * 1024)
+        cassette = f", cassette {self.cassette.path} ({len(self.cassette)} entries)" if self.cassette else ""
+        print(f"[LLMStandin] {self.mode} mode on http://{self.host}:{self.port}{cassette}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="0 sends every token at once")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="words in a synthetic reply")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="share of streams dropped halfway")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cassette", default=None, help="JSON lines file for record/replay")
+    parser.add_argument("--upstream", default="https://api.groq.com/openai/v1/chat/completions")
+    parser.add_argument("--replay-timing", choices=["recorded", "configured"], default="recorded")
+    parser.add_argument("--replay-miss", choices=["error", "synthetic"], default="error")
+    args = parser.parse_args()
+    if args.mode in ("record", "replay") and not args.cassette:
+        parser.error(f"--mode {args.mode} needs --cassette")
+
+    server = StandinServer(args.host, args.port, args.mode, args.latency_ms, args.jitter_ms, args.tokens_per_sec,
+                           args.reply_tokens, args.error_rate, args.error_status, args.disconnect_rate, args.seed,
+                           args.cassette, args.upstream, args.replay_timing, args.replay_miss)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# benchmarks/load_test.py
+"""
+End-to-end load test of ``/agent/chat/`` and ``/agent/voice/``.
+
+Runs ``--sessions`` multi-turn sales conversations, ``--concurrency`` at a
+time, against a server over HTTP. Each conversation is built from
+``agent.products_data.products``: it opens on a category, asks about a
+product and its price, sets a budget, compares with another product and asks
+about buying. A ``--voice-ratio`` share of turns goes through voice: speech
+to text (``?action=stt`` with a WAV upload), then the chat turn, then text to
+speech of the reply (``?action=tts``).
+
+The report has throughput (turns and requests per second), errors by
+status, client-side p50/p95/p99 per endpoint and per turn, and server-side
+p50/p95/p99 per pipeline stage. The stages (save_user, retrieve, prompt,
+llm, ..., transcribe, synthesize) come from the ``Server-Timing`` header
+the views send. Results go to ``benchmarks/results/`` as JSON tagged with
+the commit. ``--compare`` prints the change against an earlier result file.
+
+Backends:
+
+* ``--llm standin`` starts ``benchmarks.llm_standin`` in this process
+  (``--llm-latency-ms``, ``--llm-tokens-per-sec``, ``--llm-error-rate``);
+  ``--llm replay --cassette FILE`` replays recorded responses; ``--llm real``
+  leaves the server's ``GROQ_API_URL`` alone.
+* ``--voice stub`` makes the server skip gTTS and Whisper
+  (``VOICE_BACKEND=stub``); ``--voice real`` uses them.
+* ``--spawn`` starts the server with those settings (``manage.py runserver``
+  by default, or ``--server-cmd`` for gunicorn/uvicorn) and stops it at the
+  end. Without ``--spawn``, start ``--url`` yourself with the environment
+  printed at startup.
+
+Embeddings, Chroma and the database are always the server's own.
+
+    python -m benchmarks.load_test --spawn --llm standin --voice stub --sessions 64 --concurrency 16
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --llm real --voice real --concurrency 8
+    python -m benchmarks.load_test --spawn --llm standin --voice stub --compare benchmarks/results/load_test-<commit>-<time>.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import wave
+
+import httpx
+
+from benchmarks.common import summarize, write_results
+
+CITIES = ("Lahore", "Karachi", "Islamabad", "Dubai", "London", "Toronto")
+
+
+# ---- Workload ----
+
+def conversation(rng, products, turns):
+    """``turns`` user messages of one sales conversation, built from the product catalog."""
+    product = rng.choice(products)
+    category = product.get("category") or "products"
+    same_category = [p for p in products if p.get("category") == category and p is not product] or products
+    other = rng.choice(same_category)
+    budget = int(math.ceil(float(product.get("price") or 1000) * rng.uniform(1.0, 1.4) / 100.0)) * 100
+    script = [
+        f"Hi, I'm looking for {category.lower()}. What do you have?",
+        f"Can you tell me more about the {product['name']}?",
+        f"How much does the {product['model']} cost?",
+        f"Do you have any {category.lower()} under ${budget}?",
+        f"How does it compare with the {other['name']}?",
+        f"Which of your {category.lower()} has the most memory?",
+        f"I'd like to buy the {product['name']}. Do you ship to {rng.choice(CITIES)}?",
+        "Great, what are the payment options?",
+    ]
+    return [script[i % len(script)] for i in range(turns)]
+
+
+def tone_wav(seconds=2.0, rate=16000, freq=440.0):
+    """A short 16 kHz mono WAV to upload when no ``--audio`` file is given."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        frames = bytearray()
+        for i in range(int(seconds * rate)):
+            frames += int(8000 * math.sin(2 * math.pi * freq * i / rate)).to_bytes(2, "little", signed=True)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def parse_server_timing(value):
+    """``"retrieve;dur=12.3, llm;dur=840"`` -> ``{"retrieve": 12.3, "llm": 840.0}``."""
+    stages = {}
+    for part in (value or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, dur = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    stages[name] = float(dur)
+                except ValueError:
+                    pass
+    return stages
+
+
+# ---- Runner ----
+
+class LoadTest:
+    def __init__(self, url, sessions, concurrency, turns, voice_ratio, think_ms, timeout, seed, audio):
+        self.url = url.rstrip("/")
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.turns = turns
+        self.voice_ratio = voice_ratio
+        self.think_ms = think_ms
+        self.timeout = timeout
+        self.seed = seed
+        self.audio = audio
+        self.run_id = uuid.uuid4().hex[:8]
+        self.latencies = {}   # endpoint -> [ms]
+        self.stages = {}      # "endpoint.stage" -> [ms]
+        self.errors = {}      # endpoint -> {status: count}
+        self.turn_ms = []
+        self.requests = 0
+
+    def _record(self, endpoint, status, ms, timing=None):
+        self.requests += 1
+        if status == 200:
+            self.latencies.setdefault(endpoint, []).append(ms)
+            for stage, dur in parse_server_timing(timing).items():
+                self.stages.setdefault(f"{endpoint}.{stage}", []).append(dur)
+        else:
+            counts = self.errors.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    async def _call(self, client, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = await client.request(method, self.url + path, **kwargs)
+        except httpx.HTTPError as e:
+            self._record(endpoint, f"exception:{type(e).__name__}", 0)
+            return None
+        self._record(endpoint, r.status_code, (time.perf_counter() - start) * 1000.0, r.headers.get("server-timing"))
+        return r if r.status_code == 200 else None
+
+    async def chat(self, client, session_id, message):
+        r = await self._call(client, "chat", "POST", "/agent/chat/",
+                             json={"session_id": session_id, "message": message})
+        return r.json().get("reply", "") if r is not None else None
+
+    async def voice_turn(self, client, session_id, message):
+        # The uploaded audio is not the message, so the chat turn uses the scripted text
+        await self._call(client, "voice_stt", "POST", "/agent/voice/?action=stt",
+                         files={"audio": ("turn.wav", self.audio, "audio/wav")})
+        reply = await self.chat(client, session_id, message)
+        if reply:
+            await self._call(client, "voice_tts", "POST", "/agent/voice/?action=tts", json={"text": reply})
+
+    async def session(self, client, index, limit):
+        rng = random.Random(f"{self.seed}:{index}")
+        session_id = f"load-{self.run_id}-{index}"
+        async with limit:
+            for message in conversation(rng, self.products, self.turns):
+                start = time.perf_counter()
+                if rng.random() < self.voice_ratio:
+                    await self.voice_turn(client, session_id, message)
+                else:
+                    await self.chat(client, session_id, message)
+                self.turn_ms.append((time.perf_counter() - start) * 1000.0)
+                if self.think_ms:
+                    await asyncio.sleep(rng.uniform(0.5, 1.5) * self.think_ms / 1000.0)
+
+    async def run(self, warmup):
+        from agent.products_data import products
+        self.products = products
+
+        limits = httpx.Limits(max_connections=self.concurrency * 2, max_keepalive_connections=self.concurrency * 2)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            # Warm-up turns load the models and fill caches; they are not part of the report
+            for i in range(warmup):
+                await client.post(self.url + "/agent/chat/",
+                                  json={"session_id": f"load-{self.run_id}-warmup", "message": "Hi, show me laptops"})
+            limit = asyncio.Semaphore(self.concurrency)
+            start = time.perf_counter()
+            await asyncio.gather(*[self.session(client, i, limit) for i in range(self.sessions)])
+            elapsed = time.perf_counter() - start
+            try:
+                server_stats = (await client.get(self.url + "/agent/stats/")).json()
+            except Exception:
+                server_stats = None
+        return elapsed, server_stats
+
+    def report(self, elapsed, server_stats):
+        def ms_summary(values):
+            return summarize([v / 1000.0 for v in values])
+
+        turns = len(self.turn_ms)
+        return {
+            "duration_s": round(elapsed, 2),
+            "turns": turns,
+            "requests": self.requests,
+            "turns_per_sec": round(turns / elapsed, 2) if elapsed else 0.0,
+            "requests_per_sec": round(self.requests / elapsed, 2) if elapsed else 0.0,
+            "error_count": sum(sum(c.values()) for c in self.errors.values()),
+            "errors": self.errors,
+            "turn_latency": ms_summary(self.turn_ms),
+            "latency": {name: ms_summary(values) for name, values in sorted(self.latencies.items())},
+            "stages": {name: ms_summary(values) for name, values in sorted(self.stages.items())},
+            "server_stats": server_stats,
+        }
+
+
+# ---- Backends ----
+
+def start_standin(args):
+    from benchmarks.llm_standin import StandinServer
+
+    mode = "replay" if args.llm == "replay" else "synthetic"
+    server = StandinServer("127.0.0.1", args.llm_port, mode, args.llm_latency_ms, args.llm_jitter_ms,
+                           args.llm_tokens_per_sec, args.llm_reply_tokens, args.llm_error_rate,
+                           seed=args.seed, cassette=args.cassette, replay_miss="synthetic")
+    threading.Thread(target=asyncio.run, args=(server.serve(),), name="llm-standin", daemon=True).start()
+    return server
+
+
+def server_env(args):
+    env = {}
+    if args.llm in ("standin", "replay"):
+        env["GROQ_API_URL"] = f"http://127.0.0.1:{args.llm_port}/openai/v1/chat/completions"
+        env["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY") or "offline"
+    if args.voice == "stub":
+        env["VOICE_BACKEND"] = "stub"
+        env["VOICE_STUB_LATENCY_MS"] = str(args.voice_latency_ms)
+    return env
+
+
+def spawn_server(args, env):
+    host_port = args.url.split("://", 1)[-1].rstrip("/")
+    cmd = shlex.split(args.server_cmd) if args.server_cmd else \
+        [sys.executable, "manage.py", "runserver", "--noreload", host_port]
+    proc = subprocess.Popen(cmd, env={**os.environ, **env})
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Server exited with code {proc.returncode}: {' '.join(cmd)}")
+        try:
+            if httpx.get(args.url.rstrip("/") + "/agent/stats/", timeout=2).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit(f"Server did not answer on {args.url} within {args.startup_timeout}s")
+
+
+def compare(report, baseline_path):
+    """Print p50/p95/p99 and throughput changes against an earlier result file."""
+    with open(baseline_path) as f:
+        base = json.load(f)
+    print(f"\nvs {os.path.basename(baseline_path)} (commit {base.get('commit')}):")
+
+    def line(name, old, new):
+        if not old or not new:
+            return
+        cells = []
+        for q in ("p50_ms", "p95_ms", "p99_ms"):
+            a, b = old.get(q) or 0.0, new.get(q) or 0.0
+            change = f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+            cells.append(f"{q[:3]} {a:.1f}->{b:.1f} ({change})")
+        print(f"  {name:28s} " + "  ".join(cells))
+
+    for key in ("turns_per_sec", "requests_per_sec"):
+        a, b = base.get(key) or 0.0, report.get(key) or 0.0
+        print(f"  {key:28s} {a} -> {b}" + (f" ({(b - a) / a * 100:+.0f}%)" if a else ""))
+    line("turn", base.get("turn_latency"), report.get("turn_latency"))
+    for section in ("latency", "stages"):
+        for name, new in report.get(section, {}).items():
+            line(name, base.get(section, {}).get(name), new)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=6, help="turns per session")
+    parser.add_argument("--voice-ratio", type=float, default=0.2, help="share of turns sent through voice")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a session's turns")
+    parser.add_argument("--warmup", type=int, default=2, help="unreported chat turns before the run")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--audio", default=None, help="WAV file to upload for voice turns (default: a tone)")
+    parser.add_argument("--llm", choices=["standin", "replay", "real"], default="standin")
+    parser.add_argument("--llm-port", type=int, default=8765)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--llm-reply-tokens", type=int, default=60)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--cassette", default=None, help="recorded responses for --llm replay")
+    parser.add_argument("--voice", choices=["stub", "real"], default="stub")
+    parser.add_argument("--voice-latency-ms", type=float, default=0.0, help="stub STT/TTS delay")
+    parser.add_argument("--spawn", action="store_true", help="start the server for the run")
+    parser.add_argument("--server-cmd", default=None, help="command for --spawn (default: manage.py runserver)")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--compare", default=None, help="earlier result JSON to compare against")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/)")
+    args = parser.parse_args()
+    if args.llm == "replay" and not args.cassette:
+        parser.error("--llm replay needs --cassette")
+
+    if args.llm in ("standin", "replay"):
+        start_standin(args)
+    env = server_env(args)
+    proc = None
+    if args.spawn:
+        proc = spawn_server(args, env)
+    elif env:
+        print("Server must run with: " + " ".join(f"{k}={v}" for k, v in env.items()))
+
+    if args.audio:
+        with open(args.audio, "rb") as f:
+            audio = f.read()
+    else:
+        audio = tone_wav()
+    test = LoadTest(args.url, args.sessions, args.concurrency, args.turns, args.voice_ratio, args.think_ms,
+                    args.timeout, args.seed, audio)
+    try:
+        elapsed, server_stats = asyncio.run(test.run(args.warmup))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("compare", "output")}
+    report = {"config": config, **test.report(elapsed, server_stats)}
+    print(f"{report['turns']} turns in {report['duration_s']}s: {report['turns_per_sec']} turns/s, "
+          f"{report['requests_per_sec']} req/s, {report['error_count']} errors")
+    print(f"  {'turn':28s} p50 {report['turn_latency']['p50_ms']}  p95 {report['turn_latency']['p95_ms']}  "
+          f"p99 {report['turn_latency']['p99_ms']} ms")
+    for section in ("latency", "stages"):
+        for name, s in report[section].items():
+            print(f"  {name:28s} p50 {s['p50_ms']}  p95 {s['p95_ms']}  p99 {s['p99_ms']} ms  (n={s['count']})")
+
+    path = write_results("load_test", report, args.output)
+    print("Results written to", path)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,53 @@
 # load_embeddings.py
+import argparse
 import os
 import django
-from typing import List
 
 # IMPORTANT: set settings module before importing Django models
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "website_sale_agent.settings")
 django.setup()
 
 from agent.models import Product
-from agent.embedding_service import collection, embedding_fn
+from agent.catalog import model_items
+from agent.embedding_service import (EMBEDDING_BATCH_SIZE, EMBEDDING_DRIFT_ACTION, check_embedding_drift,
+                                     collection, sync_collection)
 
-def build_product_text_from_model(p: Product) -> str:
-    # Use getattr to avoid static analysis errors and to gracefully handle missing attrs
-    parts = [
-        f"Name: {getattr(p, 'name', '') or ''}",
-        f"Model: {getattr(p, 'model', '') or ''}",
-        f"Category: {getattr(p, 'category', '') or ''}",
-        f"Processor: {getattr(p, 'processor', '') or ''}",
-        f"Memory: {getattr(p, 'memory', '') or ''}",
-        f"Storage: {getattr(p, 'storage', '') or ''}",
-        f"Display: {getattr(p, 'display', '') or ''}",
-        f"Graphics: {getattr(p, 'graphics', '') or ''}",
-        f"Cooling: {getattr(p, 'cooling', '') or ''}",
-        f"Features: {getattr(p, 'features', '') or ''}",
-        f"Price: {getattr(p, 'price', '') or ''}",
-    ]
-    # Remove empty segments and join
-    return " | ".join([seg for seg in parts if seg.split(": ", 1)[1].strip() != ""])
+def check_drift(action):
+    """Compare the index's embedding backend with the configured one (warn, verify recall or reindex)."""
+    try:
+        check_embedding_drift(action)
+    except Exception as e:
+        print("Embedding drift check failed:", e)
 
-def main():
+def main(batch_size=EMBEDDING_BATCH_SIZE, force=False, drift_action=EMBEDDING_DRIFT_ACTION):
     products = Product.objects.all()
     if not products.exists():
         print("❌ No products found in the database. Insert products first (e.g. run your load_products.py).")
         return
 
-    print(f"Found {products.count()} products. Generating embeddings and upserting into ChromaDB...")
-
-    for p in products:
-        # build text for embedding
-        text = build_product_text_from_model(p)
-
-        # generate embedding (embedding_fn expects a list)
-        emb = embedding_fn([text])[0]
-
-        # choose an id for chroma: prefer DB pk if exists, else fallback to model string
-        pk = getattr(p, "pk", None) or getattr(p, "id", None) or getattr(p, "model", None) or str(hash(text))
-
-        collection.upsert(
-            ids=[str(pk)],
-            embeddings=[emb],
-            metadatas=[{
-                "name": getattr(p, "name", ""),
-                "model": getattr(p, "model", ""),
-                "price": getattr(p, "price", "")
-            }],
-            documents=[text]
-        )
+    print(f"Found {products.count()} products. Syncing changed embeddings into ChromaDB...")
 
-        print(f"Embedded and upserted: {getattr(p, 'name', getattr(p, 'model', str(pk)))} (id={pk})")
+    sync_collection(model_items(products.iterator()), source="db", batch_size=batch_size, force=force)
 
     print("All done.")
     try:
         print("Total items in collection:", collection.count())
     except Exception as e:
         print("Could not read collection count:", e)
+    check_drift(drift_action)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Embed Product rows into the ChromaDB product collection.")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE,
+                        help="documents per forward pass / upsert (default: %(default)s)")
+    parser.add_argument("--force", action="store_true",
+                        help="re-embed every product even if its content hash is unchanged")
+    parser.add_argument("--drift-action", choices=["warn", "verify", "reindex", "off"], default=EMBEDDING_DRIFT_ACTION,
+                        help="after syncing, warn about, measure (recall@k vs the float model) or fix "
+                             "an embedding backend mismatch (default: EMBEDDING_DRIFT_ACTION, %(default)s)")
+    parser.add_argument("--drift-only", action="store_true", help="run only the drift check, no sync")
+    args = parser.parse_args()
+    if args.drift_only:
+        check_drift(args.drift_action)
+    else:
+        main(batch_size=args.batch_size, force=args.force, drift_action=args.drift_action)
@@ -0,0 +1,52 @@
+# memory_report.py
+"""
+Print the per-process memory footprint of the agent's models and Chroma clients.
+
+Opens the product collection and then the conversation-memory collection
+(``count()`` on each, since both are opened lazily), runs one embedding
+through each, and reports the RSS measured before and after each step plus
+weight sizes from the shared model registry. Both collections share one
+embedding model, so "embedding" appears once and the memory step should add
+little on top of the product step.
+
+    python memory_report.py [--whisper]
+"""
+import json
+import sys
+
+from agent.model_registry import footprint_report, get_model
+
+
+def main():
+    before = footprint_report()
+
+    from agent import embedding_service, memory_manager
+    embedding_service.collection.count()
+    embedding_service.embedding_fn(["warm-up query"])
+    after_products = footprint_report()
+
+    memory_manager.collection.count()
+    memory_manager.embedding_fn(["warm-up memory"])
+    after_memory = footprint_report()
+
+    if "--whisper" in sys.argv:
+        get_model("whisper")
+
+    after = footprint_report()
+    report = {
+        "rss_before_mb": before["rss_mb"],
+        "rss_after_products_mb": after_products["rss_mb"],
+        "rss_after_memory_mb": after_memory["rss_mb"],
+        "rss_after_mb": after["rss_mb"],
+        "products_step_mb": round(after_products["rss_mb"] - before["rss_mb"], 1),
+        "memory_step_mb": round(after_memory["rss_mb"] - after_products["rss_mb"], 1),
+        "models": after["models"],
+        "chroma_clients": after["chroma_clients"],
+        "shared_embedding_function": embedding_service.embedding_fn is memory_manager.embedding_fn,
+    }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -60,17 +60,72 @@ async function sendMessageToBackend(formData) {
   }
 }
 
+// Parse one SSE frame ("event: x\ndata: {...}") into {event, data}
+function parseSseFrame(frame) {
+  let event = 'message', data = '';
+  frame.split('\n').forEach(line => {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data += line.slice(5).trim();
+  });
+  return { event, data: data ? JSON.parse(data) : {} };
+}
+
+// Stream a text message: tokens are appended to one bubble as they arrive,
+// lead stage / emotion come with the final "done" event.
+async function streamMessageToBackend(text) {
+  const bubble = document.createElement('div');
+  bubble.className = 'message bot';
+  bubble.textContent = 'Sales Agent is typing...';
+  chatEl.appendChild(bubble);
+  let received = false;
+
+  try {
+    const res = await fetch("/agent/chat/stream/", {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ session_id: sessionId, message: text })
+    });
+    if (!res.ok || !res.body) throw new Error('HTTP ' + res.status);
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const frame = parseSseFrame(buffer.slice(0, sep));
+        buffer = buffer.slice(sep + 2);
+
+        if (frame.event === 'token') {
+          if (!received) { bubble.textContent = ''; received = true; }
+          bubble.textContent += frame.data.text;
+          chatEl.scrollTop = chatEl.scrollHeight;
+        } else if (frame.event === 'done') {
+          bubble.textContent = frame.data.reply;
+          setLeadStage(frame.data.lead_stage);
+          setEmotion(frame.data.emotion);
+          debugEl.textContent = JSON.stringify(frame.data.history, null, 2);
+        }
+      }
+    }
+  } catch (err) {
+    console.error(err);
+    bubble.textContent = 'Error contacting server.';
+  }
+}
+
 // Text send
 sendBtn.addEventListener('click', () => {
   const text = inputEl.value.trim();
   if (!text) return;
   addMessage('user', text);
 
-  const formData = new FormData();
-  formData.append('session_id', sessionId);
-  formData.append('message', text);
-
-  sendMessageToBackend(formData);
+  streamMessageToBackend(text);
   inputEl.value = '';
 });
 
@@ -1 +1,15 @@
-# asgi.py placeholder
+"""
+ASGI config for website_sale_agent project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server so the async chat views run on the event loop, e.g.:
+
+    uvicorn website_sale_agent.asgi:application --workers 4
+"""
+
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'website_sale_agent.settings')
+
+application = get_asgi_application()